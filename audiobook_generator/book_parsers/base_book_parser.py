@@ -1,4 +1,4 @@
-from typing import List, Tuple
+from typing import AsyncIterator, Iterator, List, Tuple
 
 from audiobook_generator.config.general_config import GeneralConfig
 
@@ -29,6 +29,15 @@ class BaseBookParser:  # Base interface for books parsers
     def get_chapters(self, break_string) -> List[Tuple[str, str]]:
         raise NotImplementedError
 
+    def count_chapters(self, break_string) -> int:
+        raise NotImplementedError
+
+    def iter_chapters(self, break_string, chapter_start=1, chapter_end=-1) -> Iterator[Tuple[int, str, str]]:
+        raise NotImplementedError
+
+    def aiter_chapters(self, break_string, chapter_start=1, chapter_end=-1, workers=2) -> AsyncIterator[Tuple[int, str, str]]:
+        raise NotImplementedError
+
 
 # Common support methods for all book parsers
 
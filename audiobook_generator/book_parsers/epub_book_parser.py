@@ -1,16 +1,22 @@
+import asyncio
+import html
 import logging
 import regex as re
 import opencc
-# import concurrent.futures
+import concurrent.futures
 import os
 import warnings
+from collections import deque
 
 from bs4 import BeautifulSoup
+from lxml import etree
 import ebooklib
 from ebooklib import epub
 
 from audiobook_generator.book_parsers.base_book_parser import BaseBookParser
+from audiobook_generator.book_parsers.parsed_book_cache import ParsedBookCache
 from audiobook_generator.config.general_config import GeneralConfig
+from audiobook_generator.core.metrics import CACHE_LOOKUPS
 
 logger = logging.getLogger(__name__)
 converter = opencc.OpenCC('t2s')
@@ -23,20 +29,42 @@ class EpubBookParser(BaseBookParser):
     URL_PATTERN = re.compile(
         r"((?:https?|ftps?|gopher|telnet|nntp)://[-%()_.!~*';/?:@&=+$,A-Za-z0-9]+|mailto:[-%()_.!~*';/?:@&=+$,A-Za-z0-9]+|news:[-%()_.!~*';/?:@&=+$,A-Za-z0-9]+)")
     FN_NOTE_PATTERN = re.compile(r'#')
+    # 預掃描用：原始 HTML 中帶 # 的 <a> 標籤（href, 內文）
+    FN_ANCHOR_PATTERN = re.compile(
+        r'<a\s[^>]*?href\s*=\s*["\']([^"\']*#[^"\']*)["\'][^>]*>(.*?)</a\s*>', re.IGNORECASE | re.DOTALL)
+    TAG_PATTERN = re.compile(r'<[^>]+>')
     CHINESE_CHAR_PATTERN = re.compile(r'[\u4e00-\u9fff]')
     # >= 2個任何文字，用於「註1」情況
     TEXT_PATTERN = re.compile(r'\p{L}{2,}', re.UNICODE)
     SYMBOL_PATTERN = r"⤴↑↺⏎"
 
+    # lxml 快速路徑：與 BeautifulSoup.get_text() 一樣不計 script/style/template 內的文字
+    LXML_PARSER = etree.HTMLParser(encoding='utf-8')
+    LXML_TEXT_XPATH = etree.XPath('.//text()[not(ancestor::script or ancestor::style or ancestor::template)]')
+    LXML_HEADING_XPATH = etree.XPath('(//h1|//h2|//h3|//h4|//h5|//h6)[1]')
+    # BeautifulSoup 會把只有空白的字串縮成一個換行或空格（pre/textarea 除外）
+    ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+    PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+
     def __init__(self, config: GeneralConfig):
         super().__init__(config)
 
         logger.setLevel(config.log)
 
-        self.book = epub.read_epub(
-            self.config.input_file, {"ignore_ncx": True})
+        # 書本在需要時才讀取，快取命中時不用解壓整本 EPUB
+        self.book = None
+        self.cache = ParsedBookCache(
+            self.config.parse_cache_dir, self.config.parse_cache_size) if self.config.parse_cache_dir else None
+        self.cache_key = None
+        self.cache_entry = None
 
         self.files = {}
+        self.chapter_count = 0
+        # (文件名, id) -> 註腳內容；文件名 -> 被引用的 id
+        self.fnote_index = None
+        self.fnote_targets = None
+        # 需要改寫註腳的文件，必須使用 soup 路徑
+        self.fnote_files = set()
         self.t2sed = False
 
         if self.config.language == "zh-CN":
@@ -49,8 +77,6 @@ class EpubBookParser(BaseBookParser):
             self.fnote_prefix = " (Note: "
             self.fnote_suffix = " Note End.) "
 
-        self._load_files()
-
     def __str__(self) -> str:
         return super().__str__()
 
@@ -72,45 +98,227 @@ class EpubBookParser(BaseBookParser):
         return chinese_count, english_word_count
 
     def get_book(self):
+        if self.book is None:
+            self.book = epub.read_epub(
+                self.config.input_file, {"ignore_ncx": True})
+            self._load_files()
         return self.book
 
     def get_book_title(self) -> str:
-        if self.book.get_metadata('DC', 'title'):
+        if self.cache_entry:
+            return self.cache_entry.header["book_title"]
+        if self.get_book().get_metadata('DC', 'title'):
             return self.book.get_metadata("DC", "title")[0][0]
         return "Untitled"
 
     def get_book_author(self) -> str:
-        if self.book.get_metadata('DC', 'creator'):
+        if self.cache_entry:
+            return self.cache_entry.header["book_author"]
+        if self.get_book().get_metadata('DC', 'creator'):
             return self.book.get_metadata("DC", "creator")[0][0]
         return "Unknown"
 
     def get_chapters(self, break_string):
+        # 從快取讀出的章節可能不按次序（進程池按完成次序寫入），所以排序
+        return [(title, text) for _, title, text in sorted(self.iter_chapters(break_string))]
+
+    def count_chapters(self, break_string) -> int:
+        """
+        不清理文字，只找出各文件的標題來計算章節總數，用於在合成前檢查章節範圍。
+        有標題的文件才算作章節，lxml 路徑的標題與 soup 路徑相同；快取命中時直接讀取記錄的總數。
+        """
         self.break_string = break_string
-
-        # with concurrent.futures.ThreadPoolExecutor() as executor:
-        #     chapters = list(executor.map(
-        #         self._chapter_process, self.files.items()))
-
-        chapters = [self._chapter_process(item)
-                    for item in self.files.items()]
-
-        chapters = [chapter for chapter in chapters if all(chapter)]
-
-        return chapters
+        if self._open_cache_entry():
+            return self.cache_entry.chapter_count()
+        self._prepare_files()
+        count = 0
+        for item in self.files.values():
+            title, text = self._chapter_extract_lxml(item.get_body_content())
+            if title and text.strip():
+                count += 1
+        return count
+
+    def iter_chapters(self, break_string, chapter_start=1, chapter_end=-1):
+        """ 逐章解析，每次只持有一章的 soup；範圍外的章節只計數，不做文字清理 """
+        self.break_string = break_string
+        self.chapter_count = 0
+
+        if self._open_cache_entry():
+            yield from self._iter_cached_chapters(chapter_start, chapter_end)
+            return
+
+        self._prepare_files()
+        cache_writer = self._cache_writer(chapter_start, chapter_end)
+        try:
+            for file_name in self.files:
+                title, text_soup = self._extract_content(file_name, self.files[file_name].get_body_content())
+
+                # 沒有標題或沒有內容的文件不算作章節
+                if not title or not text_soup.strip():
+                    continue
+
+                self.chapter_count += 1
+                idx = self.chapter_count
+                if idx < chapter_start or (chapter_end != -1 and idx > chapter_end):
+                    continue
+
+                cleaned_text = self._chapter_cleanup(text_soup)
+                if cache_writer:
+                    cache_writer.add(idx, title, cleaned_text)
+                yield idx, title, cleaned_text
+        except BaseException:
+            if cache_writer:
+                cache_writer.abort()
+            raise
+
+        if cache_writer:
+            cache_writer.commit(self.chapter_count)
+
+    async def aiter_chapters(self, break_string, chapter_start=1, chapter_end=-1, workers=2):
+        """ 用進程池平行解析章節（HTML 轉文字、清理、繁轉簡），清理完成的章節按完成次序返回 """
+        self.break_string = break_string
+        self.chapter_count = 0
+
+        if self._open_cache_entry():
+            for chapter in self._iter_cached_chapters(chapter_start, chapter_end):
+                yield chapter
+            return
+
+        self._prepare_files()
+        cache_writer = self._cache_writer(chapter_start, chapter_end)
+        loop = asyncio.get_running_loop()
+        # 同時在進程池中的工作數上限，避免把整本書一次過塞進隊列
+        window = workers * 2
+
+        try:
+            with concurrent.futures.ProcessPoolExecutor(
+                    workers, initializer=_init_chapter_worker, initargs=(self,)) as pool:
+
+                async def cleanup(idx, title, text_soup):
+                    return idx, title, await loop.run_in_executor(pool, _cleanup_chapter_worker, text_soup)
+
+                files = iter(self.files.items())
+                extracting = deque()
+                cleaning = set()
+
+                while True:
+                    while len(extracting) + len(cleaning) < window and (file_item := next(files, None)):
+                        file_name, item = file_item
+                        extracting.append(loop.run_in_executor(
+                            pool, _extract_chapter_worker, file_name, item.get_body_content()))
+
+                    # 章節序號要按書本次序計算，所以只處理隊頭已完成的文件
+                    while extracting and extracting[0].done():
+                        title, text_soup = extracting.popleft().result()
+                        if not title or not text_soup.strip():
+                            continue
+
+                        self.chapter_count += 1
+                        idx = self.chapter_count
+                        if idx < chapter_start or (chapter_end != -1 and idx > chapter_end):
+                            continue
+
+                        cleaning.add(asyncio.ensure_future(cleanup(idx, title, text_soup)))
+
+                    # 所有文件都已送出並處理完畢
+                    if not extracting and not cleaning:
+                        break
+
+                    waiting = (cleaning | {extracting[0]}) if extracting else cleaning
+                    done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+
+                    for future in done & cleaning:
+                        cleaning.remove(future)
+                        chapter = future.result()
+                        if cache_writer:
+                            cache_writer.add(*chapter)
+                        yield chapter
+        except BaseException:
+            if cache_writer:
+                cache_writer.abort()
+            raise
+
+        if cache_writer:
+            cache_writer.commit(self.chapter_count)
+
+    def _prepare_files(self):
+        self.get_book()
+        if (self.config.remove_endnotes or self.config.fnote_transplant) and self.fnote_index is None:
+            self._build_fnote_index()
+
+    def _cache_options(self):
+        """ 所有會影響章節文字的選項 """
+        return {
+            "break_string": self.break_string,
+            "newline_mode": self.config.newline_mode,
+            "fnote_transplant": self.config.fnote_transplant,
+            "remove_endnotes": self.config.remove_endnotes,
+            "language": self.config.language,
+            "t2s": self._needs_t2s(),
+            "test_mode": self.config.test_mode,
+        }
+
+    def _open_cache_entry(self):
+        if not self.cache:
+            return None
+        # count_chapters 和 iter_chapters 都會查快取，EPUB 的雜湊只計算一次
+        if self.cache_key is None:
+            self.cache_key = self.cache.make_key(self.config.input_file, self._cache_options())
+            self.cache_entry = self.cache.open_entry(self.cache_key)
+            CACHE_LOOKUPS.inc(cache="parsed", result="hit" if self.cache_entry else "miss")
+        return self.cache_entry
+
+    def _iter_cached_chapters(self, chapter_start, chapter_end):
+        for idx, title, text in self.cache_entry.iter_chapters():
+            if chapter_start <= idx and (chapter_end == -1 or idx <= chapter_end):
+                yield idx, title, text
+        self.chapter_count = self.cache_entry.header["chapter_count"]
+
+    def _cache_writer(self, chapter_start, chapter_end):
+        # 只有整本書都清理過才能寫入快取
+        if not self.cache or chapter_start != 1 or chapter_end != -1:
+            return None
+        return self.cache.writer(self.cache_key, {
+            "book_title": self.get_book_title(),
+            "book_author": self.get_book_author(),
+        })
+
+    def __getstate__(self):
+        # 傳給子進程時不帶整本書，章節內容另外逐個傳送
+        state = self.__dict__.copy()
+        state['book'] = None
+        state['cache'] = None
+        state['cache_entry'] = None
+        state['files'] = dict.fromkeys(self.files)
+        return state
 
     def _load_files(self):
-        """ 載入所有Epub的內容 """
+        """ 載入所有Epub的內容（只記錄文件，soup 在需要時才建立） """
         # 获取所有html類文件，結果為字典：part0052.html:<EpubHtml:id586:text/part0052.html>
         for doc_id in self.book.spine:
             item = self.book.get_item_with_id(doc_id[0])
             if item.get_type() == ebooklib.ITEM_DOCUMENT:
                 file_name = os.path.basename(item.get_name())
-                content = item.get_body_content()
-                soup = BeautifulSoup(content, 'lxml')
-                # 清理id
-                self._clear_id(soup)
+                self.files[file_name] = item
 
-                self.files[file_name] = soup
+    def _extract_content(self, file_name, content):
+        """ 提取標題和原始文字，不需要改寫註腳的文件可走 lxml 快速路徑 """
+        if self.config.parser_engine == "lxml" and file_name not in self.fnote_files:
+            return self._chapter_extract_lxml(content)
+
+        soup = self._make_soup(content)
+        title, text_soup = self._chapter_extract(file_name, soup)
+        soup.decompose()
+        return title, text_soup
+
+    def _load_soup(self, file_name):
+        return self._make_soup(self.files[file_name].get_body_content())
+
+    def _make_soup(self, content):
+        soup = BeautifulSoup(content, 'lxml')
+        # 清理id
+        self._clear_id(soup)
+        return soup
 
     def _clear_id(self, soup):
         # 去除title 跳轉, 防止目錄跳轉被誤當標籤
@@ -120,9 +328,8 @@ class EpubBookParser(BaseBookParser):
         # 去除 body 的 id，防止被誤當標籤
         soup.find('body').attrs.pop('id', None)
 
-    def _chapter_process(self, file_item):
-        file_name, soup = file_item
-
+    def _chapter_extract(self, file_name, soup):
+        """ 提取標題和原始文字 """
         # 文章標題
         title = self._title_find(file_name, soup)
         if not title:
@@ -131,21 +338,72 @@ class EpubBookParser(BaseBookParser):
         text_soup = soup.get_text() if not (
             self.config.remove_endnotes or self.config.fnote_transplant) else self._fnote_process(file_name, soup)
 
+        return (title, text_soup)
+
+    def _chapter_cleanup(self, text_soup):
         if not self.config.test_mode:
             # Replace excessive whitespaces and newline characters based on the mode
             cleaned_text = self._text_cleanup(text_soup.strip())
 
             # 如果文本是繁體中文，但輸出語音為簡體中文，則把文本轉換為簡體中文
-            if self.config.language in ["zh-TW", "zh-HK"] and self.config.voice_name.startswith("zh-CN"):
+            if self._needs_t2s():
                 # 繁轉簡
                 cleaned_text = self._t2s(cleaned_text)
         else:
             cleaned_text = text_soup.strip()
 
-        self.files[file_name] = None
-        soup.decompose()
+        return cleaned_text
+
+    def _chapter_extract_lxml(self, content):
+        """ 直接用 lxml 提取標題和原始文字，結果與 soup 路徑相同 """
+        root = etree.fromstring(content, self.LXML_PARSER) if content.strip() else None
+        if root is None:
+            return (None, None)
+
+        # 使用'h1','h2'...標籤找標題
+        headings = self.LXML_HEADING_XPATH(root)
+        title = self._lxml_text(headings[0]).strip() if headings else ""
+
+        if not title:
+            # 如果沒有找到標題，用前兩段有文字的<p>作為標題，找到就停
+            paragraphs = []
+            for p in root.iter('p'):
+                if p_text := self._lxml_text(p):
+                    paragraphs.append(p_text.strip())
+                    if len(paragraphs) == 2:
+                        break
+            if not paragraphs:
+                return (None, None)
+            title = '_'.join(paragraphs)[:20]
 
-        return (title, cleaned_text)
+        logger.debug(f"title: <{title}>")
+        title = self._sanitize_title(title, self.break_string)
+        logger.debug(f"Sanitized title: <{title}>")
+
+        text = self._lxml_text(root)
+        if self.config.remove_endnotes or self.config.fnote_transplant:
+            # 去除Url（與 _fnote_process 一致）
+            text = re.sub(self.URL_PATTERN, "", text)
+
+        return (title, text)
+
+    def _lxml_text(self, element):
+        strings = []
+        for string in self.LXML_TEXT_XPATH(element):
+            if not string.strip(self.ASCII_SPACES) and not self._lxml_preserve_whitespace(string):
+                string = '\n' if '\n' in string else ' '
+            strings.append(string)
+        return ''.join(strings)
+
+    def _lxml_preserve_whitespace(self, string):
+        parent = string.getparent()
+        if string.is_tail:
+            parent = parent.getparent()
+        while parent is not None:
+            if parent.tag in self.PRESERVE_WHITESPACE_TAGS:
+                return True
+            parent = parent.getparent()
+        return False
 
     def _title_find(self, file_name, soup):
         """ 找標題 """
@@ -202,6 +460,9 @@ class EpubBookParser(BaseBookParser):
 
         return cleaned_text
 
+    def _needs_t2s(self):
+        return self.config.language in ["zh-TW", "zh-HK"] and self.config.voice_name.startswith("zh-CN")
+
     def _t2s(self, text):
         """ 繁轉簡 """
 
@@ -212,42 +473,103 @@ class EpubBookParser(BaseBookParser):
         # 转换为简体中文，防止語音出現問題，例如：為什麼，金額...
         return converter.convert(text)
 
-    def _fnote_process(self, file_name, soup):
-        """ 移植註腳 / 移除註腳 + 清空註腳內容 """
-        # 查找所有註腳和連結
-        for fnote in soup.find_all('a', href=self.FN_NOTE_PATTERN):
-            all_text = ''.join(fnote.stripped_strings)  # 递歸找出 a tag 中的所有文字
-            # 被處理後的註腳內容href中沒有# | 處理「註1」情況 | 處理只有圖片的註腳
-            if "#" not in fnote['href'] or self.TEXT_PATTERN.search(all_text) or (not all_text and not fnote.find('img')):
+    def _fnote_target(self, file_name, href):
+        """ 註腳連結 -> (目標文件名, id)，目標文件不在書中時視為同一文件 """
+        href_file, _, href_id = href.partition('#')
+        href_file = os.path.basename(href_file)
+        return (href_file if href_file in self.files else file_name), href_id
+
+    def _build_fnote_index(self):
+        """ 一次過掃描全書，建立 (文件名, id) -> 註腳內容 的索引，之後移植註腳只需查表 """
+        self.fnote_index = {}
+        self.fnote_targets = {}
+
+        # 1. 用正則預掃描原始 HTML，按書本次序找出所有註腳連結，不用建立 soup
+        candidates = []
+        note_ids_by_file = {}
+        for file_name, item in self.files.items():
+            content = item.get_content().decode('utf-8', errors='ignore')
+            for href, inner in self.FN_ANCHOR_PATTERN.findall(content):
+                all_text = html.unescape(''.join(part.strip() for part in self.TAG_PATTERN.split(inner)))
+                # 與 _fnote_process 相同的過濾條件
+                if self.TEXT_PATTERN.search(all_text) or (not all_text and '<img' not in inner.lower()):
+                    continue
+                href = html.unescape(href)
+                candidates.append((file_name, href))
+                target_file, href_id = self._fnote_target(file_name, href)
+                note_ids_by_file.setdefault(target_file, set()).add(href_id)
+
+        # 2. 只為被引用的文件建立 soup，只保留註腳文字和其中的連結
+        notes = {}
+        for file_name, note_ids in note_ids_by_file.items():
+            soup = self._load_soup(file_name)
+            for href_id, fnote_element in self._fnote_elements(soup, note_ids):
+                if (file_name, href_id) in notes:
+                    continue
+                inner_links = {(file_name, tag_a['href']) for tag_a in (
+                    [fnote_element] if fnote_element.name == 'a' else fnote_element.find_all('a', href=True))}
+                notes[(file_name, href_id)] = (fnote_element.get_text(), inner_links)
+            soup.decompose()
+
+        # 3. 按書本次序確認註腳，註腳內容中的連結（返回正文的連結）不會再被當作註腳
+        backlinks = set()
+        for file_name, href in candidates:
+            if (file_name, href) in backlinks:
+                continue
+            target = self._fnote_target(file_name, href)
+            if target not in notes:
                 continue
+            fnote_content, inner_links = notes[target]
+            self.fnote_index[target] = fnote_content
+            self.fnote_targets.setdefault(target[0], set()).add(target[1])
+            self.fnote_files.update((file_name, target[0]))
+            backlinks |= inner_links
 
-            # 提取href中的文件名和ID
-            href_file, href_id = fnote['href'].split('#')
-            # 尋找目標文件和ID
-            # (因為有機會註腳內容不在同一個文件中)
-            target_soup = self.files.get(href_file, soup)
-            fnote_element = target_soup.find(
-                id=href_id) if target_soup else None
+        logger.debug(f"Footnote index: {len(self.fnote_index)} notes")
 
-            if not fnote_element:
-                continue
+    def _fnote_elements(self, soup, note_ids):
+        """ 找出 soup 中被引用的註腳內容元素 """
+        fnote_elements = []
+        for element in soup.find_all(id=lambda value: value in note_ids):
+            href_id = element['id']
 
             # 如果初始找到的元素不是 p tag，向上查找直到找到 p tag
-            if fnote_element.name != 'p':
-                current_element = fnote_element
+            if element.name != 'p':
+                current_element = element
                 while current_element and current_element.name != 'p':
                     current_element = current_element.find_parent()
                 # 如果找到 p tag，使用它；否則保持原 fnote_element
-                fnote_element = current_element if current_element else fnote_element
-
-            # 移除註腳內容中的連結，防止註腳內容被當作標籤處理
-            for tag_a in ([fnote_element] if fnote_element.name == 'a' else fnote_element.find_all('a')):
-                tag_a['href'] = ''
+                element = current_element if current_element else element
 
-            # 如果找不到註腳內容
+            # 如果找不到註腳內容（例如只有「[1]」返回連結）
             # 循環向上搜尋父元素，直到找到任何文字，確保註腳內容完整
-            while (fnote_content := fnote_element.get_text()) == fnote.string:
-                fnote_element = fnote_element.find_parent()
+            while not self.TEXT_PATTERN.search(element.get_text()) and element.parent and element.parent.name != 'body':
+                element = element.parent
+
+            fnote_elements.append((href_id, element))
+
+        return fnote_elements
+
+    def _fnote_process(self, file_name, soup):
+        """ 移植註腳 / 移除註腳 + 清空註腳內容 """
+        # 先清空本文件中被引用的註腳內容，註腳文字已在索引中，與章節處理次序無關
+        note_ids = self.fnote_targets.get(file_name)
+        if note_ids:
+            for _, fnote_element in self._fnote_elements(soup, note_ids):
+                fnote_element.clear()
+
+        # 查找所有註腳和連結
+        for fnote in soup.find_all('a', href=self.FN_NOTE_PATTERN):
+            all_text = ''.join(fnote.stripped_strings)  # 递歸找出 a tag 中的所有文字
+            # 處理「註1」情況 | 處理只有圖片的註腳
+            if self.TEXT_PATTERN.search(all_text) or (not all_text and not fnote.find('img')):
+                continue
+
+            # 在索引中查找註腳內容
+            # (因為有機會註腳內容不在同一個文件中)
+            fnote_content = self.fnote_index.get(self._fnote_target(file_name, fnote['href']))
+            if fnote_content is None:
+                continue
 
             new_fnote_content = ""
             fnote.string = fnote.string or ""
@@ -266,9 +588,24 @@ class EpubBookParser(BaseBookParser):
                     new_fnote_content = f"{self.fnote_prefix}{cleaned_fnote_content.strip()}{self.fnote_suffix}"
 
             fnote.string.replace_with(new_fnote_content)
-            # 移除註腳內容
-            fnote_element.clear()
 
         # 去除Url
         cleaned_text = re.sub(self.URL_PATTERN, "", soup.get_text())
         return cleaned_text
+
+
+# 進程池子進程中使用的解析器（不包含整本書）
+_worker_parser = None
+
+
+def _init_chapter_worker(parser):
+    global _worker_parser
+    _worker_parser = parser
+
+
+def _extract_chapter_worker(file_name, content):
+    return _worker_parser._extract_content(file_name, content)
+
+
+def _cleanup_chapter_worker(text_soup):
+    return _worker_parser._chapter_cleanup(text_soup)
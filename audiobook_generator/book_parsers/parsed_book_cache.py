@@ -0,0 +1,110 @@
+import hashlib
+import json
+import logging
+import os
+
+from audiobook_generator.core.disk_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+
+class ParsedBookCache(DiskCache):
+    """ 已解析書本的磁碟快取，鍵為 EPUB 內容雜湊 + 所有影響文字的選項；存取和淘汰見 DiskCache """
+    NAME = "Parsed book cache"
+    # 解析邏輯有改動而令輸出不同時，提升版本號使舊快取失效
+    VERSION = 1
+    SUFFIX = ".jsonl"
+    # 書本不多，不分目錄；每本都大，只刪到上限
+    SHARDED = False
+    EVICT_TO = 1.0
+
+    def make_key(self, input_file, options: dict) -> str:
+        digest = hashlib.sha256()
+        with open(input_file, "rb") as f:
+            while block := f.read(1024 * 1024):
+                digest.update(block)
+        digest.update(json.dumps({"version": self.VERSION, **options}, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def open_entry(self, key):
+        """ 返回 ParsedBookEntry，沒有快取時返回 None """
+        path = self._path(key)
+        try:
+            entry = ParsedBookEntry(path)
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"Ignoring broken parsed book cache {path}: {e}")
+            return None
+
+        # 更新訪問時間，用作 LRU 淘汰
+        self._touch(path, os.stat(path))
+        logger.info(f"Parsed book cache hit: {key[:12]}")
+        return entry
+
+    def writer(self, key, header: dict):
+        return ParsedBookWriter(self, key, header)
+
+    def _commit(self, tmp_path, key):
+        if self._commit_file(tmp_path, key):
+            logger.info(f"Parsed book cache stored: {key[:12]}")
+
+
+class ParsedBookEntry:
+    """ 快取格式（JSON Lines）：第一行書本資料，之後每行 [idx, title, text]，最後一行章節總數 """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "r", encoding="utf-8") as f:
+            self.header = json.loads(f.readline())
+        if self.header.get("version") != ParsedBookCache.VERSION:
+            raise ValueError("cache version mismatch")
+
+    def chapter_count(self) -> int:
+        """ 只讀取最後一行的章節總數 """
+        with open(self.path, "rb") as f:
+            f.seek(max(0, os.path.getsize(self.path) - 4096))
+            record = json.loads(f.read().splitlines()[-1])
+        if not isinstance(record, dict) or "chapter_count" not in record:
+            raise ValueError(f"Parsed book cache is truncated: {self.path}")
+        return record["chapter_count"]
+
+    def iter_chapters(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            f.readline()
+            for line in f:
+                record = json.loads(line)
+                if isinstance(record, dict):
+                    self.header.update(record)
+                    return
+                yield tuple(record)
+        raise ValueError(f"Parsed book cache is truncated: {self.path}")
+
+
+class ParsedBookWriter:
+    """ 邊解析邊寫入暫存文件，全書解析完成後才原子地改名為快取 """
+
+    def __init__(self, cache, key, header):
+        self.cache = cache
+        self.key = key
+        self.tmp_path = cache._tmp_path(key)
+        self.file = open(self.tmp_path, "w", encoding="utf-8")
+        self._write({"version": ParsedBookCache.VERSION, **header})
+
+    def _write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False))
+        self.file.write("\n")
+
+    def add(self, idx, title, text):
+        self._write([idx, title, text])
+
+    def commit(self, chapter_count):
+        self._write({"chapter_count": chapter_count})
+        self.file.close()
+        self.cache._commit(self.tmp_path, self.key)
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
@@ -9,6 +9,9 @@ class GeneralConfig:
         self.no_prompt = args.no_prompt
         self.title_mode = args.title_mode
         self.test_mode = args.test_mode
+        self.metrics_textfile = args.metrics_textfile
+        self.metrics_json = args.metrics_json
+        self.metrics_interval = args.metrics_interval
 
         # Book parser specific arguments
         self.newline_mode = args.newline_mode
@@ -16,6 +19,10 @@ class GeneralConfig:
         self.chapter_end = args.chapter_end
         self.remove_endnotes = args.remove_endnotes
         self.fnote_transplant = args.fnote_transplant
+        self.parse_workers = args.parse_workers
+        self.parser_engine = args.parser_engine
+        self.parse_cache_dir = args.parse_cache_dir
+        self.parse_cache_size = args.parse_cache_size
 
         # TTS provider: common arguments
         self.tts = args.tts
@@ -23,6 +30,14 @@ class GeneralConfig:
         self.voice_name = args.voice_name
         self.output_format = args.output_format
         self.model_name = args.model_name
+        self.max_inflight_requests = args.max_inflight_requests
+        self.initial_inflight_requests = args.initial_inflight_requests
+        self.fixed_concurrency = args.fixed_concurrency
+        self.max_buffered_audio_mb = args.max_buffered_audio_mb
+        self.tts_cache_dir = args.tts_cache_dir
+        self.tts_cache_size = args.tts_cache_size
+        self.no_resume = args.no_resume
+        self.catalog = args.catalog
 
         # TTS provider: Azure & Edge TTS specific arguments
         self.break_duration = args.break_duration
@@ -32,15 +47,24 @@ class GeneralConfig:
         self.voice_volume = args.voice_volume
         self.voice_pitch = args.voice_pitch
         self.proxy = args.proxy
+        self.edge_pack_chars = args.edge_pack_chars
 
         # TTS provider: OpenAI TTS Provider
         self.ttsfm = args.ttsfm
         self.instructions = args.instructions
 
+        # TTS provider: Piper specific arguments
+        self.piper_workers = args.piper_workers
+
         self.sum_url = args.sum_url
         self.sum_api = args.sum_api
         self.sum_model = args.sum_model
         self.sum_only = args.sum_only
+        self.sum_tts_workers = args.sum_tts_workers
+        self.sum_stream = args.sum_stream
+        self.sum_cache_dir = args.sum_cache_dir
+        self.sum_cache_size = args.sum_cache_size
+        self.sum_cache_max_age = args.sum_cache_max_age
 
     def __str__(self):
         return ', '.join(f"{key}={value}" for key, value in self.__dict__.items())
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+from audiobook_generator.core.metrics import CONCURRENCY_LIMIT
+
+logger = logging.getLogger(__name__)
+
+# 不在這裡依賴各 provider 的 SDK，以類名識別它們的限流 / 連線錯誤
+OVERLOAD_ERROR_NAMES = {"WebSocketError", "RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError"}
+
+
+def is_overload_error(exc) -> bool:
+    """ 429、5xx、超時和連線失敗都視為服務過載，需要降低並發 """
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, ConnectionError, aiohttp.ClientConnectionError)):
+        return True
+    status = getattr(exc, "status", None) or getattr(exc, "status_code", None)
+    if isinstance(status, int) and (status == 429 or status >= 500):
+        return True
+    return type(exc).__name__ in OVERLOAD_ERROR_NAMES
+
+
+class AdaptiveLimiter:
+    """
+    AIMD（加性增、乘性減）並發上限。
+
+    每完成 limit 個健康的請求，上限加 1；p95 延遲超過基線的 latency_tolerance 倍，或最近的錯誤率過高時停止增長；
+    遇到 429、超時或連線失敗時上限乘以 backoff；降低之前已發出的請求的失敗，以及一個 p50 延遲內的失敗，不會再次降低上限。
+    """
+
+    def __init__(self, name, initial, max_limit, min_limit=1, adaptive=True,
+                 backoff=0.5, latency_tolerance=2.0, max_error_rate=0.05, window=50):
+        self.name = name
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.adaptive = adaptive
+        # 不自適應時固定為最大值
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit) if adaptive else self.max_limit)
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.max_error_rate = max_error_rate
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)  # True 為失敗
+        self.baseline_p95 = None
+        self.last_decrease = float("-inf")
+        self.inflight = 0
+        self.peak_limit = self.limit
+        self.increases = 0
+        self.decreases = 0
+        self.failures = 0
+        self._waiters = deque()
+        CONCURRENCY_LIMIT.set(self.limit, limiter=self.name)
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def p95(self):
+        return self.percentile(0.95)
+
+    def p50(self) -> float:
+        return self.percentile(0.5) or 0.0
+
+    def error_rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def on_success(self, started):
+        self.latencies.append(time.monotonic() - started)
+        self.outcomes.append(False)
+        if not self.adaptive or self.limit >= self.max_limit:
+            return
+
+        # 樣本足夠時才更新基線；基線取見過最低的 p95，代表服務空閒時的延遲
+        p95 = self.p95()
+        if len(self.latencies) >= min(self.latencies.maxlen, 10):
+            self.baseline_p95 = p95 if self.baseline_p95 is None else min(self.baseline_p95, p95)
+        if self.baseline_p95 is not None and p95 > self.baseline_p95 * self.latency_tolerance:
+            return
+        if self.error_rate() > self.max_error_rate:
+            return
+
+        previous = self.limit
+        self._limit = min(self.max_limit, self._limit + 1 / max(1, self.limit))
+        if self.limit > previous:
+            self.increases += 1
+            self.peak_limit = max(self.peak_limit, self.limit)
+            CONCURRENCY_LIMIT.set(self.limit, limiter=self.name)
+            logger.info(f"{self.name} concurrency limit {previous} -> {self.limit} (p95 {p95:.2f}s)")
+            self._wake()
+
+    def on_failure(self, exc, started):
+        self.failures += 1
+        self.outcomes.append(True)
+        if not self.adaptive or not is_overload_error(exc):
+            return
+        # 同一波過載中已在進行的請求一起失敗，只降低一次；服務需要約一個請求的時間消化已有的連線，
+        # 因此每個 p50 延遲內最多降低一次
+        now = time.monotonic()
+        if started < self.last_decrease or now - self.last_decrease < self.p50():
+            return
+        self.last_decrease = now
+        previous = self.limit
+        self._limit = max(self.min_limit, self._limit * self.backoff)
+        # 降低前的錯誤已經反映在新的上限中，重新統計錯誤率
+        self.outcomes.clear()
+        if self.limit < previous:
+            self.decreases += 1
+            CONCURRENCY_LIMIT.set(self.limit, limiter=self.name)
+            logger.info(f"{self.name} concurrency limit {previous} -> {self.limit} ({type(exc).__name__}: {exc})")
+
+    def snapshot(self) -> dict:
+        p95 = self.p95()
+        return {
+            "limit": self.limit,
+            "peak_limit": self.peak_limit,
+            "inflight": self.inflight,
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+            "error_rate": round(self.error_rate(), 3),
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "failures": self.failures,
+        }
+
+    async def acquire(self):
+        while self.inflight >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.inflight += 1
+
+    def release(self):
+        self.inflight -= 1
+        self._wake()
+
+    def _wake(self):
+        free = self.limit - self.inflight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    @asynccontextmanager
+    async def slot(self):
+        """ 佔用一個名額完成一次請求，並按結果調整上限 """
+        await self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.on_failure(e, started)
+            raise
+        else:
+            self.on_success(started)
+        finally:
+            self.release()
@@ -0,0 +1,81 @@
+import functools
+import logging
+import re
+from dataclasses import dataclass
+
+from audiobook_generator.core.utils import _MP3_BITRATES, _MP3_SAMPLE_RATES
+
+logger = logging.getLogger(__name__)
+
+# Azure / Edge 的格式名中的 khz 不一定是整數千赫
+_KHZ = {8: 8000, 11: 11025, 16: 16000, 22: 22050, 24: 24000, 44: 44100, 48: 48000}
+_OUTPUT_FORMAT = re.compile(
+    r"^(?:audio|raw|riff)-(\d+)khz-(\d+)(kbitrate|bit)-(mono|stereo)-(mp3|pcm)$")
+
+
+@dataclass(frozen=True)
+class AudioFormat:
+    codec: str  # "mp3" 或 "pcm"
+    sample_rate: int
+    channels: int
+    bit_rate: int = None  # kbps，mp3 用
+    sample_width: int = 2  # bytes，pcm 用
+
+
+def parse_output_format(output_format) -> AudioFormat:
+    """ 解析 audio-24khz-48kbitrate-mono-mp3 / raw-24khz-16bit-mono-pcm 形式的格式名，無法識別時返回 None """
+    match = _OUTPUT_FORMAT.match(output_format or "")
+    if not match or int(match.group(1)) not in _KHZ:
+        return None
+    khz, size, unit, channels, codec = match.groups()
+    sample_rate = _KHZ[int(khz)]
+    channels = 1 if channels == "mono" else 2
+    if codec == "mp3":
+        return AudioFormat("mp3", sample_rate, channels, bit_rate=int(size)) if unit == "kbitrate" else None
+    return AudioFormat("pcm", sample_rate, channels, sample_width=int(size) // 8) if unit == "bit" else None
+
+
+@functools.lru_cache(maxsize=64)
+def silence(duration_ms, audio_format: AudioFormat) -> bytes:
+    """
+    與 audio_format 相同格式的靜音，每種時長和格式只生成一次，之後直接返回快取的數據。
+    mp3 為整數個不依賴位元儲存器的靜音幀，時長取最接近的幀數，可以直接插在任何兩個片段之間。
+    """
+    if audio_format.codec == "pcm":
+        frames = round(audio_format.sample_rate * duration_ms / 1000)
+        return b"\0" * (frames * audio_format.channels * audio_format.sample_width)
+    return _mp3_silence(duration_ms, audio_format)
+
+
+def _mp3_silence(duration_ms, audio_format: AudioFormat) -> bytes:
+    # 版本位：3 為 MPEG-1，2 為 MPEG-2，0 為 MPEG-2.5
+    version = next(v for v, rates in _MP3_SAMPLE_RATES.items() if audio_format.sample_rate in rates)
+    mpeg1 = version == 3
+    bit_rates = _MP3_BITRATES[1 if mpeg1 else 2]
+    if audio_format.bit_rate not in bit_rates[1:]:
+        raise ValueError(f"Unsupported MP3 bit rate: {audio_format.bit_rate} kbps")
+    bitrate_index = bit_rates.index(audio_format.bit_rate)
+    sample_rate_index = _MP3_SAMPLE_RATES[version].index(audio_format.sample_rate)
+    mono = audio_format.channels == 1
+
+    samples_per_frame = 1152 if mpeg1 else 576
+    frame_count = max(1, round(audio_format.sample_rate * duration_ms / 1000 / samples_per_frame))
+    # 每幀的字節數不是整數時（例如 44.1kHz），與編碼器一樣按需要加一個填充字節
+    frame_bytes = (144 if mpeg1 else 72) * audio_format.bit_rate * 1000 / audio_format.sample_rate
+
+    frames = []
+    remainder = 0.0
+    for _ in range(frame_count):
+        remainder += frame_bytes - int(frame_bytes)
+        padding = 1 if remainder >= 1 else 0
+        remainder -= padding
+        header = bytes([
+            0xFF,
+            0xE0 | (version << 3) | (1 << 1) | 1,  # Layer III，無 CRC
+            (bitrate_index << 4) | (sample_rate_index << 2) | (padding << 1),
+            (0b11 << 6 if mono else 0) | 0b100,  # 聲道模式，original
+        ])
+        # 旁資訊和主數據全為 0：main_data_begin = 0，每個 granule 的 part2_3_length = 0，解碼結果為靜音
+        frames.append(header + bytes(int(frame_bytes) + padding - 4))
+    logger.debug(f"Generated {frame_count} silent MP3 frames for {duration_ms}ms of {audio_format}")
+    return b"".join(frames)
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import struct
+from dataclasses import dataclass
+
+import lameenc
+
+logger = logging.getLogger(__name__)
+
+PIPE_READ_SIZE = 64 * 1024
+# 流式寫 WAV 時總長度未知，頭部先填最大值，寫完後再由 finalize_wav 改正
+WAV_UNKNOWN_SIZE = 0xFFFFFFFF
+
+
+@dataclass(frozen=True)
+class PcmFormat:
+    sample_rate: int
+    channels: int
+    sample_width: int  # bytes
+
+
+class Mp3Encoder:
+    """ lameenc 增量編碼，每收到一塊 PCM 就輸出對應的 MP3 幀 """
+
+    def __init__(self, fmt: PcmFormat, on_audio):
+        if fmt.sample_width != 2:
+            raise ValueError(f"MP3 encoding needs 16-bit PCM, got {fmt.sample_width * 8}-bit")
+        self.on_audio = on_audio
+        self.encoder = lameenc.Encoder()
+        self.encoder.set_channels(fmt.channels)
+        self.encoder.set_in_sample_rate(fmt.sample_rate)
+        self.encoder.set_out_sample_rate(fmt.sample_rate)
+        self.encoder.set_bit_rate(128)
+        self.encoder.set_quality(2)
+
+    async def write(self, pcm):
+        data = await asyncio.to_thread(self.encoder.encode, pcm)
+        if data:
+            await self.on_audio(bytes(data))
+
+    async def close(self):
+        await self.on_audio(bytes(self.encoder.flush()))
+
+    def abort(self):
+        pass
+
+
+class WavEncoder:
+    """ 直接輸出 PCM；頭部的長度在文件寫完後以 finalize_wav 補上 """
+
+    def __init__(self, fmt: PcmFormat, on_audio):
+        self.fmt = fmt
+        self.on_audio = on_audio
+        self.header_written = False
+
+    async def write(self, pcm):
+        if not self.header_written:
+            self.header_written = True
+            await self.on_audio(wav_header(self.fmt, WAV_UNKNOWN_SIZE))
+        await self.on_audio(pcm)
+
+    async def close(self):
+        if not self.header_written:
+            self.header_written = True
+            await self.on_audio(wav_header(self.fmt, 0))
+
+    def abort(self):
+        pass
+
+
+class PipedEncoder:
+    """ 其他格式（例如 opus）經 ffmpeg 管道編碼，一邊寫入 PCM 一邊讀出編碼後的數據 """
+
+    SAMPLE_FORMATS = {1: "u8", 2: "s16le", 4: "s32le"}
+
+    def __init__(self, output_format, fmt: PcmFormat, on_audio):
+        self.command = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-f", self.SAMPLE_FORMATS[fmt.sample_width], "-ar", str(fmt.sample_rate), "-ac", str(fmt.channels),
+            "-i", "pipe:0",
+            "-f", output_format, "pipe:1",
+        ]
+        self.on_audio = on_audio
+        self.process = None
+        self.reader = None
+
+    async def write(self, pcm):
+        if self.process is None:
+            self.process = await asyncio.create_subprocess_exec(
+                *self.command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE)
+            self.reader = asyncio.ensure_future(self._read())
+            self.reader.add_done_callback(self._on_reader_done)
+        try:
+            self.process.stdin.write(pcm)
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg 因讀取端失敗而被結束時，拋出讀取端的錯誤
+            if self.reader.done() and not self.reader.cancelled() and self.reader.exception():
+                raise self.reader.exception()
+            raise
+
+    def _on_reader_done(self, task):
+        # 讀取端失敗時結束 ffmpeg，否則它的輸出寫滿後不再讀 stdin，寫入會一直等待
+        if not task.cancelled() and task.exception() is not None:
+            self.abort()
+
+    async def _read(self):
+        while data := await self.process.stdout.read(PIPE_READ_SIZE):
+            await self.on_audio(data)
+
+    async def close(self):
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        await self.reader
+        if await self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with code {self.process.returncode}: {' '.join(self.command)}")
+
+    def abort(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+        if self.reader is not None:
+            self.reader.cancel()
+
+
+def make_encoder(output_format, fmt: PcmFormat, on_audio):
+    """ 按輸出格式返回增量編碼器；on_audio(data) 為接收編碼後數據的協程函數 """
+    if output_format == "mp3":
+        return Mp3Encoder(fmt, on_audio)
+    if output_format == "wav":
+        return WavEncoder(fmt, on_audio)
+    return PipedEncoder(output_format, fmt, on_audio)
+
+
+def wav_header(fmt: PcmFormat, data_size) -> bytes:
+    block_align = fmt.channels * fmt.sample_width
+    riff_size = min(WAV_UNKNOWN_SIZE, 36 + data_size)
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, 1, fmt.channels, fmt.sample_rate, fmt.sample_rate * block_align, block_align,
+        fmt.sample_width * 8,
+        b"data", data_size,
+    )
+
+
+def finalize_wav(path):
+    """ 以文件的實際大小改正 WavEncoder 寫入的頭部 """
+    with open(path, "r+b") as f:
+        size = f.seek(0, 2)
+        f.seek(4)
+        f.write(struct.pack("<I", size - 8))
+        f.seek(40)
+        f.write(struct.pack("<I", size - 44))
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import os
+from collections import deque
+
+import aiofiles
+
+from audiobook_generator.core.metrics import AUDIO_BYTES, BUFFERED_AUDIO_BYTES, RESUMED_SEGMENTS
+from audiobook_generator.core.resume_journal import ResumeJournal
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_SIZE = 64 * 1024  # 從服務讀取音頻時每次的大小
+
+
+class AudioBufferBudget:
+    """
+    所有章節共用的音頻緩衝上限。
+
+    寫入器把還不能寫入文件（前面的片段未完成）的音頻記在這裡；超過上限時，排程器只派發能直接寫入文件的片段，
+    快取命中的片段也要等到有空間才讀取。
+    """
+
+    def __init__(self, max_buffered_mb):
+        self.max_bytes = int(max_buffered_mb * 1024 * 1024)
+        self.buffered = 0
+        self.peak_buffered = 0
+        self.listeners = []
+        self._waiters = []
+
+    @property
+    def full(self) -> bool:
+        return self.buffered >= self.max_bytes
+
+    def add(self, size):
+        self.buffered += size
+        self.peak_buffered = max(self.peak_buffered, self.buffered)
+        BUFFERED_AUDIO_BYTES.set(self.buffered)
+
+    def release(self, size):
+        was_full = self.full
+        self.buffered -= size
+        BUFFERED_AUDIO_BYTES.set(self.buffered)
+        if was_full and not self.full:
+            self.notify()
+
+    def notify(self):
+        """ 緩衝騰出空間或寫入器換了當前片段時調用 """
+        for listener in self.listeners:
+            listener()
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def wait_for_room(self, sink):
+        while self.full and not sink.is_head:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+
+class SegmentSink:
+    """ 一個片段的音頻入口，provider 邊收到數據邊 write，完成後由排程器 finish """
+
+    def __init__(self, writer, index):
+        self.writer = writer
+        self.index = index
+        self.chunks = deque()
+        self.finished = False
+        # 上次運行已寫入文件的片段，不需要再合成，寫入的數據會被忽略
+        self.resumed = False
+        self.written = 0
+        # 需要寫入快取時，保留一份完整的音頻
+        self.capture = None
+
+    @property
+    def is_head(self) -> bool:
+        return self.writer.head == self.index
+
+    async def write(self, data: bytes):
+        if not data or self.resumed:
+            return
+        self.written += len(data)
+        if self.capture is not None:
+            self.capture.append(data)
+        self.chunks.append(data)
+        self.writer.budget.add(len(data))
+        if self.is_head:
+            await self.writer.drain()
+
+    async def finish(self):
+        if self.resumed:
+            return
+        self.finished = True
+        if self.is_head:
+            await self.writer.drain()
+
+
+class OrderedAudioWriter:
+    """
+    按次序把片段的音頻追加到輸出文件：當前片段的數據直接寫入，後面片段的數據暫存到前面的片段完成為止。
+
+    數據先寫入 output_file + ".part"，全部片段完成後才改名為 output_file，未完成的文件不會被當成已完成的章節。
+    以 async with 使用；傳入 journal 時，每寫完一批片段就記錄進度，出錯、被取消或崩潰後保留 .part，
+    下次以相同的 segments（片段內容，用於判斷是否可以接續）運行時從第一個未寫入的片段繼續；沒有 journal 時刪除 .part。
+    片段數事先不知道時（例如文字由 LLM 串流生成），以 count=0 建立，每得到一段文字就 add_segment()；這種用法不能續傳，不傳入 journal。
+    """
+
+    def __init__(self, output_file, count, budget: AudioBufferBudget, journal: ResumeJournal = None, segments=None):
+        self.output_file = output_file
+        self.part_file = f"{output_file}.part"
+        self.name = os.path.basename(output_file)
+        self.budget = budget
+        self.journal = journal
+        self.fingerprint = journal.fingerprint(segments) if journal else None
+        self.segments = [SegmentSink(self, i) for i in range(count)]
+        self.head = 0
+        self.offset = 0
+        # 整章在上次運行已完成
+        self.skipped = False
+        self.file = None
+        self.lock = asyncio.Lock()
+
+    def segment(self, index) -> SegmentSink:
+        return self.segments[index]
+
+    def add_segment(self) -> SegmentSink:
+        """ 在最後追加一個片段 """
+        sink = SegmentSink(self, len(self.segments))
+        self.segments.append(sink)
+        return sink
+
+    async def __aenter__(self):
+        progress = self.journal.progress(self.name, self.fingerprint) if self.journal else None
+        if progress and progress.done and os.path.exists(self.output_file):
+            self._resume(len(self.segments))
+            self.skipped = True
+            logger.info(f"Skipping finished chapter: {self.name}")
+            return self
+        if progress and progress.committed and self._part_size() >= progress.offset:
+            os.truncate(self.part_file, progress.offset)
+            self.file = await aiofiles.open(self.part_file, "ab")
+            self.offset = progress.offset
+            self._resume(progress.committed)
+            logger.info(f"Resuming {self.name} at segment {progress.committed + 1}/{len(self.segments)}")
+            return self
+        self.file = await aiofiles.open(self.part_file, "wb")
+        if self.journal:
+            self.journal.start(self.name, self.fingerprint, len(self.segments))
+        return self
+
+    def _part_size(self):
+        try:
+            return os.path.getsize(self.part_file)
+        except FileNotFoundError:
+            return -1
+
+    def _resume(self, committed):
+        for sink in self.segments[:committed]:
+            sink.resumed = True
+            sink.finished = True
+        self.head = committed
+        RESUMED_SEGMENTS.inc(committed)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.skipped:
+            return False
+        await self.file.close()
+        if exc_type is None and self.head == len(self.segments):
+            os.replace(self.part_file, self.output_file)
+            if self.journal:
+                self.journal.finish(self.name)
+            return False
+
+        self.budget.release(sum(len(chunk) for sink in self.segments for chunk in sink.chunks))
+        for sink in self.segments:
+            sink.chunks.clear()
+        if self.journal is None:
+            try:
+                os.remove(self.part_file)
+            except FileNotFoundError:
+                pass
+        if exc_type is None:
+            raise RuntimeError(f"{len(self.segments) - self.head} audio segments were not finished: {self.output_file}")
+        return False
+
+    async def drain(self):
+        async with self.lock:
+            head = self.head
+            # 最後一個完整片段的結尾；之後可能已寫入下一個片段的部分數據，不能記為進度
+            committed_offset = self.offset
+            while self.head < len(self.segments):
+                sink = self.segments[self.head]
+                while sink.chunks:
+                    chunk = sink.chunks.popleft()
+                    await self.file.write(chunk)
+                    self.offset += len(chunk)
+                    AUDIO_BYTES.inc(len(chunk))
+                    self.budget.release(len(chunk))
+                if not sink.finished:
+                    break
+                self.head += 1
+                committed_offset = self.offset
+                self.budget.notify()
+            if self.journal and self.head > head:
+                # 先把數據交給操作系統再記錄進度，記錄的 offset 之前的數據在進程崩潰後仍在文件中
+                await self.file.flush()
+                self.journal.commit(self.name, self.head, committed_offset)
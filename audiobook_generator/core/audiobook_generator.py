@@ -1,11 +1,17 @@
 import logging
 import os
 import asyncio
+import concurrent.futures
+import time
+from contextlib import aclosing
 
 from audiobook_generator.book_parsers.base_book_parser import get_book_parser
 from audiobook_generator.config.general_config import GeneralConfig
 from audiobook_generator.core.audio_tags import AudioTags
-from audiobook_generator.tts_providers.base_tts_provider import get_async_tts_provider
+from audiobook_generator.core.edition_diff import EditionDiff
+from audiobook_generator.core.library_catalog import SUMMARY_DONE, SUMMARY_TEXT, LibraryCatalog, file_hash
+from audiobook_generator.core.metrics import CHAPTER_CHARS, CHAPTER_PARSE_SECONDS, CHAPTERS
+from audiobook_generator.tts_providers.base_tts_provider import BaseTTSProvider, get_async_tts_provider
 
 logger = logging.getLogger(__name__)
 
@@ -26,8 +32,13 @@ def get_total_chars(chapters):
 
 
 class AudiobookGenerator:
-    def __init__(self, config: GeneralConfig):
+    def __init__(self, config: GeneralConfig, tts_provider: BaseTTSProvider = None, catalog: LibraryCatalog = None):
         self.config = config
+        # 傳入時與其他書共用（排程器、連線池、快取、書庫目錄），由調用者關閉
+        self.tts_provider = tts_provider
+        self.shared_catalog = catalog
+        self.catalog = None
+        self.edition_diff = None
         logger.setLevel(config.log)
 
     def __str__(self) -> str:
@@ -35,60 +46,182 @@ class AudiobookGenerator:
 
     async def run(self):
         logger.info(f"🟢 Start - {os.path.basename(self.config.input_file)}")
+        tts_provider = None
         try:
             book_parser = get_book_parser(self.config)
-            tts_provider = await get_async_tts_provider(self.config)
+            tts_provider = self.tts_provider or await get_async_tts_provider(self.config)
 
             os.makedirs(self.config.output_folder, exist_ok=True)
-            chapters = book_parser.get_chapters(tts_provider.get_break_string())
-            chapters = [(title, text) for title, text in chapters if text.strip()]
-            logger.info(f"Chapters count: {len(chapters)}.")
-
-            self.validate_chapters(len(chapters))
+            self.validate_chapter_range()
+            await self.open_catalog(book_parser)
+            # 轉換全書時才刪除新版中已不存在的章節，validate_chapters 會改寫 chapter_end
+            complete = self.config.chapter_start == 1 and self.config.chapter_end == -1
+            if not complete:
+                # 指定了章節範圍時，在交給 TTS 之前先數出章節總數檢查範圍，超出範圍不會等到合成完才報錯
+                chapter_count = await asyncio.to_thread(book_parser.count_chapters, tts_provider.get_break_string())
+                self.validate_chapters(chapter_count)
+            if not self.config.preview:
+                journal = tts_provider.journal(self.config.output_folder)
+                if journal.contents:
+                    # 上次轉換過這本書（或它的上一版），內容沒有改變的章節沿用上次的音頻
+                    self.edition_diff = EditionDiff(self.config.output_folder, journal)
 
             logger.info(f"Converting chapters from {self.config.chapter_start} to {self.config.chapter_end}.")
 
-            total_characters = get_total_chars(chapters[self.config.chapter_start - 1:self.config.chapter_end])
-            logger.info(f"✨ Total characters in selected book chapters: {total_characters} ✨")
-            rough_price = tts_provider.estimate_cost(total_characters)
+            # 逐章解析，只有選定範圍內的章節才會被清理
+            chapters = self._iter_chapters(book_parser, tts_provider.get_break_string())
 
             if not self.config.no_prompt and not self.config.preview and self.config.tts != 'edge':
+                # 需要先估算費用，所以把選定範圍內的章節全部解析出來
+                chapter_list = [chapter async for chapter in chapters]
+                total_characters = get_total_chars((title, text) for _, title, text in chapter_list)
+                rough_price = tts_provider.estimate_cost(total_characters)
                 print(f"Estimate book voiceover would cost you roughly: ${rough_price:.2f}\n")
                 confirm_conversion()
+                chapters = self._replay_chapters(chapter_list)
 
-            semaphore = asyncio.Semaphore(5)  # Limit concurrent tasks
+            # 章節一解析完就交給 TTS provider，各章的片段由全書共用的排程器控制並發。
+            # 每章在合成完之前持有整章文字，所以同時進行的章節數以 max_inflight_requests 為上限，
+            # 有章節完成、空出名額時才解析下一章，記憶體用量不隨全書長度增長
+            chapter_slots = asyncio.Semaphore(max(1, self.config.max_inflight_requests))
             tasks = []
-            for idx, (title, text) in enumerate(chapters, start=1):
-                if not (self.config.chapter_start <= idx <= self.config.chapter_end):
-                    continue
-
-                task = self.process_chapter(semaphore, idx, title, text, book_parser, tts_provider, len(chapters))
-                tasks.append(task)
-
-            await asyncio.gather(*tasks)
+            total_characters = 0
+            try:
+                async with aclosing(chapters):
+                    await chapter_slots.acquire()
+                    async for idx, title, text in chapters:
+                        total_characters += len(text)
+                        task = asyncio.create_task(self.process_chapter(idx, title, text, book_parser, tts_provider))
+                        task.add_done_callback(lambda _: chapter_slots.release())
+                        tasks.append(task)
+                        # 讓剛建立的章節先把片段交給排程器，解析下一章的同時已開始合成
+                        await asyncio.sleep(0)
+                        await chapter_slots.acquire()
+                        if any(started.done() and not started.cancelled() and started.exception() for started in tasks):
+                            # 有章節失敗，不再解析後面的章節，下面的 gather 拋出錯誤
+                            break
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # 解析或某一章失敗時，取消其餘章節並等它們結束，之後才關閉 provider 和書庫目錄
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            if self.edition_diff:
+                self.edition_diff.finish(complete)
+            if self.catalog:
+                self.catalog.record_chapter_count(self.config.output_folder, book_parser.chapter_count)
+            if not self.config.preview:
+                # 解析完才知道全書章節數，續傳日誌據此判斷是否還有未轉換的章節
+                tts_provider.journal(self.config.output_folder).record_chapter_count(book_parser.chapter_count)
+
+            logger.info(f"Chapters count: {book_parser.chapter_count}.")
+            logger.info(f"✨ Total characters in selected book chapters: {total_characters} ✨")
+            if not self.config.preview:
+                scheduler = tts_provider.scheduler
+                logger.info(f"TTS requests: {scheduler.submitted}, peak in flight: {scheduler.peak_inflight}/{scheduler.max_inflight}")
+                logger.info(f"TTS concurrency: {scheduler.limiter.snapshot()}")
+                logger.info(f"Peak buffered audio: {scheduler.budget.peak_buffered / 1024 / 1024:.1f}/{scheduler.budget.max_bytes / 1024 / 1024:.0f} MB")
+                if tts_provider.synthesis_cache:
+                    logger.info(f"TTS cache: {tts_provider.synthesis_cache.stats()}")
+            self.validate_chapters(book_parser.chapter_count)
 
             logger.info(f"Audio Book finished - {os.path.basename(self.config.input_file)}🎉🎉🎉")
 
         except KeyboardInterrupt:
             logger.info("Job stopped by user.")
             exit()
-
-    async def process_chapter(self, semaphore, idx, title, text, book_parser, tts_provider, total_chapters):
-        async with semaphore:
-            logger.info(f"Converting chapter {idx}/{total_chapters}: {title}, characters: {len(text)}")
-
-            if self.config.output_text:
-                text_file = os.path.join(self.config.output_folder, f"{idx:04d}_{title}.txt")
-                with open(text_file, "w", encoding='utf-8') as file:
-                    file.write(text)
-
-            if self.config.preview:
-                return
-
-            output_file = os.path.join(self.config.output_folder, f"{idx:04d}_{title}.{tts_provider.get_output_file_extension()}")
-            audio_tags = AudioTags(title, book_parser.get_book_author(), book_parser.get_book_title(), idx)
-
+        finally:
+            if self.tts_provider:
+                self.tts_provider.release_journal(self.config.output_folder)
+            elif tts_provider:
+                await tts_provider.close()
+            if self.catalog and not self.shared_catalog:
+                self.catalog.close()
+            self.catalog = None
+            self.edition_diff = None
+
+    async def open_catalog(self, book_parser):
+        """ 設定了 --catalog 時記錄這本書；EPUB 的雜湊在線程中計算 """
+        if not self.shared_catalog and not self.config.catalog:
+            return
+        self.catalog = self.shared_catalog or LibraryCatalog(self.config.catalog)
+        epub_hash = await asyncio.to_thread(file_hash, self.config.input_file)
+        self.catalog.record_book(self.config.output_folder, epub_hash, book_parser.get_book_title())
+
+    async def _iter_chapters(self, book_parser, break_string):
+        """ 逐章返回 (idx, title, text)；設定了 parse_workers 時在進程池中解析，與語音合成重疊進行 """
+        if self.config.parse_workers > 0:
+            logger.info(f"Parsing chapters with {self.config.parse_workers} worker processes.")
+            started = time.perf_counter()
+            async for chapter in book_parser.aiter_chapters(
+                    break_string, self.config.chapter_start, self.config.chapter_end, self.config.parse_workers):
+                self._record_parsed(chapter, started)
+                yield chapter
+                started = time.perf_counter()
+        else:
+            # 解析（lxml/BeautifulSoup、清理、繁轉簡）在單個線程中逐章進行，不阻塞事件循環上的請求和其他書；
+            # 只用一個線程，關閉生成器時不會與仍在執行的 next 衝突
+            loop = asyncio.get_running_loop()
+            chapters = book_parser.iter_chapters(break_string, self.config.chapter_start, self.config.chapter_end)
+            with concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="parse") as parser_thread:
+                try:
+                    started = time.perf_counter()
+                    while (chapter := await loop.run_in_executor(parser_thread, next, chapters, None)) is not None:
+                        self._record_parsed(chapter, started)
+                        yield chapter
+                        started = time.perf_counter()
+                finally:
+                    await loop.run_in_executor(parser_thread, chapters.close)
+
+    @staticmethod
+    def _record_parsed(chapter, started):
+        """ 記錄從請求下一章到拿到該章的時間（快取命中時只有讀取的時間） """
+        CHAPTER_PARSE_SECONDS.observe(time.perf_counter() - started)
+        CHAPTERS.inc()
+        CHAPTER_CHARS.inc(len(chapter[2]))
+
+    @staticmethod
+    async def _replay_chapters(chapters):
+        for chapter in chapters:
+            yield chapter
+
+    async def process_chapter(self, idx, title, text, book_parser, tts_provider):
+        logger.info(f"Converting chapter {idx}: {title}, characters: {len(text)}")
+        if self.catalog:
+            # 章節的字數和雜湊在解析時寫入一次，之後的掃描和摘要不用再讀文字文件
+            self.catalog.record_chapter(self.config.output_folder, idx, title, f"{idx:04d}_{title}", text)
+
+        if self.config.output_text:
+            text_file = os.path.join(self.config.output_folder, f"{idx:04d}_{title}.txt")
+            with open(text_file, "w", encoding='utf-8') as file:
+                file.write(text)
+
+        if self.config.preview:
+            return
+
+        output_file = os.path.join(self.config.output_folder, f"{idx:04d}_{title}.{tts_provider.get_output_file_extension()}")
+        journal = tts_provider.journal(self.config.output_folder)
+        reused = self.edition_diff.prepare(idx, title, text, output_file) if self.edition_diff else None
+        journal.record_chapter(idx, os.path.basename(output_file), journal.content_hash(text), title)
+        audio_tags = AudioTags(title, book_parser.get_book_author(), book_parser.get_book_title(), idx)
+
+        if reused:
+            await asyncio.to_thread(self.edition_diff.retag, reused, output_file, audio_tags)
+        else:
             await tts_provider.async_text_to_speech(text, output_file, audio_tags)
+        if self.catalog:
+            self.catalog.mark_audio_done(self.config.output_folder, idx)
+            if reused and (reused.summary_audio or reused.summary_text):
+                self.catalog.mark_summary(self.config.output_folder, idx,
+                                          SUMMARY_DONE if reused.summary_audio else SUMMARY_TEXT)
+
+    def validate_chapter_range(self):
+        # 只檢查不需要章節總數的部分
+        if self.config.chapter_start < 1:
+            raise ValueError(f"Chapter start index {self.config.chapter_start} is out of range.")
+        if self.config.chapter_end != -1 and self.config.chapter_start > self.config.chapter_end:
+            raise ValueError("Chapter start index cannot be larger than chapter end index.")
 
     def validate_chapters(self, num_chapters):
         if self.config.chapter_start < 1 or self.config.chapter_start > num_chapters:
@@ -0,0 +1,177 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DiskCache:
+    """
+    以文件保存條目的磁碟 LRU 快取，供摘要、合成和解析快取共用。
+
+    寫入先寫暫存文件再改名，多個進程可以共用同一個目錄；總大小超過上限時按最久未用的次序刪除條目。
+    條目的修改時間是寫入時間，訪問時間是最後使用的時間：命中時只更新訪問時間，LRU 按訪問時間排序；
+    設定 max_age_days 時，寫入超過這個天數的條目在讀取時當作沒有，並在寫入時定期清除。
+    """
+    NAME = "Disk cache"
+    SUFFIX = ""
+    # 按鍵的前兩位分目錄，條目多時避免單個目錄過大
+    SHARDED = True
+    # 淘汰時刪到上限的這個比例，避免每寫一個條目就掃描一次目錄
+    EVICT_TO = 0.9
+    # 設定 max_age 時，至多每隔這麼多秒在寫入時掃描一次過期條目
+    SWEEP_INTERVAL = 3600
+
+    def __init__(self, cache_dir, max_size_mb, max_age_days=None):
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.max_age = max_age_days * 86400 if max_age_days else None
+        self.expired = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # 目錄總大小只在首次寫入和淘汰時掃描，其餘時間按本進程的寫入和刪除增減
+        self.total_size = None
+        self.size_lock = threading.Lock()
+        # 首次寫入時清除過期條目
+        self.next_sweep = 0.0
+
+    def _path(self, key):
+        if self.SHARDED:
+            return os.path.join(self.cache_dir, key[:2], f"{key}{self.SUFFIX}")
+        return os.path.join(self.cache_dir, f"{key}{self.SUFFIX}")
+
+    def _tmp_path(self, key):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def _is_expired(self, mtime) -> bool:
+        return bool(self.max_age) and time.time() - mtime > self.max_age
+
+    @staticmethod
+    def _touch(path, stat):
+        """ 只更新訪問時間（LRU），保留修改時間（寫入時間） """
+        os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+
+    def _read_file(self, key):
+        """ 返回條目內容，沒有條目或條目已過期時返回 None """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                if self._is_expired(stat.st_mtime):
+                    data = None
+                else:
+                    data = f.read()
+            if data is None:
+                self.expired += 1
+                self._discard(path, stat.st_size)
+                return None
+            self._touch(path, stat)
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Ignoring broken {self.NAME.lower()} entry {path}: {e}")
+            return None
+        return data
+
+    def _write_file(self, key, data: bytes):
+        tmp_path = self._tmp_path(key)
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+        except OSError as e:
+            logger.warning(f"Could not store {self.NAME.lower()} entry {self._path(key)}: {e}")
+            self._remove(tmp_path)
+            return
+        self._commit_file(tmp_path, key)
+
+    def _commit_file(self, tmp_path, key) -> bool:
+        """ 把寫好的暫存文件原子地改名為條目，並按需要淘汰 """
+        path = self._path(key)
+        try:
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not store {self.NAME.lower()} entry {path}: {e}")
+            self._remove(tmp_path)
+            return False
+
+        with self.size_lock:
+            if self.total_size is None:
+                self.total_size = sum(size for _, _, size, _ in self._scan())
+            else:
+                self.total_size += size
+            sweep = self.max_age and time.monotonic() >= self.next_sweep
+            if sweep or self.total_size > self.max_size:
+                self._evict()
+        return True
+
+    def _discard(self, path, size):
+        """ 刪除一個條目並從總大小中扣除 """
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self.size_lock:
+            if self.total_size is not None:
+                self.total_size -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _scan(self):
+        """ 返回 (訪問時間, 修改時間, 大小, 路徑) 的列表 """
+        entries = []
+        if self.SHARDED:
+            folders = [shard.path for shard in os.scandir(self.cache_dir) if shard.is_dir()]
+        else:
+            folders = [self.cache_dir]
+        for folder in folders:
+            for entry in os.scandir(folder):
+                if not entry.name.endswith(self.SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_atime, stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        """ 先刪除過期的條目，再按最久沒有使用的次序刪到上限的 EVICT_TO；調用時須持有 size_lock """
+        entries = self._scan()
+        total_size = sum(size for _, _, size, _ in entries)
+        kept = []
+        evicted = expired = 0
+        for entry in entries:
+            if not self._is_expired(entry[1]):
+                kept.append(entry)
+                continue
+            try:
+                os.remove(entry[3])
+                expired += 1
+            except FileNotFoundError:
+                pass
+            total_size -= entry[2]
+
+        for _, _, size, path in sorted(kept):
+            if total_size <= self.max_size * self.EVICT_TO:
+                break
+            try:
+                os.remove(path)
+                evicted += 1
+            except FileNotFoundError:
+                pass
+            total_size -= size
+        self.total_size = total_size
+        self.expired += expired
+        if self.max_age:
+            self.next_sweep = time.monotonic() + self.SWEEP_INTERVAL
+        if evicted or expired:
+            logger.info(f"{self.NAME} evicted {evicted} entries and {expired} expired entries, "
+                        f"{total_size / 1024 / 1024:.1f} MB left")
@@ -0,0 +1,169 @@
+import difflib
+import logging
+import os
+
+from audiobook_generator.core.audio_tags import AudioTags
+from audiobook_generator.core.resume_journal import PREVIOUS_EDITION_DIR, ResumeJournal
+from audiobook_generator.core.utils import set_audio_tags
+
+logger = logging.getLogger(__name__)
+
+# 標題相似度達到這個比例時，內容改了的章節視為上一版某一章的新版本
+TITLE_SIMILARITY = 0.8
+
+
+def summary_name(name, extension) -> str:
+    """ 章節文件名對應的摘要文件名，例如 0012_標題.mp3 -> 0012S_標題.txt """
+    folder, base = os.path.split(name)
+    stem = os.path.splitext(base)[0]
+    return os.path.join(folder, f"{stem[:4]}S{stem[4:]}.{extension}")
+
+
+class PreviousChapter:
+    """ 上一版已完成的一章 """
+    __slots__ = ("name", "idx", "content", "title", "claimed", "summary_text", "summary_audio")
+
+    def __init__(self, name, idx, content, title):
+        self.name = name
+        self.idx = idx
+        self.content = content
+        self.title = title
+        # 已被新版的某一章沿用
+        self.claimed = False
+        self.summary_text = False
+        self.summary_audio = False
+
+
+class EditionDiff:
+    """
+    換了新版 EPUB 後重新轉換時，只重新合成內容改變了的章節。
+
+    續傳日誌記錄了每章文字（連同聲音設定）的雜湊；新版解析出一章時：
+    - 文件名和內容都沒變：照常交給 TTS provider，續傳日誌判斷為已完成而跳過；
+    - 內容與上一版某一章相同，但編號或標題變了（前面增刪了章節）：把那一章的音頻和摘要改名到新文件名並重寫標籤，不再合成；
+    - 內容改了或新增的章節：重新合成和生成摘要。文件名被上一版另一章佔用時，先把那一章移到 .previous_edition/，
+      後面的章節仍可沿用它。
+
+    完整轉換全書後，沒有被沿用的上一版章節（已刪除或內容已改）連同摘要一併刪除，內容改了的章節按標題相似度配對後記錄在日誌中。
+    prepare() 在章節的第一個 await 之前調用，多個章節並發時仍按解析次序決定沿用哪一個文件。
+    """
+
+    def __init__(self, folder, journal: ResumeJournal):
+        self.folder = folder
+        self.journal = journal
+        self.previous = {}  # 文件名 -> PreviousChapter
+        self.by_content = {}  # content -> [PreviousChapter]
+        for name, (content, title) in journal.contents.items():
+            if journal.is_done(name, folder):
+                chapter = self.previous[name] = PreviousChapter(name, journal.indexes.get(name), content, title)
+                self.by_content.setdefault(content, []).append(chapter)
+        self.produced = set()  # 本次轉換的章節文件名
+        self.unchanged = 0
+        self.reused = []  # (上一版文件名, 新文件名)
+        self.synthesized = []  # (新文件名, 標題)
+
+    def _path(self, name):
+        return os.path.join(self.folder, name)
+
+    def _rename(self, chapter, new_name):
+        """ 把一章的音頻和摘要改名，並記入續傳日誌 """
+        os.makedirs(os.path.dirname(self._path(new_name)), exist_ok=True)
+        os.replace(self._path(chapter.name), self._path(new_name))
+        for extension in ("txt", "mp3"):
+            source = self._path(summary_name(chapter.name, extension))
+            if os.path.exists(source):
+                os.replace(source, self._path(summary_name(new_name, extension)))
+                if extension == "txt":
+                    chapter.summary_text = True
+                else:
+                    chapter.summary_audio = True
+        self.journal.rename(chapter.name, new_name)
+        self.previous.pop(chapter.name, None)
+        chapter.name = new_name
+
+    def prepare(self, idx, title, text, output_file):
+        """ 返回沿用的上一版章節（音頻已改名為 output_file，需要重寫標籤）；需要合成時返回 None """
+        name = os.path.basename(output_file)
+        content = self.journal.content_hash(text)
+        self.produced.add(name)
+        previous = self.previous.get(name)
+        if previous and not previous.claimed and previous.content == content:
+            previous.claimed = True
+            self.unchanged += 1
+            return None
+
+        if previous and not previous.claimed:
+            # 這個文件名要給新的一章，上一版的這一章可能是後面某一章的舊編號
+            self._rename(previous, os.path.join(PREVIOUS_EDITION_DIR, name))
+            self.previous[previous.name] = previous
+        candidates = [chapter for chapter in self.by_content.get(content, ()) if not chapter.claimed]
+        if not candidates:
+            self.synthesized.append((name, title))
+            return None
+
+        source = min(candidates, key=lambda chapter: abs((chapter.idx or 0) - idx))
+        source.claimed = True
+        self.reused.append((os.path.basename(source.name), name))
+        logger.info(f"Reusing the audio of {source.name} for chapter {idx}: {title}")
+        self._rename(source, name)
+        return source
+
+    def retag(self, chapter: PreviousChapter, output_file, audio_tags: AudioTags):
+        """ 沿用的音頻改用新的章節序號和標題（在線程中調用） """
+        set_audio_tags(output_file, audio_tags)
+        if chapter.summary_audio:
+            set_audio_tags(summary_name(output_file, "mp3"), AudioTags("", "", "", f"{audio_tags.idx:04d}"))
+
+    def finish(self, complete):
+        """ 轉換結束時調用；complete 為 True（轉換了全書所有章節）時刪除沒有被沿用的上一版章節 """
+        if not complete:
+            # 只轉換了部分章節，其餘上一版章節是否仍在新版中還不知道
+            if self.reused:
+                logger.info(f"Reused the audio of {len(self.reused)} renumbered chapters")
+            return
+        leftover = [chapter for chapter in self.previous.values() if not chapter.claimed]
+        if self.reused or leftover:
+            changed = self._pair_changed(leftover)
+            logger.info(f"Compared with the previous edition: {self.unchanged} unchanged, {len(self.reused)} renumbered, "
+                        f"{len(changed)} changed, {len(self.synthesized) - len(changed)} added, "
+                        f"{len(leftover) - len(changed)} removed chapters")
+            for old_name, new_name in changed:
+                logger.info(f"Changed chapter: {old_name} -> {new_name}")
+        produced_stems = {os.path.splitext(name)[0] for name in self.produced}
+        for chapter in leftover:
+            paths = [chapter.name, summary_name(chapter.name, "txt"), summary_name(chapter.name, "mp3")]
+            stem = os.path.splitext(chapter.name)[0]
+            if stem not in produced_stems:
+                # 章節文字；與新章節同名的（暫存的章節）已被新的文字覆蓋，不能刪除
+                paths.append(f"{stem}.txt")
+            self._remove(paths)
+            self.journal.remove(chapter.name)
+        # 改了編號的章節，新的文字文件已經寫好，刪除舊編號的文字文件
+        self._remove(f"{os.path.splitext(old_name)[0]}.txt" for old_name, _ in self.reused
+                     if os.path.splitext(old_name)[0] not in produced_stems)
+        try:
+            os.rmdir(self._path(PREVIOUS_EDITION_DIR))
+        except OSError:
+            pass
+
+    def _remove(self, names):
+        for name in names:
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+    def _pair_changed(self, leftover) -> list:
+        """ 按標題相似度為重新合成的章節找出上一版，返回 [(上一版文件名, 新文件名)] """
+        pairs = []
+        remaining = list(leftover)
+        for name, title in self.synthesized:
+            best, best_ratio = None, TITLE_SIMILARITY
+            for chapter in remaining:
+                ratio = difflib.SequenceMatcher(None, chapter.title or "", title).ratio()
+                if ratio >= best_ratio:
+                    best, best_ratio = chapter, ratio
+            if best:
+                remaining.remove(best)
+                pairs.append((best.name, name))
+        return pairs
@@ -0,0 +1,230 @@
+import contextlib
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from audiobook_generator.core.utils import count_chinese_chars
+
+logger = logging.getLogger(__name__)
+
+# 中文字數超過這個數目的章節需要生成摘要
+SUMMARY_MIN_CHINESE_CHARS = 2000
+
+# 摘要狀態
+SUMMARY_SKIPPED = "skipped"  # 章節太短，不需要摘要
+SUMMARY_PENDING = "pending"  # 需要生成摘要文字
+SUMMARY_TEXT = "text"  # 摘要文字已生成，還沒有音頻
+SUMMARY_DONE = "done"
+
+CHAPTER_TEXT_FILE = re.compile(r"^(\d{4})_(.*)\.txt$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    folder TEXT PRIMARY KEY,
+    epub_hash TEXT,
+    title TEXT,
+    chapter_count INTEGER,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS chapters (
+    folder TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    file_stem TEXT NOT NULL,
+    chars INTEGER NOT NULL,
+    chinese_chars INTEGER NOT NULL,
+    text_hash TEXT NOT NULL,
+    audio_done INTEGER NOT NULL DEFAULT 0,
+    summary_status TEXT NOT NULL,
+    PRIMARY KEY (folder, idx)
+);
+CREATE INDEX IF NOT EXISTS chapters_audio_pending ON chapters (folder, idx) WHERE audio_done = 0;
+CREATE INDEX IF NOT EXISTS chapters_summary_pending ON chapters (folder, idx) WHERE summary_status IN ('pending', 'text');
+"""
+
+
+def text_hash(text) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_hash(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(1024 * 1024):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def initial_summary_status(chinese_chars) -> str:
+    return SUMMARY_PENDING if chinese_chars > SUMMARY_MIN_CHINESE_CHARS else SUMMARY_SKIPPED
+
+
+class BookState:
+    """ 一本書還要做的事：第一個沒有音頻的章節，以及需要生成摘要文字 / 摘要音頻的章節 """
+    __slots__ = ("first_pending_audio", "summary_pending", "summary_audio_pending")
+
+    def __init__(self, first_pending_audio, summary_pending, summary_audio_pending):
+        self.first_pending_audio = first_pending_audio
+        self.summary_pending = summary_pending
+        self.summary_audio_pending = summary_audio_pending
+
+    @property
+    def needs_summary(self) -> bool:
+        return bool(self.summary_pending or self.summary_audio_pending)
+
+
+class LibraryCatalog:
+    """
+    書庫目錄（SQLite）：每本書的 EPUB 雜湊、章節數，每章的標題、字數、中文字數、文字雜湊、音頻和摘要狀態。
+
+    解析章節時寫入一次（AudiobookGenerator），合成音頻和生成摘要後更新狀態；auto_ebook.py 的掃描和
+    AudioSummaryGenerator 以索引查詢「還有什麼要做」，不再 glob 文件夾和讀取每一章的文字。
+    同一章的文字改變時（例如換了新版的 EPUB），音頻和摘要狀態重置。
+    多個進程可以共用同一個數據庫（WAL 模式），同一個實例可以在多個線程中使用。
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.lock:
+            self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def _folder(folder) -> str:
+        return os.path.abspath(folder)
+
+    def _execute(self, sql, params=()):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """ 多條語句一次提交；在同一線程中可以嵌套調用其他方法 """
+        with self.lock:
+            if self.db.in_transaction:
+                yield
+                return
+            self.db.execute("BEGIN")
+            try:
+                yield
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def record_book(self, folder, epub_hash=None, title=None):
+        self._execute(
+            "INSERT INTO books (folder, epub_hash, title, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (folder) DO UPDATE SET epub_hash = COALESCE(excluded.epub_hash, epub_hash), "
+            "title = COALESCE(excluded.title, title), updated_at = excluded.updated_at",
+            (self._folder(folder), epub_hash, title, time.time()))
+
+    def record_chapter_count(self, folder, chapter_count):
+        folder = self._folder(folder)
+        with self._transaction():
+            self.db.execute(
+                "INSERT INTO books (folder, chapter_count, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (folder) DO UPDATE SET chapter_count = excluded.chapter_count, "
+                "updated_at = excluded.updated_at",
+                (folder, chapter_count, time.time()))
+            # 新版的書章節變少時，刪除多出來的章節
+            self.db.execute("DELETE FROM chapters WHERE folder = ? AND idx > ?", (folder, chapter_count))
+
+    def record_chapter(self, folder, idx, title, file_stem, text):
+        """ 解析出一章時調用；文字和上次記錄的相同時保留音頻和摘要狀態 """
+        chinese_chars = count_chinese_chars(text)
+        self._execute(
+            "INSERT INTO chapters (folder, idx, title, file_stem, chars, chinese_chars, text_hash, summary_status) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (folder, idx) DO UPDATE SET "
+            "audio_done = CASE WHEN text_hash = excluded.text_hash AND file_stem = excluded.file_stem "
+            "THEN audio_done ELSE 0 END, "
+            "summary_status = CASE WHEN text_hash = excluded.text_hash AND file_stem = excluded.file_stem "
+            "THEN summary_status ELSE excluded.summary_status END, "
+            "title = excluded.title, file_stem = excluded.file_stem, chars = excluded.chars, "
+            "chinese_chars = excluded.chinese_chars, text_hash = excluded.text_hash",
+            (self._folder(folder), idx, title, file_stem, len(text), chinese_chars, text_hash(text),
+             initial_summary_status(chinese_chars)))
+
+    def mark_audio_done(self, folder, idx):
+        self._execute("UPDATE chapters SET audio_done = 1 WHERE folder = ? AND idx = ?", (self._folder(folder), idx))
+
+    def mark_summary(self, folder, idx, status):
+        self._execute("UPDATE chapters SET summary_status = ? WHERE folder = ? AND idx = ?",
+                      (status, self._folder(folder), idx))
+
+    def epub_replaced(self, folder, epub_path) -> bool:
+        """ 文件夾中的 EPUB 在上次轉換之後換成了內容不同的文件（例如新版）；只有修改時間較新時才計算雜湊 """
+        folder = self._folder(folder)
+        rows = self._execute("SELECT epub_hash, updated_at FROM books WHERE folder = ?", (folder,))
+        if not rows or rows[0][0] is None or os.stat(epub_path).st_mtime <= rows[0][1]:
+            return False
+        if file_hash(epub_path) == rows[0][0]:
+            self.record_book(folder)
+            return False
+        return True
+
+    def is_known(self, folder) -> bool:
+        """ 章節總數已知，而且每一章都有記錄 """
+        rows = self._execute(
+            "SELECT chapter_count, (SELECT COUNT(*) FROM chapters WHERE chapters.folder = books.folder) "
+            "FROM books WHERE folder = ?", (self._folder(folder),))
+        return bool(rows) and rows[0][0] is not None and rows[0][0] == rows[0][1]
+
+    def book_state(self, folder):
+        """ 返回 BookState；目錄還沒有這本書的完整記錄時返回 None """
+        if not self.is_known(folder):
+            return None
+        folder = self._folder(folder)
+        first_pending = self._execute(
+            "SELECT MIN(idx) FROM chapters WHERE folder = ? AND audio_done = 0", (folder,))[0][0]
+        summary = self._execute(
+            "SELECT idx, summary_status FROM chapters WHERE folder = ? AND summary_status IN ('pending', 'text') "
+            "ORDER BY idx", (folder,))
+        return BookState(first_pending,
+                         [idx for idx, status in summary if status == SUMMARY_PENDING],
+                         [idx for idx, status in summary if status == SUMMARY_TEXT])
+
+    def summary_chapters(self, folder, status) -> list:
+        """ 摘要狀態為 status 的章節 [(idx, file_stem)] """
+        return self._execute(
+            "SELECT idx, file_stem FROM chapters WHERE folder = ? AND summary_status = ? ORDER BY idx",
+            (self._folder(folder), status))
+
+    def import_folder(self, folder):
+        """
+        從文件夾中已有的文件建立一本書的記錄（本目錄出現之前轉換的書籍），每本書只需要做一次：
+        章節文字來自 NNNN_標題.txt，音頻狀態來自同名 .mp3，摘要狀態來自 NNNNS_標題.txt / .mp3。
+        """
+        names = set(os.listdir(folder))
+        chapters = sorted((int(match.group(1)), match.group(2), name[:-4])
+                          for name in names if (match := CHAPTER_TEXT_FILE.match(name)))
+        texts = []
+        for idx, title, stem in chapters:
+            with open(os.path.join(folder, f"{stem}.txt"), encoding="utf-8") as f:
+                texts.append(f.read())
+        # 全書一次提交，不必每章等待一次寫入
+        with self._transaction():
+            for (idx, title, stem), text in zip(chapters, texts):
+                self.record_chapter(folder, idx, title, stem, text)
+                if f"{stem}.mp3" in names:
+                    self.mark_audio_done(folder, idx)
+                summary_stem = f"{stem[:4]}S{stem[4:]}"
+                if f"{summary_stem}.mp3" in names:
+                    self.mark_summary(folder, idx, SUMMARY_DONE)
+                elif f"{summary_stem}.txt" in names:
+                    self.mark_summary(folder, idx, SUMMARY_TEXT)
+            # 章節序號不連續（只轉換過部分章節）時記錄不完整，book_state 仍返回 None
+            self.record_chapter_count(folder, chapters[-1][0] if chapters else 0)
+        logger.info(f"Imported {len(chapters)} chapters of {folder} into the library catalog")
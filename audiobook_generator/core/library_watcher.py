@@ -0,0 +1,199 @@
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+import sys
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+ROOT_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE | IN_ONLYDIR
+BOOK_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def is_book_dir_name(name) -> bool:
+    """ 以 . 或 @ 開頭的文件夾（快取、NAS 的系統文件夾）不是書籍 """
+    return not name.startswith(('.', '@'))
+
+
+class InotifyWatcher:
+    """
+    以 Linux inotify 監視書庫：根目錄中寫完或移入的 .epub、新建的書籍文件夾，以及書籍文件夾中文件的寫入、移動和刪除。
+    沒有變化時不佔用任何 CPU 或磁盤讀取；事件在 debounce 秒內合併，一次返回。
+
+    changes() 返回有變化的路徑集合：根目錄中的 .epub 文件或書籍文件夾；包含根目錄本身時表示事件隊列溢出，需要完整掃描。
+    """
+
+    def __init__(self, base_path, debounce=0.2):
+        self.base_path = Path(base_path)
+        self.debounce = debounce
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_init1: {os.strerror(ctypes.get_errno())}")
+        self.watches = {}  # wd -> 文件夾
+        self.pending = set()
+        self.ready = asyncio.Event()
+        self.loop = None
+        try:
+            self._add_watch(self.base_path, ROOT_MASK)
+            for entry in os.scandir(self.base_path):
+                if entry.is_dir() and is_book_dir_name(entry.name):
+                    self._add_watch(Path(entry.path), BOOK_MASK)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def _add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_add_watch {path}: {os.strerror(error)}")
+        self.watches[wd] = path
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.fd, self._read_events)
+
+    def close(self):
+        if self.loop:
+            self.loop.remove_reader(self.fd)
+            self.loop = None
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def _read_events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            self._handle_event(wd, mask, name)
+        if self.pending:
+            self.ready.set()
+
+    def _handle_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("inotify event queue overflowed, rescanning the library")
+            self.pending.add(self.base_path)
+            return
+        if mask & IN_IGNORED:
+            # 文件夾被刪除或移走
+            self.watches.pop(wd, None)
+            return
+        folder = self.watches.get(wd)
+        if folder is None:
+            return
+        if folder != self.base_path:
+            if not mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                self.pending.add(folder)
+            return
+
+        path = folder / name
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO) and is_book_dir_name(name):
+                try:
+                    self._add_watch(path, BOOK_MASK)
+                except OSError as e:
+                    logger.warning(f"Cannot watch {path}, changes in it are only picked up by a full rescan: {e}")
+                self.pending.add(path)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and name.lower().endswith(".epub"):
+            # 只在文件寫完（或整個移入）後報告，複製到一半的 EPUB 不會被拿去轉換
+            self.pending.add(path)
+
+    async def changes(self) -> set:
+        if self.loop is None:
+            self.start()
+        await self.ready.wait()
+        # 合併同一批操作（例如複製整個文件夾）產生的事件
+        await asyncio.sleep(self.debounce)
+        changes, self.pending = self.pending, set()
+        self.ready.clear()
+        return changes
+
+
+class PollingWatcher:
+    """
+    沒有 inotify 時（非 Linux、或 inotify 的 watch 數量已用完）的後備：每 interval 秒只讀取根目錄的列表和
+    各書籍文件夾的修改時間（文件夾中增加、刪除或改名文件時會改變），不讀取任何章節文件。
+    根目錄中的 .epub 在兩次輪詢之間大小和修改時間都不變後才報告，避免轉換複製到一半的文件。
+    """
+
+    def __init__(self, base_path, interval=1.0):
+        self.base_path = Path(base_path)
+        self.interval = interval
+        self.snapshot = self._snapshot()
+        # 已發現但還在變化的 .epub
+        self.unsettled = set()
+
+    def _snapshot(self) -> dict:
+        snapshot = {}
+        for entry in os.scandir(self.base_path):
+            try:
+                if entry.is_dir():
+                    if is_book_dir_name(entry.name):
+                        snapshot[Path(entry.path)] = entry.stat().st_mtime_ns
+                elif entry.name.lower().endswith(".epub"):
+                    stat = entry.stat()
+                    snapshot[Path(entry.path)] = (stat.st_size, stat.st_mtime_ns)
+            except FileNotFoundError:
+                continue
+        return snapshot
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def changes(self) -> set:
+        while True:
+            await asyncio.sleep(self.interval)
+            previous, self.snapshot = self.snapshot, await asyncio.to_thread(self._snapshot)
+            changes = set()
+            for path, state in self.snapshot.items():
+                if isinstance(state, tuple):
+                    if previous.get(path) != state:
+                        self.unsettled.add(path)
+                    elif path in self.unsettled:
+                        self.unsettled.discard(path)
+                        changes.add(path)
+                elif previous.get(path) != state:
+                    changes.add(path)
+            self.unsettled &= self.snapshot.keys()
+            if changes:
+                return changes
+
+
+def open_library_watcher(base_path, poll_interval=1.0):
+    """ Linux 上使用 inotify，不可用時改為輪詢 """
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(base_path)
+        except OSError as e:
+            hint = " (raise fs.inotify.max_user_watches)" if e.errno == errno.ENOSPC else ""
+            logger.warning(f"inotify is not available{hint}, polling every {poll_interval:g}s instead: {e}")
+    return PollingWatcher(base_path, poll_interval)
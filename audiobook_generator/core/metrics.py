@@ -0,0 +1,306 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+PARSE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels) -> tuple:
+        if len(labels) != len(self.labelnames) or any(name not in labels for name in self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key) -> dict:
+        return dict(zip(self.labelnames, key))
+
+    def reset(self):
+        with self.lock:
+            self.values.clear()
+
+    def samples(self):
+        """ 返回 [(名稱後綴, 標籤, 數值)]，用於 Prometheus 文本格式 """
+        raise NotImplementedError
+
+    def snapshot(self) -> list:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self.lock:
+            return [("", self._labels(key), value) for key, value in self.values.items()]
+
+    def snapshot(self) -> list:
+        return [{"labels": labels, "value": value} for _, labels, value in self.samples()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # [各桶計數（非累計）, 總和, 次數]
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][next(i for i, bound in enumerate(self.buckets) if value <= bound)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels) -> int:
+        entry = self.values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def _entries(self):
+        with self.lock:
+            return [(self._labels(key), list(counts), total, count) for key, (counts, total, count) in self.values.items()]
+
+    def samples(self):
+        samples = []
+        for labels, counts, total, count in self._entries():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, count))
+        return samples
+
+    def quantile(self, counts, count, fraction):
+        """ 以所在桶的上限估算分位數 """
+        rank = fraction * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound if bound != math.inf else self.buckets[-2]
+        return None
+
+    def snapshot(self) -> list:
+        return [{
+            "labels": labels,
+            "count": count,
+            "sum": round(total, 4),
+            "mean": round(total / count, 4) if count else None,
+            "p50_upper": self.quantile(counts, count, 0.5),
+            "p95_upper": self.quantile(counts, count, 0.95),
+        } for labels, counts, total, count in self._entries()]
+
+
+class MetricsRegistry:
+    """ 進程內的指標集合，可輸出為 Prometheus textfile 或 JSON """
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _get(self, metric_class, name, help_text, labelnames, **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = metric_class(name, help_text, labelnames, **kwargs)
+        elif not isinstance(metric, metric_class) or metric.labelnames != tuple(labelnames):
+            raise ValueError(f"Metric {name} is already registered with a different type or labels")
+        return metric
+
+    def counter(self, name, help_text, labelnames=()) -> Counter:
+        return self._get(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()) -> Gauge:
+        return self._get(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def reset(self):
+        for metric in self.metrics.values():
+            metric.reset()
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            samples = metric.samples()
+            if not samples:
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        return {
+            metric.name: {"type": metric.kind, "help": metric.help, "values": values}
+            for metric in self.metrics.values() if (values := metric.snapshot())
+        }
+
+
+def write_atomic(path, text):
+    """ 先寫入同目錄的暫存文件再改名，讀取的一方（例如 node_exporter）不會讀到寫了一半的文件 """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+# 整個進程共用的指標
+metrics = MetricsRegistry()
+
+CHAPTERS = metrics.counter("audiobook_chapters_total", "Chapters parsed.")
+CHAPTER_CHARS = metrics.counter("audiobook_chapter_chars_total", "Characters of text in parsed chapters.")
+CHAPTER_PARSE_SECONDS = metrics.histogram(
+    "audiobook_chapter_parse_seconds", "Time to parse and clean one chapter.", buckets=PARSE_BUCKETS)
+SEGMENTS = metrics.counter(
+    "audiobook_tts_segments_total", "Segments submitted to the TTS scheduler (cache hits excluded).", ["provider"])
+TTS_REQUEST_SECONDS = metrics.histogram(
+    "audiobook_tts_request_seconds", "Time from dispatch to completion of one TTS segment, including retries.",
+    ["provider", "outcome"])
+RETRIES = metrics.counter("audiobook_retries_total", "Failed requests that were retried.", ["service"])
+RESUMED_SEGMENTS = metrics.counter(
+    "audiobook_resumed_segments_total", "Segments already written by an earlier run and not synthesized again.")
+AUDIO_BYTES = metrics.counter("audiobook_audio_bytes_written_total", "Audio bytes written to output files.")
+CACHE_LOOKUPS = metrics.counter("audiobook_cache_lookups_total", "Cache lookups by cache and result.",
+                                ["cache", "result"])
+QUEUED_SEGMENTS = metrics.gauge(
+    "audiobook_scheduler_queued_segments", "Segments waiting for a free request slot.", ["provider"])
+INFLIGHT_REQUESTS = metrics.gauge("audiobook_scheduler_inflight_requests", "TTS requests in flight.", ["provider"])
+CONCURRENCY_LIMIT = metrics.gauge("audiobook_concurrency_limit", "Current concurrency limit.", ["limiter"])
+BUFFERED_AUDIO_BYTES = metrics.gauge(
+    "audiobook_buffered_audio_bytes", "Audio held in memory until earlier segments are written.")
+LLM_REQUEST_SECONDS = metrics.histogram(
+    "audiobook_llm_request_seconds", "Time of one summary LLM request.", ["outcome"])
+RUN_INFO = metrics.gauge("audiobook_run_info", "The book being converted.", ["book", "tts"])
+RUN_START = metrics.gauge("audiobook_run_start_timestamp_seconds", "Start time of the current run.")
+LAST_UPDATE = metrics.gauge("audiobook_last_update_timestamp_seconds", "Time the metrics were last written.")
+RUN_FAILED = metrics.gauge("audiobook_run_failed", "1 if the last run ended with an error.")
+
+
+class MetricsExporter:
+    """
+    以 async with 包住一次轉換：每 interval 秒把指標寫到 Prometheus textfile（供 node_exporter 的 textfile collector 讀取），
+    結束時再寫一次，並輸出本書的 JSON 摘要。兩個路徑都沒有設定時不做任何事。
+    """
+
+    def __init__(self, textfile=None, json_file=None, interval=15, book=None, tts=None, registry=metrics):
+        self.textfile = textfile
+        self.json_file = json_file
+        self.interval = interval
+        self.book = book
+        self.tts = tts
+        self.registry = registry
+        self.started = None
+        self.task = None
+
+    async def __aenter__(self):
+        if not self.textfile and not self.json_file:
+            return self
+        self.started = time.time()
+        RUN_INFO.set(1, book=self.book or "", tts=self.tts or "")
+        RUN_START.set(self.started)
+        RUN_FAILED.set(0)
+        if self.textfile:
+            await self.write_textfile()
+            self.task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.started is None:
+            return False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        RUN_FAILED.set(0 if exc_type is None else 1)
+        try:
+            if self.textfile:
+                await self.write_textfile()
+            if self.json_file:
+                await asyncio.to_thread(write_atomic, self.json_file, json.dumps(
+                    self.summary(exc_type is None), ensure_ascii=False, indent=2))
+                logger.info(f"Metrics summary written to {self.json_file}")
+        except OSError as e:
+            logger.warning(f"Failed to write metrics: {e}")
+        return False
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.write_textfile()
+            except OSError as e:
+                logger.warning(f"Failed to write metrics textfile {self.textfile}: {e}")
+
+    async def write_textfile(self):
+        LAST_UPDATE.set(time.time())
+        await asyncio.to_thread(write_atomic, self.textfile, self.registry.to_prometheus())
+
+    def summary(self, succeeded=True) -> dict:
+        finished = time.time()
+        return {
+            "book": self.book,
+            "tts": self.tts,
+            "status": "ok" if succeeded else "failed",
+            "started_at": datetime.fromtimestamp(self.started, timezone.utc).isoformat(timespec="seconds"),
+            "elapsed_seconds": round(finished - self.started, 3),
+            "metrics": self.registry.snapshot(),
+        }
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_NAME = ".resume_journal.jsonl"
+# 換了新版 EPUB 時，被新章節佔用文件名的舊章節暫存在這裡，見 EditionDiff
+PREVIOUS_EDITION_DIR = ".previous_edition"
+
+
+class ChapterProgress:
+    __slots__ = ("fingerprint", "segments", "committed", "offset", "done")
+
+    def __init__(self, fingerprint, segments):
+        self.fingerprint = fingerprint
+        self.segments = segments
+        # 前 committed 個片段已按次序寫入 .part 文件的前 offset 個字節
+        self.committed = 0
+        self.offset = 0
+        self.done = False
+
+
+class ResumeJournal:
+    """
+    每本書一個的續傳日誌，放在輸出文件夾，格式為只追加的 JSON Lines：
+      {"version": 1}                                          第一行
+      {"chapter": 文件名, "idx": 章節序號, "content": ..., "title": 標題}
+                                                               解析到的章節，content 為聲音設定和章節文字的雜湊
+      {"chapter_count": N}                                     全書章節數
+      {"chapter": 文件名, "fingerprint": ..., "segments": N}     開始寫入，fingerprint 為聲音設定和各片段內容的雜湊
+      {"chapter": 文件名, "committed": k, "offset": 字節數}       前 k 個片段已寫入 .part 文件
+      {"chapter": 文件名, "done": true}                          .part 已改名為輸出文件
+      {"chapter": 文件名, "renamed": 新文件名}                    輸出文件已改名（新版 EPUB 的章節重新編號）
+      {"chapter": 文件名, "removed": true}                       輸出文件已刪除
+
+    重新運行時，同一章的 fingerprint 不變就把 .part 截到 offset，從第 k 個片段接著合成；已完成的章節不再合成。
+    每條記錄寫入後即關閉文件，進程崩潰時最多丟失正在寫的一條；不做 fsync，斷電時可能回退到較早的進度，但不會跳過未寫入的片段。
+    """
+    VERSION = 1
+
+    def __init__(self, folder, identity: dict = None, resume=True):
+        self.path = os.path.join(folder, JOURNAL_NAME)
+        self.identity = identity or {}
+        self.chapters = {}  # 文件名 -> ChapterProgress
+        self.indexes = {}  # 文件名 -> 章節序號
+        self.contents = {}  # 文件名 -> (content, 標題)
+        self.chapter_count = None
+        # 載入的記錄在第一次寫入前壓縮成每章一條，日誌不會無限增長
+        self.compacted = False
+        if resume:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        if not lines or self._parse(lines[0]) != {"version": self.VERSION}:
+            logger.warning(f"Ignoring resume journal of another version: {self.path}")
+            return
+        for line in lines[1:]:
+            record = self._parse(line)
+            if record is not None:
+                self._apply(record)
+
+    @staticmethod
+    def _parse(line):
+        try:
+            return json.loads(line)
+        except ValueError:
+            # 崩潰時寫了一半的最後一行
+            return None
+
+    def _apply(self, record):
+        if "chapter_count" in record:
+            self.chapter_count = record["chapter_count"]
+            return
+        name = record.get("chapter")
+        if "renamed" in record:
+            new_name = record["renamed"]
+            for entries in (self.indexes, self.contents, self.chapters):
+                if name in entries:
+                    entries[new_name] = entries.pop(name)
+        elif record.get("removed"):
+            for entries in (self.indexes, self.contents, self.chapters):
+                entries.pop(name, None)
+        elif "idx" in record:
+            self.indexes[name] = record["idx"]
+            if "content" in record:
+                self.contents[name] = (record["content"], record.get("title"))
+        elif "fingerprint" in record:
+            self.chapters[name] = ChapterProgress(record["fingerprint"], record["segments"])
+        elif name in self.chapters:
+            progress = self.chapters[name]
+            if "committed" in record:
+                progress.committed = record["committed"]
+                progress.offset = record["offset"]
+            if record.get("done"):
+                progress.done = True
+
+    def _records(self):
+        yield {"version": self.VERSION}
+        if self.chapter_count is not None:
+            yield {"chapter_count": self.chapter_count}
+        for name, idx in self.indexes.items():
+            if name in self.contents:
+                content, title = self.contents[name]
+                yield {"chapter": name, "idx": idx, "content": content, "title": title}
+            else:
+                yield {"chapter": name, "idx": idx}
+        for name, progress in self.chapters.items():
+            yield {"chapter": name, "fingerprint": progress.fingerprint, "segments": progress.segments}
+            if progress.committed:
+                yield {"chapter": name, "committed": progress.committed, "offset": progress.offset}
+            if progress.done:
+                yield {"chapter": name, "done": True}
+
+    def _append(self, record):
+        self._apply(record)
+        if not self.compacted:
+            self.compacted = True
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(line, ensure_ascii=False) + "\n" for line in self._records())
+            os.replace(tmp_path, self.path)
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def fingerprint(self, segments) -> str:
+        data = json.dumps({"identity": self.identity, "segments": segments}, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def content_hash(self, text) -> str:
+        """ 章節文字和聲音設定的雜湊；相同時上次合成的音頻可以直接使用 """
+        return self.fingerprint([text])
+
+    def progress(self, name, fingerprint) -> ChapterProgress:
+        """ 返回可以接續的進度；沒有記錄或設定 / 內容已改變時返回 None """
+        progress = self.chapters.get(name)
+        if progress is None or progress.fingerprint != fingerprint:
+            return None
+        return progress
+
+    def record_chapter(self, idx, name, content=None, title=None):
+        if self.indexes.get(name) != idx or (content and self.contents.get(name) != (content, title)):
+            record = {"chapter": name, "idx": idx}
+            if content:
+                record.update(content=content, title=title)
+            self._append(record)
+
+    def rename(self, name, new_name):
+        self._append({"chapter": name, "renamed": new_name})
+
+    def remove(self, name):
+        self._append({"chapter": name, "removed": True})
+
+    def record_chapter_count(self, chapter_count):
+        if self.chapter_count != chapter_count:
+            self._append({"chapter_count": chapter_count})
+
+    def start(self, name, fingerprint, segments):
+        self._append({"chapter": name, "fingerprint": fingerprint, "segments": segments})
+
+    def commit(self, name, committed, offset):
+        self._append({"chapter": name, "committed": committed, "offset": offset})
+
+    def finish(self, name):
+        self._append({"chapter": name, "done": True})
+
+    def is_done(self, name, folder) -> bool:
+        progress = self.chapters.get(name)
+        return bool(progress and progress.done and os.path.exists(os.path.join(folder, name)))
+
+    def pending_chapters(self, folder) -> list:
+        """
+        返回未完成章節的序號：已解析但未完成的章節，加上知道章節總數時從未記錄過的序號；
+        還不知道章節總數（上次運行在解析完之前中斷）時，最後一個已知章節之後的一章也算未完成。暫存的舊版章節不計。
+        不知道任何章節（例如從未解析過）時返回 None。
+        """
+        indexes = {name: idx for name, idx in self.indexes.items() if not name.startswith(PREVIOUS_EDITION_DIR)}
+        if not indexes and self.chapter_count is None:
+            return None
+        known = set(indexes.values())
+        pending = {idx for name, idx in indexes.items() if not self.is_done(name, folder)}
+        if self.chapter_count is not None:
+            pending.update(idx for idx in range(1, self.chapter_count + 1) if idx not in known)
+        else:
+            pending.add(max(known) + 1)
+        return sorted(pending)
@@ -0,0 +1,207 @@
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from collections import deque
+
+from audiobook_generator.core.adaptive_limiter import AdaptiveLimiter
+from audiobook_generator.core.audio_writer import AudioBufferBudget, SegmentSink
+from audiobook_generator.core.metrics import INFLIGHT_REQUESTS, QUEUED_SEGMENTS, SEGMENTS, TTS_REQUEST_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_MAX_BUFFERED_MB = 64  # 沒有傳入共用緩衝上限時使用
+
+
+class _Job:
+    __slots__ = ("chapter", "book", "weight", "func", "args", "future", "sink", "started", "context")
+
+    def __init__(self, chapter, book, weight, func, args, future, sink=None):
+        self.chapter = chapter
+        self.book = book
+        self.weight = weight
+        self.func = func
+        self.args = args
+        self.future = future
+        self.sink = sink
+        self.started = None
+        # 在提交者的 context 中運行，請求的日誌仍歸屬提交它的書（見 auto_ebook.py 的常駐模式）
+        self.context = contextvars.copy_context()
+
+
+class _ChapterJobs:
+    __slots__ = ("book", "pending", "remaining")
+
+    def __init__(self, book):
+        self.book = book
+        self.pending = deque()
+        # 尚未完成（排隊中 + 進行中）的工作量，通常是字數
+        self.remaining = 0
+
+
+class SegmentScheduler:
+    """
+    全書共用的語音合成請求排程器。
+
+    各 TTS provider 把每個片段（段落 / chunk / 整章）作為一個工作交給排程器，
+    同一時間最多只有 limiter.limit 個請求在進行（上限按延遲和錯誤自動調整，見 AdaptiveLimiter）。
+    有空位時，優先處理剩餘工作量最大的章節（Longest Processing Time first），避免最後只剩一條長章節單獨在跑。
+    多本書共用同一個排程器時（auto_ebook.py 的常駐模式），先選進行中請求最少的書，再在這本書中按上面的規則選章節，
+    每本書輪流得到空出的名額，長書不會把短書擠到最後。
+    音頻緩衝已滿時只派發能直接寫入文件的片段，等前面的片段完成、騰出空間後再派發其他片段。
+    """
+
+    def __init__(self, max_inflight, limiter: AdaptiveLimiter = None, cache=None, budget: AudioBufferBudget = None,
+                 provider="tts"):
+        self.limiter = limiter or AdaptiveLimiter("TTS", max_inflight, max_inflight, adaptive=False)
+        # SynthesisCache，命中的片段不佔用名額
+        self.cache = cache
+        self.budget = budget or AudioBufferBudget(DEFAULT_MAX_BUFFERED_MB)
+        self.budget.listeners.append(self._dispatch)
+        # 指標的 provider 標籤
+        self.provider = provider
+        self.inflight = 0
+        self.peak_inflight = 0
+        self.submitted = 0
+        self.queued = 0
+        self.chapters = {}
+        # 各書進行中的請求數
+        self.book_inflight = {}
+
+    @property
+    def max_inflight(self) -> int:
+        return self.limiter.max_limit
+
+    def submit(self, chapter, weight, func, *args, sink: SegmentSink = None) -> asyncio.Future:
+        """ 排入一個工作 func(*args)，返回其結果的 Future；chapter 為章節的鍵（例如輸出文件名），sink 為工作寫入的片段 """
+        future = asyncio.get_running_loop().create_future()
+        jobs = self.chapters.get(chapter)
+        if jobs is None:
+            jobs = self.chapters[chapter] = _ChapterJobs(self._book_of(chapter))
+        jobs.pending.append(_Job(chapter, jobs.book, weight, func, args, future, sink))
+        jobs.remaining += weight
+        self.submitted += 1
+        self.queued += 1
+        SEGMENTS.inc(provider=self.provider)
+        self._dispatch()
+        return future
+
+    @staticmethod
+    def _book_of(chapter):
+        """ 章節的鍵是輸出文件路徑時，所在的文件夾就是一本書 """
+        return os.path.dirname(chapter) if isinstance(chapter, str) else None
+
+    async def synthesize(self, chapter, text, sink: SegmentSink, func, *args):
+        """
+        合成一個片段：func(sink, *args) 把 text 的音頻寫入 sink，以文字長度為工作量。
+        有快取時先查快取，命中的片段不佔用名額；完成後 finish sink。上次運行已寫入文件的片段直接跳過。
+        """
+        if sink.resumed:
+            return
+        key = None
+        if self.cache is not None:
+            key = self.cache.make_key(text)
+            await self.budget.wait_for_room(sink)
+            audio = await self.cache.get(key)
+            if audio is not None:
+                await sink.write(audio)
+                await sink.finish()
+                return
+            sink.capture = []
+
+        await self.submit(chapter, len(text), func, sink, *args, sink=sink)
+        await sink.finish()
+        if key is not None and sink.capture:
+            await self.cache.put(key, b''.join(sink.capture))
+        sink.capture = None
+
+    async def gather(self, futures):
+        """ 按原順序返回結果；任何一個失敗或被取消時，取消同一批其餘的工作 """
+        futures = [asyncio.ensure_future(future) for future in futures]
+        try:
+            return await asyncio.gather(*futures)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def _next_job(self):
+        if self.budget.full:
+            return self._next_head_job()
+        while True:
+            candidates = [((-self.book_inflight.get(jobs.book, 0), jobs.remaining), chapter)
+                          for chapter, jobs in self.chapters.items() if jobs.pending]
+            if not candidates:
+                return None
+            # max 在相同條件時取最先提交的章節
+            _, chapter = max(candidates, key=lambda candidate: candidate[0])
+            jobs = self.chapters[chapter]
+            job = jobs.pending.popleft()
+            self.queued -= 1
+            if job.future.cancelled():
+                self._job_finished(job)
+                continue
+            return job
+
+    def _next_head_job(self):
+        """ 緩衝已滿時，只取寫入器當前片段的工作，這些片段的數據直接寫入文件，完成後緩衝才能騰出空間 """
+        for jobs in self.chapters.values():
+            for job in jobs.pending:
+                if job.future.cancelled():
+                    continue
+                if job.sink is None or job.sink.is_head:
+                    jobs.pending.remove(job)
+                    self.queued -= 1
+                    return job
+        return None
+
+    def _dispatch(self):
+        while self.inflight < self.limiter.limit:
+            job = self._next_job()
+            if job is None:
+                break
+            self.inflight += 1
+            self.book_inflight[job.book] = self.book_inflight.get(job.book, 0) + 1
+            self.limiter.inflight = self.inflight
+            self.peak_inflight = max(self.peak_inflight, self.inflight)
+            job.started = time.monotonic()
+            task = job.context.run(asyncio.ensure_future, job.func(*job.args))
+            job.future.add_done_callback(lambda future, task=task: task.cancel() if future.cancelled() else None)
+            task.add_done_callback(lambda task, job=job: self._on_done(job, task))
+        QUEUED_SEGMENTS.set(self.queued, provider=self.provider)
+        INFLIGHT_REQUESTS.set(self.inflight, provider=self.provider)
+
+    def _on_done(self, job, task):
+        self.inflight -= 1
+        self.book_inflight[job.book] -= 1
+        if not self.book_inflight[job.book]:
+            del self.book_inflight[job.book]
+        self.limiter.inflight = self.inflight
+        self._job_finished(job)
+        if task.cancelled():
+            outcome = "cancelled"
+        elif task.exception() is not None:
+            outcome = "error"
+            self.limiter.on_failure(task.exception(), job.started)
+        else:
+            outcome = "ok"
+            self.limiter.on_success(job.started)
+        TTS_REQUEST_SECONDS.observe(time.monotonic() - job.started, provider=self.provider, outcome=outcome)
+        if not job.future.done():
+            if task.cancelled():
+                job.future.cancel()
+            elif task.exception() is not None:
+                job.future.set_exception(task.exception())
+            else:
+                job.future.set_result(task.result())
+        self._dispatch()
+
+    def _job_finished(self, job):
+        jobs = self.chapters.get(job.chapter)
+        if jobs is None:
+            return
+        jobs.remaining -= job.weight
+        if not jobs.pending and jobs.remaining <= 0:
+            del self.chapters[job.chapter]
@@ -0,0 +1,69 @@
+import asyncio
+import hashlib
+import json
+import logging
+
+from audiobook_generator.core.disk_cache import DiskCache
+from audiobook_generator.core.metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+
+class SummaryCache(DiskCache):
+    """
+    章節摘要的磁碟快取，鍵為摘要提示詞、模型、temperature 和章節文字的雜湊，值為寫入 .txt 的摘要文字。
+
+    同一章重新轉換到另一個文件夾、換了新版但內容沒變的章節、重複上傳的書，都不用再請求 LLM。
+    存取和淘汰見 DiskCache；設定 max_age_days 時，寫入超過這個天數的摘要不再使用（模型更新後重新生成）。
+    """
+    NAME = "Summary cache"
+    # 摘要的格式或生成邏輯有改動時，提升版本號使舊快取失效
+    VERSION = 1
+    SUFFIX = ".json"
+
+    def __init__(self, cache_dir, max_size_mb, identity: dict, max_age_days=None):
+        super().__init__(cache_dir, max_size_mb, max_age_days)
+        self.identity = json.dumps({"version": self.VERSION, **identity}, ensure_ascii=False, sort_keys=True)
+        self.hits = 0
+        self.misses = 0
+        self.hit_chars = 0
+
+    def make_key(self, text) -> str:
+        digest = hashlib.sha256(self.identity.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+
+    async def get(self, key):
+        """ 返回摘要文字，沒有快取（或已過期）時返回 None """
+        summary = await asyncio.to_thread(self._read, key)
+        if summary is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.hit_chars += len(summary)
+        CACHE_LOOKUPS.inc(cache="summary", result="miss" if summary is None else "hit")
+        return summary
+
+    async def put(self, key, summary: str):
+        await asyncio.to_thread(self._write, key, summary)
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0.0
+        return (f"hits {self.hits}, misses {self.misses} ({ratio:.0%} hit), {self.expired} expired, "
+                f"{self.hit_chars} summary chars reused")
+
+    def _read(self, key):
+        data = self._read_file(key)
+        if data is None:
+            return None
+        try:
+            return json.loads(data)["summary"]
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring broken summary cache entry {self._path(key)}: {e}")
+            return None
+
+    def _write(self, key, summary):
+        data = json.dumps({"summary": summary}, ensure_ascii=False).encode("utf-8")
+        self._write_file(key, data)
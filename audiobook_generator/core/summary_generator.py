@@ -1,11 +1,19 @@
 import os
 import re
+import json
 import asyncio
 import aiohttp
 import logging
+import time
 from audiobook_generator.config.general_config import GeneralConfig
+from audiobook_generator.core.adaptive_limiter import AdaptiveLimiter
 from audiobook_generator.core.audio_tags import AudioTags
-from audiobook_generator.tts_providers.base_tts_provider import get_async_tts_provider
+from audiobook_generator.core.library_catalog import (LibraryCatalog, SUMMARY_DONE, SUMMARY_MIN_CHINESE_CHARS,
+                                                      SUMMARY_PENDING, SUMMARY_TEXT)
+from audiobook_generator.core.metrics import LLM_REQUEST_SECONDS, RETRIES
+from audiobook_generator.core.summary_cache import SummaryCache
+from audiobook_generator.core.utils import count_chinese_chars
+from audiobook_generator.tts_providers.base_tts_provider import BaseTTSProvider, get_async_tts_provider
 
 # Setup logging
 logger = logging.getLogger(__name__)
@@ -40,19 +48,88 @@ SUMMARY_PROMPT = """
 
 请开始分析下面的文章：
 """
+SUMMARY_TEMPERATURE = 0.7
+SUMMARY_BEGIN = "(本章总结)"
+SUMMARY_END = "(总结结束)"
+# 串流模式中的句子結尾；第一句一完成就交給 TTS，之後每段至少 STREAM_SEGMENT_CHARS 字，減少 TTS 請求次數
+SENTENCE_END = re.compile(r'[。！？!?；;…\n]')
+STREAM_SEGMENT_CHARS = 80
+LLM_MAX_RETRIES = 4
+
+
+class SummaryStream:
+    """ 把 LLM 串流收到的文字切成交給 TTS 的片段（按句子），同時保留完整文字 """
+
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.parts = []
+        # LLM 的回應已完整收到
+        self.finished = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts).strip()
+
+    @staticmethod
+    def _cut(pending, first) -> int:
+        """ 可以交給 TTS 的長度（到某個句子結尾為止）；還不能切時返回 0 """
+        if first:
+            match = SENTENCE_END.search(pending)
+            return match.end() if match else 0
+        cut = 0
+        for match in SENTENCE_END.finditer(pending):
+            cut = match.end()
+        return cut if cut >= STREAM_SEGMENT_CHARS else 0
+
+    async def segments(self):
+        pending = ""
+        prefix = SUMMARY_BEGIN
+        async for delta in self.deltas:
+            self.parts.append(delta)
+            pending += delta
+            if prefix:
+                pending = pending.lstrip()
+            cut = self._cut(pending, bool(prefix))
+            if cut:
+                yield prefix + pending[:cut]
+                pending = pending[cut:]
+                prefix = ""
+        if not self.text:
+            raise ValueError("Empty summary in the LLM response")
+        self.finished = True
+        yield prefix + pending.strip() + SUMMARY_END
+
 
 class AudioSummaryGenerator:
-    def __init__(self, config: GeneralConfig):
+    def __init__(self, config: GeneralConfig, tts_provider: BaseTTSProvider = None, llm_limiter: AdaptiveLimiter = None,
+                 session: aiohttp.ClientSession = None, catalog: LibraryCatalog = None):
         self.config = config
         logger.setLevel(config.log)
+        # LLM 服務與 TTS 分開限流，每次嘗試佔用一個名額，按延遲和錯誤調整並發
+        self.llm_limiter = llm_limiter or AdaptiveLimiter(
+            "LLM", config.initial_inflight_requests, config.max_inflight_requests,
+            adaptive=not config.fixed_concurrency)
+        # 以下傳入時與其他書共用，由調用者關閉
+        self.tts_provider = tts_provider
+        self.session = session
+        self.shared_catalog = catalog
+        self.catalog = None
+        # 以提示詞、模型、temperature 和章節文字為鍵，同樣的章節不再請求 LLM
+        self.summary_cache = SummaryCache(
+            config.sum_cache_dir, config.sum_cache_size,
+            {"prompt": SUMMARY_PROMPT, "model": config.sum_model, "temperature": SUMMARY_TEMPERATURE},
+            config.sum_cache_max_age) if config.sum_cache_dir else None
 
     def _count_chinese_chars(self, text: str) -> int:
         """Counts the number of Chinese characters in a string."""
-        # This regex matches CJK Unified Ideographs, covering both simplified and traditional.
-        return len(re.findall(r'[\u4e00-\u9fff]', text))
+        return count_chinese_chars(text)
+
+    def _mark_summary(self, output_folder, filename, status):
+        if self.catalog:
+            self.catalog.mark_summary(output_folder, int(filename[:4]), status)
 
     def _summary_format(self, text: str) -> str:
-        format_text = f"(本章总结){text}(总结结束)"
+        format_text = f"{SUMMARY_BEGIN}{text}{SUMMARY_END}"
         return format_text
 
     def _llm_url_format(self, base_url: str) -> str:
@@ -78,8 +155,8 @@ class AudioSummaryGenerator:
         return base_url
 
 
-    async def _get_summary_from_llm_async(self, session: aiohttp.ClientSession, text: str, filename: str) -> str:
-        """Sends text to LLM and gets a summary asynchronously."""
+    def _llm_request(self, text: str, stream: bool):
+        """ 返回 chat/completions 請求的 (url, headers, data) """
         headers = {
             "Authorization": f"Bearer {self.config.sum_api}",
             "Content-Type": "application/json"
@@ -90,26 +167,34 @@ class AudioSummaryGenerator:
                 {"role": "system", "content": SUMMARY_PROMPT.strip()},
                 {"role": "user", "content": text}
             ],
-            "temperature": 0.7,
-            "stream": False
+            "temperature": SUMMARY_TEMPERATURE,
+            "stream": stream
         }
+        return self._llm_url_format(self.config.sum_url), headers, data
 
-        base_url = self._llm_url_format(self.config.sum_url)
-        max_retries = 4
+    async def _get_summary_from_llm_async(self, session: aiohttp.ClientSession, text: str, filename: str) -> str:
+        """Sends text to LLM and gets a summary asynchronously."""
+        base_url, headers, data = self._llm_request(text, stream=False)
+        max_retries = LLM_MAX_RETRIES
         for attempt in range(max_retries + 1):
+            started = time.monotonic()
             try:
                 logger.debug(f"Requesting LLM for {filename} (Attempt {attempt + 1}/{max_retries + 1})")
-                async with session.post(base_url, headers=headers, json=data, timeout=300) as response:
-                    response.raise_for_status()
-                    result = await response.json()
-                    summary = result['choices'][0]['message']['content'].strip()
-                    return self._summary_format(summary)
-            except aiohttp.ClientError as e:
+                async with self.llm_limiter.slot():
+                    async with session.post(base_url, headers=headers, json=data, timeout=300) as response:
+                        response.raise_for_status()
+                        result = await response.json()
+                        summary = result['choices'][0]['message']['content'].strip()
+                        LLM_REQUEST_SECONDS.observe(time.monotonic() - started, outcome="ok")
+                        return self._summary_format(summary)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                LLM_REQUEST_SECONDS.observe(time.monotonic() - started, outcome="error")
                 logger.warning(f"API request for {filename} failed: {e}")
                 if attempt >= max_retries:
                     logger.error(f"API request for {filename} failed after {max_retries + 1} attempts.")
                     return ""
             except (KeyError, IndexError) as e:
+                LLM_REQUEST_SECONDS.observe(time.monotonic() - started, outcome="invalid")
                 logger.warning(f"Failed to parse LLM response for {filename}: {e}")
                 if attempt >= max_retries:
                     # The response object might not be available here if the error is ClientError
@@ -122,31 +207,125 @@ class AudioSummaryGenerator:
                     return ""
 
             if attempt < max_retries:
+                RETRIES.inc(service="llm")
                 logger.info(f"Retrying for {filename} in 5s...")
                 await asyncio.sleep(5)
         return ""
 
-    async def _process_llm_task(self, semaphore: asyncio.Semaphore, session: aiohttp.ClientSession, task: dict):
-        """Wrapper to process a single LLM task with semaphore."""
-        async with semaphore:
+    async def _stream_summary_from_llm(self, session: aiohttp.ClientSession, text: str, filename: str):
+        """ 以 SSE 串流請求摘要，逐段產出模型生成的文字 """
+        base_url, headers, data = self._llm_request(text, stream=True)
+        started = time.monotonic()
+        logger.debug(f"Requesting streaming LLM for {filename}")
+        try:
+            async with self.llm_limiter.slot():
+                async with session.post(base_url, headers=headers, json=data, timeout=300) as response:
+                    response.raise_for_status()
+                    async for line in response.content:
+                        line = line.decode("utf-8").strip()
+                        if not line.startswith("data:"):
+                            continue
+                        payload = line[5:].strip()
+                        if payload == "[DONE]":
+                            break
+                        choices = json.loads(payload)["choices"]
+                        if choices and (delta := choices[0].get("delta", {}).get("content")):
+                            yield delta
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            LLM_REQUEST_SECONDS.observe(time.monotonic() - started, outcome="error")
+            raise
+        except (KeyError, IndexError, ValueError):
+            LLM_REQUEST_SECONDS.observe(time.monotonic() - started, outcome="invalid")
+            raise
+        LLM_REQUEST_SECONDS.observe(time.monotonic() - started, outcome="ok")
+
+    async def _stream_summary_to_speech(self, session: aiohttp.ClientSession, task: dict, tts_provider) -> str:
+        """
+        串流模式：模型生成摘要的同時，每完成一句（或一段）就交給 TTS 合成，音頻按次序寫入摘要 MP3，
+        第一句的音頻不用等整個回應；回應完整收到後才寫入摘要文字。
+        回應中途失敗時放棄已合成的部分重新請求；文字完整但合成失敗時仍寫入文字，下次運行再合成。
+        返回寫入的摘要文字，失敗時返回空字串。
+        """
+        filename = task['filename']
+        summary_txt_path, summary_mp3_path, _ = self._tts_task(filename, os.path.dirname(task['summary_txt_path']))
+        audio_done = False
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            stream = SummaryStream(self._stream_summary_from_llm(session, task['content'], filename))
+            try:
+                await tts_provider.async_stream_to_speech(
+                    stream.segments(), summary_mp3_path, AudioTags("", "", "", filename[:4]))
+                audio_done = True
+                break
+            except Exception as e:
+                if stream.finished:
+                    logger.error(f"Could not convert summary of {filename} to audio: {e}")
+                    break
+                logger.warning(f"Streaming API request for {filename} failed: {e}")
+                if attempt >= LLM_MAX_RETRIES:
+                    logger.error(f"API request for {filename} failed after {LLM_MAX_RETRIES + 1} attempts.")
+                    return ""
+            RETRIES.inc(service="llm")
+            logger.info(f"Retrying for {filename} in 5s...")
+            await asyncio.sleep(5)
+
+        summary_content = self._summary_format(stream.text)
+        try:
+            with open(summary_txt_path, 'w', encoding='utf-8') as f:
+                f.write(summary_content)
+        except Exception as e:
+            logger.error(f"Could not write summary file {summary_txt_path}: {e}")
+            return ""
+        output_folder = os.path.dirname(summary_txt_path)
+        self._mark_summary(output_folder, filename, SUMMARY_DONE if audio_done else SUMMARY_TEXT)
+        logger.info(f"Successfully generated: {os.path.basename(summary_txt_path)}")
+        return summary_content
+
+    async def _process_llm_task(self, session: aiohttp.ClientSession, task: dict, tts_queue: asyncio.Queue = None,
+                                tts_provider: BaseTTSProvider = None):
+        """Wrapper to process a single LLM task; concurrency is limited per request by llm_limiter."""
+        cache_key = self.summary_cache.make_key(task['content']) if self.summary_cache else None
+        summary_content = await self.summary_cache.get(cache_key) if cache_key else None
+        if summary_content:
+            # 同樣的章節已生成過摘要，不再請求 LLM；串流模式也直接交給 TTS worker
+            logger.info(f"Summary cache hit: {task['filename']}")
+        elif tts_provider is not None:
+            logger.info(f"Generating: {task['filename']}")
+            summary_content = await self._stream_summary_to_speech(session, task, tts_provider)
+            if cache_key and summary_content:
+                await self.summary_cache.put(cache_key, summary_content)
+            return
+        else:
             logger.info(f"Generating: {task['filename']}")
             summary_content = await self._get_summary_from_llm_async(session, task['content'], task['filename'])
-            if summary_content:
-                try:
-                    with open(task['summary_txt_path'], 'w', encoding='utf-8') as f:
-                        f.write(summary_content)
-                    logger.info(f"Successfully generated: {os.path.basename(task['summary_txt_path'])}")
-                except Exception as e:
-                    logger.error(f"Could not write summary file {task['summary_txt_path']}: {e}")
-            else:
-                logger.warning(f"Failed to generate summary for {task['filename']}.")
+            if cache_key and summary_content:
+                await self.summary_cache.put(cache_key, summary_content)
+        if summary_content:
+            try:
+                with open(task['summary_txt_path'], 'w', encoding='utf-8') as f:
+                    f.write(summary_content)
+                self._mark_summary(os.path.dirname(task['summary_txt_path']), task['filename'], SUMMARY_TEXT)
+                logger.info(f"Successfully generated: {os.path.basename(task['summary_txt_path'])}")
+            except Exception as e:
+                logger.error(f"Could not write summary file {task['summary_txt_path']}: {e}")
+                return
+            if tts_queue is not None:
+                # 一生成就交給 TTS，不等其他章節的摘要
+                await tts_queue.put(self._tts_task(task['filename'], os.path.dirname(task['summary_txt_path'])))
+        else:
+            logger.warning(f"Failed to generate summary for {task['filename']}.")
 
-    async def _run_llm_tasks(self, tasks_for_llm: list):
-        """Runs all LLM summary tasks asynchronously with a concurrency limit."""
-        semaphore = asyncio.Semaphore(5)
-        async with aiohttp.ClientSession() as session:
-            async_tasks = [self._process_llm_task(semaphore, session, task) for task in tasks_for_llm]
-            await asyncio.gather(*async_tasks)
+    async def _run_llm_tasks(self, tasks_for_llm: list, tts_queue: asyncio.Queue = None,
+                             tts_provider: BaseTTSProvider = None):
+        """Runs all LLM summary tasks asynchronously with an adaptive concurrency limit."""
+        if not tasks_for_llm:
+            return
+        if self.session:
+            await asyncio.gather(*[self._process_llm_task(self.session, task, tts_queue, tts_provider)
+                                   for task in tasks_for_llm])
+        else:
+            async with aiohttp.ClientSession() as session:
+                async_tasks = [self._process_llm_task(session, task, tts_queue, tts_provider) for task in tasks_for_llm]
+                await asyncio.gather(*async_tasks)
 
     async def run(self):
         output_folder = os.path.dirname(self.config.input_file)
@@ -156,18 +335,36 @@ class AudioSummaryGenerator:
             logger.error(f"Output folder not found: {output_folder}")
             return
 
-        file_pattern = re.compile(r'^\d{4}_.*\.txt$')
-        files_to_process = sorted([f for f in os.listdir(output_folder) if file_pattern.match(f)])
-
-        tasks_for_llm = self.collect_llm_tasks(files_to_process, output_folder)
+        if self.shared_catalog or self.config.catalog:
+            self.catalog = self.shared_catalog or LibraryCatalog(self.config.catalog)
+        try:
+            if self.catalog:
+                if not self.catalog.is_known(output_folder):
+                    await asyncio.to_thread(self.catalog.import_folder, output_folder)
+                # 只讀取還需要摘要的章節，字數在解析時已記錄
+                files_to_process = [f"{stem}.txt" for _, stem in
+                                    self.catalog.summary_chapters(output_folder, SUMMARY_PENDING)]
+            else:
+                file_pattern = re.compile(r'^\d{4}_.*\.txt$')
+                files_to_process = sorted([f for f in os.listdir(output_folder) if file_pattern.match(f)])
 
-        if tasks_for_llm:
-            logger.info(f"Found {len(tasks_for_llm)} file(s) to summarize.")
-            await self._run_llm_tasks(tasks_for_llm)
-        else:
-            logger.info("No new summaries needed.")
+            tasks_for_llm = self.collect_llm_tasks(files_to_process, output_folder)
 
-        await self._run_tts_tasks(files_to_process, output_folder)
+            if tasks_for_llm:
+                logger.info(f"Found {len(tasks_for_llm)} file(s) to summarize.")
+            else:
+                logger.info("No new summaries needed.")
+
+            # 之前已生成文字、還沒有音頻的摘要
+            if self.catalog:
+                files_to_process = [f"{stem}.txt" for _, stem in
+                                    self.catalog.summary_chapters(output_folder, SUMMARY_TEXT)]
+            tasks_for_tts = self.collect_tts_tasks(files_to_process, output_folder)
+            await self._run_pipeline(tasks_for_llm, tasks_for_tts, output_folder)
+        finally:
+            if self.catalog and not self.shared_catalog:
+                self.catalog.close()
+            self.catalog = None
         logger.info(f"Audio Summary finished - {os.path.basename(self.config.input_file)}🎈🎈🎈")
 
     def collect_llm_tasks(self, files_to_process, output_folder):
@@ -177,14 +374,18 @@ class AudioSummaryGenerator:
             summary_txt_path = os.path.join(output_folder, summary_txt_filename)
             summary_mp3_path = os.path.join(output_folder, summary_txt_filename.replace('.txt', '.mp3'))
 
-            if os.path.exists(summary_mp3_path) or os.path.exists(summary_txt_path):
+            if os.path.exists(summary_mp3_path):
+                self._mark_summary(output_folder, filename, SUMMARY_DONE)
+                continue
+            if os.path.exists(summary_txt_path):
+                self._mark_summary(output_folder, filename, SUMMARY_TEXT)
                 continue
 
             source_path = os.path.join(output_folder, filename)
             try:
                 with open(source_path, 'r', encoding='utf-8') as f:
                     content = f.read()
-                if self._count_chinese_chars(content) > 2000:
+                if self._count_chinese_chars(content) > SUMMARY_MIN_CHINESE_CHARS:
                     tasks_for_llm.append({
                         'filename': filename,
                         'content': content,
@@ -196,42 +397,86 @@ class AudioSummaryGenerator:
                 logger.error(f"Could not read source file {source_path}: {e}")
         return tasks_for_llm
 
-    async def _run_tts_tasks(self, files_to_process, output_folder):
-        logger.info("Starting TTS conversion for all available summaries.")
-        tts_provider = await get_async_tts_provider(self.config)
-        semaphore = asyncio.Semaphore(5)
-        tasks = []
+    @staticmethod
+    def _tts_task(filename, output_folder):
+        summary_txt_filename = f"{filename[:4]}S{filename[4:]}"
+        summary_txt_path = os.path.join(output_folder, summary_txt_filename)
+        summary_mp3_path = os.path.join(output_folder, summary_txt_filename.replace('.txt', '.mp3'))
+        return summary_txt_path, summary_mp3_path, filename
 
+    def collect_tts_tasks(self, files_to_process, output_folder):
+        tasks_for_tts = []
         for filename in files_to_process:
-            summary_txt_filename = f"{filename[:4]}S{filename[4:]}"
-            summary_txt_path = os.path.join(output_folder, summary_txt_filename)
-            summary_mp3_path = os.path.join(output_folder, summary_txt_filename.replace('.txt', '.mp3'))
+            summary_txt_path, summary_mp3_path, _ = task = self._tts_task(filename, output_folder)
 
-            if os.path.exists(summary_mp3_path) or not os.path.exists(summary_txt_path):
+            if os.path.exists(summary_mp3_path):
+                self._mark_summary(output_folder, filename, SUMMARY_DONE)
+                continue
+            if not os.path.exists(summary_txt_path):
                 continue
 
-            tasks.append(self._process_tts_task(semaphore, summary_txt_path, summary_mp3_path, filename, tts_provider))
-
-        if tasks:
-            await asyncio.gather(*tasks)
-        else:
+            tasks_for_tts.append(task)
+        return tasks_for_tts
+
+    async def _run_pipeline(self, tasks_for_llm, tasks_for_tts, output_folder):
+        """
+        LLM 和 TTS 兩段流水線：每章的摘要一生成就放入有上限的隊列，由 sum_tts_workers 個 worker 取出合成，
+        TTS 不必等所有摘要都生成完，總耗時接近兩段中較長的一段。LLM 的並發由 llm_limiter 控制，
+        TTS 的片段並發由 provider 的排程器控制；隊列滿時生成好的摘要等待 worker 空出。
+        sum_stream 時新生成的摘要在串流中按句直接合成（見 _stream_summary_to_speech），worker 只處理之前已有文字的摘要。
+        """
+        if not tasks_for_llm and not tasks_for_tts:
             logger.info("No new summaries to convert to audio.")
+            return
+        tts_provider = self.tts_provider or await get_async_tts_provider(self.config)
+        tts_queue = asyncio.Queue(maxsize=self.config.sum_tts_workers * 2)
+        workers = [asyncio.create_task(self._tts_worker(tts_queue, tts_provider))
+                   for _ in range(self.config.sum_tts_workers)]
+        try:
+            await asyncio.gather(self._enqueue(tts_queue, tasks_for_tts),
+                                 self._run_llm_tasks(tasks_for_llm, tts_queue,
+                                                     tts_provider if self.config.sum_stream else None))
+            for _ in workers:
+                await tts_queue.put(None)
+            await asyncio.gather(*workers)
+            if tasks_for_llm:
+                logger.info(f"LLM concurrency: {self.llm_limiter.snapshot()}")
+            if self.summary_cache and tasks_for_llm:
+                logger.info(f"Summary LLM cache: {self.summary_cache.stats()}")
+            if tts_provider.synthesis_cache:
+                logger.info(f"Summary TTS cache: {tts_provider.synthesis_cache.stats()}")
+        finally:
+            for worker in workers:
+                worker.cancel()
+            if self.tts_provider:
+                self.tts_provider.release_journal(output_folder)
+            else:
+                await tts_provider.close()
 
-    async def _process_tts_task(self, semaphore, summary_txt_path, summary_mp3_path, filename, tts_provider):
-        async with semaphore:
-            try:
-                with open(summary_txt_path, 'r', encoding='utf-8') as f:
-                    summary_content = f.read()
-                if summary_content:
-                    id_tag = filename[:4]
-                    sum_count = self._count_chinese_chars(summary_content)
-                    logger.info(f"Converting MP3 ({sum_count} words): {os.path.basename(summary_txt_path)}")
-                    audio_tags = AudioTags("", "", "", id_tag)
-                    await tts_provider.async_text_to_speech(summary_content, summary_mp3_path, audio_tags)
-                else:
-                    logger.warning(f"Summary file {summary_txt_path} is empty, skipping TTS.")
-            except Exception as e:
-                logger.error(f"Could not process summary file {summary_txt_path} for TTS: {e}")
+    @staticmethod
+    async def _enqueue(tts_queue, tasks_for_tts):
+        for task in tasks_for_tts:
+            await tts_queue.put(task)
+
+    async def _tts_worker(self, tts_queue, tts_provider):
+        while (task := await tts_queue.get()) is not None:
+            await self._process_tts_task(*task, tts_provider)
+
+    async def _process_tts_task(self, summary_txt_path, summary_mp3_path, filename, tts_provider):
+        try:
+            with open(summary_txt_path, 'r', encoding='utf-8') as f:
+                summary_content = f.read()
+            if summary_content:
+                id_tag = filename[:4]
+                sum_count = self._count_chinese_chars(summary_content)
+                logger.info(f"Converting MP3 ({sum_count} words): {os.path.basename(summary_txt_path)}")
+                audio_tags = AudioTags("", "", "", id_tag)
+                await tts_provider.async_text_to_speech(summary_content, summary_mp3_path, audio_tags)
+                self._mark_summary(os.path.dirname(summary_mp3_path), filename, SUMMARY_DONE)
+            else:
+                logger.warning(f"Summary file {summary_txt_path} is empty, skipping TTS.")
+        except Exception as e:
+            logger.error(f"Could not process summary file {summary_txt_path} for TTS: {e}")
 
 
 
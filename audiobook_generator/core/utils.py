@@ -1,4 +1,5 @@
 import logging
+import re
 from typing import List
 from mutagen.id3._frames import TIT2, TPE1, TALB, TRCK
 from mutagen.id3 import ID3, ID3NoHeaderError
@@ -6,41 +7,117 @@ from mutagen.id3 import ID3, ID3NoHeaderError
 logger = logging.getLogger(__name__)
 
 
-def split_text(text: str, max_chars: int, language: str) -> List[str]:
-    chunks = []
-    current_chunk = ""
+# 字符類別表：英文字母、數字、標點和中文標點前不切分
+SPECIAL_CHARS = frozenset(
+    [chr(c) for c in range(33, 127)]
+    + list("。，、？！：；“”‘’（）《》【】…—～·「」『』〈〉〖〗〔〕")
+    + list("∶")  # special unicode punctuation
+)
+# 優先在句末切分，其次在分句處切分
+SENTENCE_END_CHARS = "。！？!?"
+CLAUSE_END_CHARS = "；，;,"
+# 句末標點後緊接的引號和括號要跟前一塊
+CLOSING_CHARS = frozenset("」』”’）》】〉〗〕)]\"'")
+# 一句：到句末標點（英文句點後要有空白，不切開 3.14 這類數字）和緊接的引號、括號、空白為止；最後一句可以沒有句末標點
+SENTENCE_RE = re.compile(r'.*?(?:[。！？]|[.!?](?=[\s"\'”’)\]」』）》]|$))+[」』”’）》】〉〗〕)\]"\']*\s*|.+', re.S)
+# 中日韓統一表意文字（簡體和繁體）以外的字符
+NON_CJK_RE = re.compile(r'[^\u4e00-\u9fff]+')
 
-    if language.startswith("zh"):  # Chinese
-        for char in text:
-            if len(current_chunk) + 1 <= max_chars or is_special_char(char):
-                current_chunk += char
-            else:
-                chunks.append(current_chunk)
-                current_chunk = char
 
-        if current_chunk:
-            chunks.append(current_chunk)
+def count_chinese_chars(text: str) -> int:
+    """ 中文字數；刪去其他字符後取長度，比 re.findall 逐字建立列表快約 5 倍 """
+    return len(NON_CJK_RE.sub('', text))
+
 
+def split_text(text: str, max_chars: int, language: str) -> List[str]:
+    if language.startswith("zh"):  # Chinese
+        chunks = _split_chinese_text(text, max_chars)
     else:
-        words = text.split()
+        chunks = _split_words(text, max_chars)
 
-        for word in words:
-            if len(current_chunk) + len(word) + 1 <= max_chars:
-                current_chunk += (" " if current_chunk else "") + word
+    logger.info(f"Split text into {len(chunks)} chunks")
+    if logger.isEnabledFor(logging.DEBUG):
+        for i, chunk in enumerate(chunks, 1):
+            first_100 = chunk[:100]
+            last_100 = chunk[-100:] if len(chunk) > 100 else ""
+            logger.debug(
+                f"Chunk {i}: Length={len(chunk)}, Start={first_100}..., End={last_100}"
+            )
+
+    return chunks
+
+
+def split_sentences(text: str, max_chars: int, language: str) -> List[str]:
+    """ 只在句末切分，相鄰的句子合併到 max_chars 以內；單句超過 max_chars 時才按 split_text 的方式切開 """
+    parts = []
+    current = ""
+    for sentence in SENTENCE_RE.findall(text):
+        if current and len(current) + len(sentence) > max_chars:
+            parts.append(current)
+            current = ""
+        if len(sentence) > max_chars:
+            if language.startswith("zh"):
+                parts.extend(_split_chinese_text(sentence, max_chars))
             else:
-                chunks.append(current_chunk)
-                current_chunk = word
+                parts.extend(_split_words(sentence, max_chars))
+            continue
+        current += sentence
+    if current:
+        parts.append(current)
+    return [part.strip() for part in parts if part.strip()]
 
-        if current_chunk:
-            chunks.append(current_chunk)
 
-    logger.info(f"Split text into {len(chunks)} chunks")
-    for i, chunk in enumerate(chunks, 1):
-        first_100 = chunk[:100]
-        last_100 = chunk[-100:] if len(chunk) > 100 else ""
-        logger.info(
-            f"Chunk {i}: Length={len(chunk)}, Start={first_100}..., End={last_100}"
-        )
+def _split_chinese_text(text: str, max_chars: int) -> List[str]:
+    """ 只掃描一次，記錄切分位置，最後才切出各塊 """
+    text_len = len(text)
+    # 句末/分句標點不會太前，避免切出太短的塊
+    min_cut = max(1, max_chars // 2)
+    cuts = []
+    start = 0
+
+    while text_len - start > max_chars:
+        end = start + max_chars
+        cut = _last_boundary(text, start + min_cut, end, SENTENCE_END_CHARS) \
+            or _last_boundary(text, start + min_cut, end, CLAUSE_END_CHARS)
+
+        if cut:
+            while cut < text_len and text[cut] in CLOSING_CHARS:
+                cut += 1
+        else:
+            # 沒有標點可切：在上限處切，但不切開英文、數字和標點
+            cut = end
+            while cut < text_len and text[cut] in SPECIAL_CHARS:
+                cut += 1
+
+        if cut >= text_len:
+            break
+        cuts.append(cut)
+        start = cut
+
+    bounds = [0, *cuts, text_len]
+    return [text[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1) if bounds[i] < bounds[i + 1]]
+
+
+def _last_boundary(text: str, lower: int, upper: int, boundary_chars: str) -> int:
+    """ text[lower:upper] 中最後一個分界標點之後的位置，沒有則返回 0 """
+    return max(text.rfind(char, lower, upper) for char in boundary_chars) + 1
+
+
+def _split_words(text: str, max_chars: int) -> List[str]:
+    chunks = []
+    current_words = []
+    current_len = 0
+
+    for word in text.split():
+        if current_words and current_len + len(word) + 1 > max_chars:
+            chunks.append(" ".join(current_words))
+            current_words = []
+            current_len = 0
+        current_len += len(word) + (1 if current_words else 0)
+        current_words.append(word)
+
+    if current_words:
+        chunks.append(" ".join(current_words))
 
     return chunks
 
@@ -65,11 +142,87 @@ def set_audio_tags(output_file, audio_tags):
 
 def is_special_char(char: str) -> bool:
     # Check if the character is a English letter, number or punctuation or a punctuation in Chinese, never split these characters.
-    ord_char = ord(char)
-    result = (
-        (ord_char >= 33 and ord_char <= 126)
-        or (char in "。，、？！：；“”‘’（）《》【】…—～·「」『』〈〉〖〗〔〕")
-        or (char in "∶")
-    )  # special unicode punctuation
-    logger.debug(f"is_special_char> char={char}, ord={ord_char}, result={result}")
-    return result
\ No newline at end of file
+    return char in SPECIAL_CHARS
+
+
+# MP3 (MPEG Layer III) 幀頭表
+_MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],  # MPEG-1
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],  # MPEG-2 / 2.5
+}
+_MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],  # MPEG-1
+    2: [22050, 24000, 16000],  # MPEG-2
+    0: [11025, 12000, 8000],  # MPEG-2.5
+}
+
+
+def iter_mp3_frames(data: bytes):
+    """
+    Yield (offset, length, duration, main_data_begin) for every Layer III frame in data.
+    main_data_begin == 0 means the frame does not borrow bits from earlier frames, so it is a safe cut point.
+    """
+    pos = 0
+    data_len = len(data)
+    while pos + 4 <= data_len:
+        if data[pos] != 0xFF or (data[pos + 1] & 0xE0) != 0xE0:
+            pos += 1
+            continue
+
+        version = (data[pos + 1] >> 3) & 0x03
+        layer = (data[pos + 1] >> 1) & 0x03
+        protected = not (data[pos + 1] & 0x01)
+        bitrate_index = data[pos + 2] >> 4
+        sample_rate_index = (data[pos + 2] >> 2) & 0x03
+        padding = (data[pos + 2] >> 1) & 0x01
+
+        if version == 1 or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+            pos += 1
+            continue
+
+        mpeg1 = version == 3
+        bitrate = _MP3_BITRATES[1 if mpeg1 else 2][bitrate_index] * 1000
+        sample_rate = _MP3_SAMPLE_RATES[version][sample_rate_index]
+        samples = 1152 if mpeg1 else 576
+        length = (144 if mpeg1 else 72) * bitrate // sample_rate + padding
+
+        side_info = pos + 4 + (2 if protected else 0)
+        if side_info + 2 > data_len or length <= 0:
+            break
+        if mpeg1:
+            main_data_begin = (data[side_info] << 1) | (data[side_info + 1] >> 7)
+        else:
+            main_data_begin = data[side_info]
+
+        yield pos, length, samples / sample_rate, main_data_begin
+        pos += length
+
+
+def split_mp3_at(data: bytes, cut_times: List[float], search_frames: int = 8) -> List[bytes]:
+    """
+    Split an MP3 stream at the frame boundaries closest to cut_times (seconds, ascending).
+    Frames that do not depend on the bit reservoir within search_frames of a cut are preferred.
+    """
+    frames = list(iter_mp3_frames(data))
+    if not frames or not cut_times:
+        return [data]
+
+    starts = []
+    elapsed = 0.0
+    for _, _, duration, _ in frames:
+        starts.append(elapsed)
+        elapsed += duration
+
+    cut_offsets = []
+    frame_idx = 0
+    for cut_time in cut_times:
+        while frame_idx < len(frames) - 1 and starts[frame_idx + 1] <= cut_time:
+            frame_idx += 1
+        candidates = range(max(1, frame_idx - search_frames), min(len(frames), frame_idx + search_frames + 1))
+        safe = [i for i in candidates if frames[i][3] == 0]
+        best = min(safe or candidates or [frame_idx], key=lambda i: abs(starts[i] - cut_time))
+        # 每個切點都返回一段（可能為空），令段數永遠是 len(cut_times) + 1
+        cut_offsets.append(max(frames[best][0], cut_offsets[-1] if cut_offsets else 0))
+
+    bounds = [0, *cut_offsets, len(data)]
+    return [data[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
@@ -3,24 +3,29 @@ import io
 import logging
 import math
 import os
+import time
 from datetime import datetime, timedelta
-from time import sleep
-import requests
 import asyncio
 import aiohttp
-import aiofiles
 
 from audiobook_generator.core.audio_tags import AudioTags
+from audiobook_generator.core.audio_writer import OrderedAudioWriter, STREAM_CHUNK_SIZE
 from audiobook_generator.config.general_config import GeneralConfig
+from audiobook_generator.core.metrics import RETRIES
 from audiobook_generator.core.utils import split_text, set_audio_tags
 from audiobook_generator.tts_providers.base_tts_provider import BaseTTSProvider
 
 logger = logging.getLogger(__name__)
 
 MAX_RETRIES = 12  # Max_retries constant for network errors
+TOKEN_LIFETIME = timedelta(minutes=9, seconds=1)  # token 有效 10 分鐘，留一點餘量
+TOKEN_REFRESH_MARGIN = timedelta(minutes=1)  # 到期前這段時間內在背景提前刷新
+KEEPALIVE_TIMEOUT = 60  # 閒置連線保留的秒數，章節之間的空檔不用重新握手
 
 
 class AzureTTSProvider(BaseTTSProvider):
+    supports_text_stream = True
+
     def __init__(self, config: GeneralConfig):
         logger.setLevel(config.log)
         # TTS provider specific config
@@ -33,6 +38,8 @@ class AzureTTSProvider(BaseTTSProvider):
         # access token and expiry time
         self.access_token = None
         self.token_expiry_time = datetime.utcnow()
+        self.token_refresh = None
+        self.session = None
         super().__init__(config)
 
         subscription_key = os.environ.get("MS_TTS_KEY")
@@ -58,33 +65,22 @@ class AzureTTSProvider(BaseTTSProvider):
     def is_access_token_expired(self) -> bool:
         return self.access_token is None or datetime.utcnow() >= self.token_expiry_time
 
-    def auto_renew_access_token(self) -> str:
-        if self.access_token is None or self.is_access_token_expired():
-            logger.info(
-                f"azure tts access_token doesn't exist or is expired, getting new one"
+    def get_session(self) -> aiohttp.ClientSession:
+        """ 整個 provider 共用一個連線池，TLS 連線可以跨章節重用 """
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.config.max_inflight_requests + 2,  # 另外留給取 token
+                limit_per_host=self.config.max_inflight_requests,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300,
             )
-            self.access_token = self.get_access_token()
-            self.token_expiry_time = datetime.utcnow() + timedelta(minutes=9, seconds=1)
-        return self.access_token
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
 
-    def get_access_token(self) -> str:
-        for retry in range(MAX_RETRIES):
-            try:
-                logger.info("Getting new access token")
-                response = requests.post(self.TOKEN_URL, headers=self.TOKEN_HEADERS)
-                response.raise_for_status()  # Will raise HTTPError for 4XX or 5XX status
-                access_token = str(response.text)
-                logger.info("Got new access token")
-                return access_token
-            except requests.exceptions.RequestException as e:
-                logger.warning(
-                    f"Network error while getting access token (attempt {retry + 1}/{MAX_RETRIES}): {e}"
-                )
-                if retry < MAX_RETRIES - 1:
-                    sleep(2 ** retry)
-                else:
-                    raise e
-        raise Exception("Failed to get access token")
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
 
     async def async_get_access_token(self, session) -> str:
         for retry in range(MAX_RETRIES):
@@ -100,19 +96,46 @@ class AzureTTSProvider(BaseTTSProvider):
                     f"Network error while getting access token (attempt {retry + 1}/{MAX_RETRIES}): {e}"
                 )
                 if retry < MAX_RETRIES - 1:
+                    RETRIES.inc(service="azure_token")
                     await asyncio.sleep(2 ** retry)
                 else:
                     raise e
         raise Exception("Failed to get access token")
 
     async def async_auto_renew_access_token(self, session) -> str:
-        if self.access_token is None or self.is_access_token_expired():
-            logger.info(
-                f"azure tts access_token doesn't exist or is expired, getting new one"
-            )
-            self.access_token = await self.async_get_access_token(session)
-            self.token_expiry_time = datetime.utcnow() + timedelta(minutes=9, seconds=1)
-        return self.access_token
+        """
+        同一時間只有一個刷新 token 的請求，其他調用者等待它的結果；
+        token 快到期時在背景提前刷新，期間繼續使用舊 token
+        """
+        if not self.is_access_token_expired():
+            if datetime.utcnow() >= self.token_expiry_time - TOKEN_REFRESH_MARGIN:
+                self._refresh_access_token(session)
+            return self.access_token
+
+        logger.info(
+            f"azure tts access_token doesn't exist or is expired, getting new one"
+        )
+        # shield：個別調用者被取消時不影響其他等待同一次刷新的請求
+        return await asyncio.shield(self._refresh_access_token(session))
+
+    def _refresh_access_token(self, session) -> asyncio.Future:
+        if self.token_refresh is None or self.token_refresh.done():
+            self.token_refresh = asyncio.ensure_future(self._fetch_access_token(session))
+            self.token_refresh.add_done_callback(self._on_token_refreshed)
+        return self.token_refresh
+
+    async def _fetch_access_token(self, session) -> str:
+        requested = datetime.utcnow()
+        access_token = await self.async_get_access_token(session)
+        self.access_token = access_token
+        # 有效期從發出請求時算起
+        self.token_expiry_time = requested + TOKEN_LIFETIME
+        return access_token
+
+    @staticmethod
+    def _on_token_refreshed(task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Failed to refresh azure tts access token: {task.exception()}")
 
     async def async_text_to_speech(
             self,
@@ -123,24 +146,27 @@ class AzureTTSProvider(BaseTTSProvider):
         max_chars = 1800 if self.config.language.startswith("zh") else 3000
         text_chunks = split_text(text, max_chars, self.config.language)
 
-        async with aiohttp.ClientSession() as session:
-            audio_segments = await self.process_chunks(session, text_chunks, audio_tags)
-
-            async with aiofiles.open(output_file, "wb") as outfile:
-                for segment in audio_segments:
-                    await outfile.write(segment)
+        session = self.get_session()
+        journal = self.journal(os.path.dirname(output_file))
+        async with OrderedAudioWriter(output_file, len(text_chunks), self.scheduler.budget, journal,
+                                      text_chunks) as writer:
+            await self.process_chunks(session, text_chunks, audio_tags, output_file, writer)
 
         set_audio_tags(output_file, audio_tags)
 
-    async def process_chunks(self, session, text_chunks, audio_tags):
+    async def process_chunks(self, session, text_chunks, audio_tags, chapter, writer):
         tasks = []
         for i, chunk in enumerate(text_chunks, 1):
-            tasks.append(self.process_chunk(session, chunk, i, len(text_chunks), audio_tags))
+            tasks.append(self.scheduler.synthesize(
+                chapter, chunk, writer.segment(i - 1), self.process_chunk, session, chunk, i, len(text_chunks), audio_tags))
 
-        audio_segments = await asyncio.gather(*tasks)
-        return audio_segments
+        await self.scheduler.gather(tasks)
 
-    async def process_chunk(self, session, chunk, i, total_chunks, audio_tags):
+    async def synthesize_segment(self, sink, text, audio_tags: AudioTags):
+        # 串流的片段總數事先不知道
+        await self.process_chunk(sink, self.get_session(), text, sink.index + 1, "?", audio_tags)
+
+    async def process_chunk(self, sink, session, chunk, i, total_chunks, audio_tags):
         escaped_text = html.escape(chunk)
         escaped_text = escaped_text.replace(
             self.get_break_string().strip(),
@@ -156,26 +182,32 @@ class AzureTTSProvider(BaseTTSProvider):
                 "X-Microsoft-OutputFormat": self.config.output_format,
                 "User-Agent": "Python",
             }
+            started = time.monotonic()
             try:
                 logger.info(
                     f"Processing chapter-{audio_tags.idx} <{audio_tags.title}>, chunk {i} of {total_chunks}, data length: {len(ssml)}"
                 )
                 async with session.post(self.TTS_URL, headers=headers, data=ssml.encode("utf-8")) as response:
                     response.raise_for_status()
-                    content = await response.read()
+                    # 邊收邊寫，不在記憶體中保留整段音頻
+                    async for data in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                        await sink.write(data)
                     logger.info(
-                        f"Got response from Azure TTS for chapter-{audio_tags.idx}, response length: {len(content)}"
+                        f"Got response from Azure TTS for chapter-{audio_tags.idx}, response length: {sink.written}"
                     )
-                    return content
+                    return
             except aiohttp.ClientError as e:
                 logger.warning(
                     f"Error while converting text to speech (attempt {retry + 1}): {e}"
                 )
-                if retry < MAX_RETRIES - 1:
+                # 已寫出部分音頻時無法重來
+                if retry < MAX_RETRIES - 1 and sink.written == 0:
+                    # 最終的失敗由調度器回報給限流器，這裡只回報會重試的這一次
+                    self.scheduler.limiter.on_failure(e, started)
+                    RETRIES.inc(service="azure")
                     await asyncio.sleep(2 ** retry)
                 else:
                     raise e
-        return b''
 
 
     def get_break_string(self):
@@ -1,6 +1,16 @@
-from typing import List
+import asyncio
+import inspect
+import os
+from typing import AsyncIterator, List
 
 from audiobook_generator.config.general_config import GeneralConfig
+from audiobook_generator.core.adaptive_limiter import AdaptiveLimiter
+from audiobook_generator.core.audio_tags import AudioTags
+from audiobook_generator.core.audio_writer import AudioBufferBudget, OrderedAudioWriter
+from audiobook_generator.core.resume_journal import ResumeJournal
+from audiobook_generator.core.segment_scheduler import SegmentScheduler
+from audiobook_generator.core.utils import set_audio_tags
+from audiobook_generator.tts_providers.synthesis_cache import SynthesisCache
 
 TTS_AZURE = "azure"
 TTS_OPENAI = "openai"
@@ -9,19 +19,97 @@ TTS_PIPER = 'piper'
 
 
 class BaseTTSProvider:  # Base interface for TTS providers
+    # 網絡服務按延遲和錯誤調整並發；本地合成的 provider 設為 False
+    adaptive_concurrency = True
+    # 各片段的音頻可以直接相接（實現了 synthesize_segment），見 async_stream_to_speech
+    supports_text_stream = False
+
     # Base provider interface
     def __init__(self, config: GeneralConfig):
         self.config = config
+        # 所有章節的合成請求都經過同一個排程器，全書共用同一個並發上限
+        limiter = AdaptiveLimiter(
+            "TTS", config.initial_inflight_requests, config.max_inflight_requests,
+            adaptive=self.adaptive_concurrency and not config.fixed_concurrency)
+        self.synthesis_cache = SynthesisCache(
+            config.tts_cache_dir, config.tts_cache_size, self.cache_identity()) if config.tts_cache_dir else None
+        # 各章的片段進度記在輸出文件夾的續傳日誌中，中斷後從第一個未寫入的片段繼續；以文件夾為鍵，見 journal()
+        self.journals = {}
+        # 片段按次序邊完成邊寫入文件，未輪到的片段最多暫存 max_buffered_audio_mb
+        self.scheduler = SegmentScheduler(
+            config.max_inflight_requests, limiter, self.synthesis_cache, AudioBufferBudget(config.max_buffered_audio_mb),
+            provider=config.tts)
 
     def __str__(self) -> str:
         return f"{self.config}"
 
+    def cache_identity(self) -> dict:
+        """ 所有影響合成音頻的設定，與片段文字一起組成快取的鍵 """
+        return {
+            "provider": self.config.tts,
+            "voice": self.config.voice_name,
+            "rate": self.config.voice_rate,
+            "pitch": self.config.voice_pitch,
+            "volume": self.config.voice_volume,
+            "output_format": self.config.output_format,
+            "model": self.config.model_name,
+            "language": self.config.language,
+            "break_duration": self.config.break_duration,
+            "instructions": self.config.instructions,
+        }
+
+    def journal(self, folder) -> ResumeJournal:
+        """ 返回輸出文件夾 folder 的續傳日誌；同一個 provider 轉換多本書時每本書各有一個 """
+        folder = os.path.abspath(folder)
+        journal = self.journals.get(folder)
+        if journal is None:
+            journal = self.journals[folder] = ResumeJournal(
+                folder, self.cache_identity(), resume=not self.config.no_resume)
+        return journal
+
+    def release_journal(self, folder):
+        """ 一本書轉換完後釋放它的續傳日誌，下次轉換時重新從文件載入 """
+        self.journals.pop(os.path.abspath(folder), None)
+
     def validate_config(self):
         raise NotImplementedError
 
     async def async_text_to_speech(self, *args, **kwargs):
         raise NotImplementedError
 
+    async def synthesize_segment(self, sink, text, audio_tags: AudioTags):
+        """ 把一段文字的音頻寫入 sink（supports_text_stream 的 provider 實現） """
+        raise NotImplementedError
+
+    async def async_stream_to_speech(self, texts: AsyncIterator[str], output_file, audio_tags: AudioTags):
+        """
+        texts 逐段產生文字（例如 LLM 串流中完成的句子），每得到一段就交給排程器合成，音頻按次序寫入 output_file，
+        不用等全部文字生成完才開始合成。不支持的 provider 收集全部文字後再合成。不記錄續傳日誌。
+        """
+        if not self.supports_text_stream:
+            await self.async_text_to_speech("".join([text async for text in texts]), output_file, audio_tags)
+            return
+        async with OrderedAudioWriter(output_file, 0, self.scheduler.budget) as writer:
+            tasks = []
+            try:
+                async for text in texts:
+                    tasks.append(asyncio.ensure_future(self.scheduler.synthesize(
+                        output_file, text, writer.add_segment(), self.synthesize_segment, text, audio_tags)))
+            except BaseException:
+                # 文字來源出錯（例如 LLM 串流中斷）時放棄整個文件
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            if not tasks:
+                raise ValueError(f"No text to synthesize: {output_file}")
+            await self.scheduler.gather(tasks)
+        set_audio_tags(output_file, audio_tags)
+
+    async def close(self):
+        """ 釋放 provider 持有的連線等資源 """
+        pass
+
     def estimate_cost(self, total_chars):
         raise NotImplementedError
 
@@ -53,7 +141,10 @@ async def get_async_tts_provider(config) -> BaseTTSProvider:
         provider = PiperTTSProvider(config)
 
     if provider:
-        await provider.validate_config()
+        # 只有 edge 的檢查是異步的（需要下載語音列表）
+        result = provider.validate_config()
+        if inspect.isawaitable(result):
+            await result
         return provider
     else:
         raise ValueError(f"Invalid TTS provider: {config.tts}")
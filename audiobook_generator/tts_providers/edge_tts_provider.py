@@ -1,22 +1,35 @@
 import asyncio
+import bisect
+import html
 import logging
 import math
 import time
-import aiofiles
-import lameenc
 import regex as re
 import os
 
 from edge_tts import Communicate, list_voices
+from edge_tts.communicate import calc_max_mesg_size, remove_incompatible_characters
+from edge_tts.data_classes import TTSConfig
 
 from audiobook_generator.config.general_config import GeneralConfig
+from audiobook_generator.core.adaptive_limiter import is_overload_error
+from audiobook_generator.core.audio_assets import parse_output_format, silence
 from audiobook_generator.core.audio_tags import AudioTags
-from audiobook_generator.core.utils import set_audio_tags
+from audiobook_generator.core.audio_writer import OrderedAudioWriter
+from audiobook_generator.core.metrics import RETRIES
+from audiobook_generator.core.resume_journal import ResumeJournal
+from audiobook_generator.core.segment_scheduler import SegmentScheduler
+from audiobook_generator.core.utils import set_audio_tags, split_mp3_at
 from audiobook_generator.tts_providers.base_tts_provider import BaseTTSProvider
 
 logger = logging.getLogger(__name__)
 
 MAX_RETRIES = 3  # Max_retries constant for network errors
+MAX_THROTTLE_RETRIES = 8  # 429 / 超時等過載錯誤等待並發降低後再試，次數較多
+DEFAULT_MAX_INFLIGHT = 16  # 沒有傳入共用排程器時的並發上限
+PACK_SEPARATOR = "\n"  # 合併段落時的分隔符
+# edge-tts 固定輸出的格式，停頓的靜音使用相同的格式
+EDGE_AUDIO_FORMAT = parse_output_format("audio-24khz-48kbitrate-mono-mp3")
 
 
 async def get_supported_voices():
@@ -43,6 +56,10 @@ class CommWithPauses:
         voice_name: str,
         break_string: str,
         break_duration: int = 500,
+        pack_chars: int = 0,
+        scheduler: SegmentScheduler = None,
+        chapter=None,
+        journal: ResumeJournal = None,
         **kwargs,
     ) -> None:
         # @BRK# -> [pause=500]
@@ -52,17 +69,20 @@ class CommWithPauses:
         self.rate = f"+{kwargs.get('rate', 0)}%"
         self.pitch = f"+{kwargs.get('pitch', 0)}Hz"
         self.break_duration = break_duration
+        self.pack_chars = pack_chars
+        self.request_count = 0
+        self.scheduler = scheduler or SegmentScheduler(DEFAULT_MAX_INFLIGHT)
+        self.chapter = chapter if chapter is not None else id(self)
+        self.journal = journal
 
         self.loop = asyncio.get_event_loop()
 
-    async def process_segment(self, segment):
-        if re.match(r'\[pause=\d+\]', segment):
-            return await asyncio.to_thread(self.generate_silence)
-
+    async def _stream(self, text, on_audio, on_boundary=None):
+        """ 合成 text，音頻數據邊收到邊交給 on_audio """
         for i in range(MAX_RETRIES):
             try:
                 communicate = Communicate(
-                    segment, self.voice, rate=self.rate, volume=self.volume, pitch=self.pitch)
+                    text, self.voice, rate=self.rate, volume=self.volume, pitch=self.pitch)
 
             except Exception:
                 logger.error(f"[{i}] An error occurred retrying...")
@@ -70,36 +90,154 @@ class CommWithPauses:
             else:
                 break
 
-        segment_audio = b''.join([chunk["data"] async for chunk in communicate.stream() if chunk["type"] == "audio"])
-        return segment_audio
+        retry = 0
+        while True:
+            self.request_count += 1
+            started = time.monotonic()
+            received = False
+            try:
+                async for chunk in communicate.stream():
+                    received = True
+                    if chunk["type"] == "audio":
+                        await on_audio(chunk["data"])
+                    elif on_boundary and chunk["type"] == "WordBoundary":
+                        on_boundary(chunk)
+                return
+            except Exception as e:
+                # 已收到部分資料時已寫出的音頻和 on_boundary 的狀態無法回滾，只重試連線階段的失敗（限流時握手被拒）
+                max_retries = MAX_THROTTLE_RETRIES if is_overload_error(e) else MAX_RETRIES
+                if received or retry >= max_retries - 1:
+                    raise
+                # 最終的失敗由調度器回報給限流器，這裡只回報會重試的這一次
+                self.scheduler.limiter.on_failure(e, started)
+                logger.warning(f"Edge TTS request failed (attempt {retry + 1}/{max_retries}): {e}")
+                RETRIES.inc(service="edge")
+                await asyncio.sleep(min(2 ** retry, 16))
+                retry += 1
+                communicate = Communicate(
+                    text, self.voice, rate=self.rate, volume=self.volume, pitch=self.pitch)
+
+    async def _synthesize(self, sink, text):
+        await self._stream(text, sink.write)
+
+    async def _synthesize_bytes(self, text, on_boundary=None):
+        audio = []
+
+        async def on_audio(data):
+            audio.append(data)
+
+        await self._stream(text, on_audio, on_boundary)
+        return b''.join(audio)
+
+    async def write_silence(self, sink, duration_ms):
+        await sink.write(silence(duration_ms, EDGE_AUDIO_FORMAT))
+        await sink.finish()
+
+    async def process_pack(self, sink, paragraphs):
+        """ 一個請求合成多個段落，再按 WordBoundary 找出段落交界，在交界插入停頓 """
+        if len(paragraphs) == 1:
+            return await self._synthesize(sink, paragraphs[0])
+
+        text = PACK_SEPARATOR.join(paragraphs)
+        starts = []
+        position = 0
+        for paragraph in paragraphs:
+            starts.append(position)
+            position += len(paragraph) + len(PACK_SEPARATOR)
+
+        # 每段的 [首字開始時間, 尾字結束時間]（單位：100ns）
+        spans = [None] * len(paragraphs)
+        cursor = 0
+
+        def on_boundary(chunk):
+            nonlocal cursor
+            found = text.find(chunk["text"], cursor)
+            if found == -1:
+                return
+            cursor = found + len(chunk["text"])
+            idx = bisect.bisect_right(starts, found) - 1
+            word_end = chunk["offset"] + chunk["duration"]
+            if spans[idx] is None:
+                spans[idx] = [chunk["offset"], word_end]
+            else:
+                spans[idx][1] = word_end
+
+        audio = await self._synthesize_bytes(text, on_boundary)
+
+        # 交界取上一段尾字和下一段首字之間的中點；找不到字的段落與前一段合併
+        cut_times = []
+        previous = spans[0]
+        for span in spans[1:]:
+            if span is None:
+                continue
+            if previous is not None:
+                cut_times.append((previous[1] + span[0]) / 2 / 10_000_000)
+            previous = span
+
+        if cut_times:
+            pause = silence(self.break_duration, EDGE_AUDIO_FORMAT)
+            audio = pause.join(split_mp3_at(audio, cut_times))
+        await sink.write(audio)
+
+    def pack_segments(self, segments):
+        """ 把相連的段落合併成最多 pack_chars 字（不超過服務的單次請求上限）的請求，段落間的停頓在 process_pack 中補回 """
+        max_size = calc_max_mesg_size(TTSConfig(self.voice, self.rate, self.volume, self.pitch))
+        packs = []
+        current = []
+        current_chars = 0
+        current_size = 0
+        for segment in segments:
+            if re.match(r'\[pause=\d+\]', segment):
+                continue
+            size = len(html.escape(remove_incompatible_characters(segment)).encode("utf-8")) + len(PACK_SEPARATOR)
+            if current and (current_size + size > max_size or current_chars + len(segment) > self.pack_chars):
+                packs.append(current)
+                current = []
+                current_chars = 0
+                current_size = 0
+            current.append(segment)
+            current_chars += len(segment)
+            current_size += size
+        if current:
+            packs.append(current)
+        return packs
 
-    async def run_tts(self):
+    async def run_tts(self, output_file):
+        """ 合成整章並按次序寫入 output_file，片段完成後即寫出，不在記憶體中保留整章音頻 """
         segments = re.split(r'(\[pause=\d+\])', self.text)
-        tasks = [self.process_segment(segment)
-                 # \p{L}為任何文字字符（所有國家）
-                 for segment in segments if re.search(r'\p{L}', segment)]
-        results = await asyncio.gather(*tasks)
-        return b''.join(results)
-
-    def generate_silence(self, sample_rate=24000, bit_depth=16):
-        num_frames = int(sample_rate * self.break_duration / 1000)
-        silent_frame = b'\x00' * (bit_depth // 8) * num_frames
-        encoder = lameenc.Encoder()
-        encoder.set_channels(1)
-        encoder.set_in_sample_rate(sample_rate)
-        encoder.set_bit_rate(128)
-        encoder.set_out_sample_rate(sample_rate)
-        encoder.set_quality(2)
-        mp3_data = encoder.encode(silent_frame)
-        mp3_data += encoder.flush()
-        return mp3_data
-
-    async def save(self, audio_fname, audio_data) -> None:
-        async with aiofiles.open(audio_fname, "wb") as f:
-            await f.write(audio_data)
+        # \p{L}為任何文字字符（所有國家）
+        segments = [segment for segment in segments if re.search(r'\p{L}', segment)]
+
+        if self.pack_chars > 0:
+            # 合併後的請求之間同樣插入停頓
+            packs = self.pack_segments(segments)
+            segments = []
+            for pack in packs:
+                if segments:
+                    segments.append(f"[pause={self.break_duration}]")
+                segments.append(pack)
+
+        async with OrderedAudioWriter(output_file, len(segments), self.scheduler.budget, self.journal,
+                                      segments) as writer:
+            # 停頓在本地生成，只有文字片段佔用排程器的請求名額
+            tasks = []
+            for i, segment in enumerate(segments):
+                sink = writer.segment(i)
+                if isinstance(segment, list):
+                    tasks.append(self.scheduler.synthesize(
+                        self.chapter, PACK_SEPARATOR.join(segment), sink, self.process_pack, segment))
+                elif pause := re.match(r'\[pause=(\d+)\]', segment):
+                    tasks.append(self.write_silence(sink, int(pause.group(1))))
+                else:
+                    tasks.append(self.scheduler.synthesize(self.chapter, segment, sink, self._synthesize, segment))
+            await self.scheduler.gather(tasks)
+
+        logger.debug(f"Edge TTS requests: {self.request_count} for {len(segments)} segments")
 
 
 class EdgeTTSProvider(BaseTTSProvider):
+    supports_text_stream = True
+
     def __init__(self, config: GeneralConfig):
         logger.setLevel(config.log)
         # TTS provider specific config
@@ -132,24 +270,32 @@ class EdgeTTSProvider(BaseTTSProvider):
             audio_tags: AudioTags,
     ):
         start = time.time()
-        communicate = CommWithPauses(
+        communicate = self._communicate(text, output_file, self.journal(os.path.dirname(output_file)))
+
+        await communicate.run_tts(output_file)
+
+        set_audio_tags(output_file, audio_tags)
+        logger.info(f"{os.path.basename(output_file)} Proceed Time: {round(time.time() - start, 2)}s, Requests: {communicate.request_count}")
+
+    async def synthesize_segment(self, sink, text, audio_tags: AudioTags):
+        await self._communicate(text, None)._synthesize(sink, text)
+
+    def _communicate(self, text, output_file, journal: ResumeJournal = None) -> CommWithPauses:
+        return CommWithPauses(
             text=text,
             voice_name=self.config.voice_name,
             break_string=self.get_break_string().strip(),
             break_duration=int(self.config.break_duration),
+            pack_chars=self.config.edge_pack_chars,
+            scheduler=self.scheduler,
+            chapter=output_file,
+            journal=journal,
             rate=self.config.voice_rate,
             volume=self.config.voice_volume,
             pitch=self.config.voice_pitch,
             proxy=self.config.proxy,
         )
 
-        audio_data = await communicate.run_tts()
-        await communicate.save(output_file, audio_data)
-
-        set_audio_tags(output_file, audio_tags)
-        logger.info(f"{os.path.basename(output_file)} Proceed Time: {round(time.time() - start, 2)}s")
-
-
     def estimate_cost(self, total_chars):
         return math.ceil(total_chars / 1000) * self.price
 
@@ -1,12 +1,12 @@
 import io
 import logging
 import math
-import asyncio
-import aiofiles
+import os
 
 from openai import OpenAI, AsyncOpenAI
 
 from audiobook_generator.core.audio_tags import AudioTags
+from audiobook_generator.core.audio_writer import OrderedAudioWriter, STREAM_CHUNK_SIZE
 from audiobook_generator.config.general_config import GeneralConfig
 from audiobook_generator.core.utils import split_text, set_audio_tags
 from audiobook_generator.tts_providers.base_tts_provider import BaseTTSProvider
@@ -28,6 +28,8 @@ def get_supported_formats():
 
 
 class OpenAITTSProvider(BaseTTSProvider):
+    supports_text_stream = True
+
     def __init__(self, config: GeneralConfig):
         logger.setLevel(config.log)
         config.model_name = config.model_name or "tts-1"
@@ -48,29 +50,35 @@ class OpenAITTSProvider(BaseTTSProvider):
         max_chars = 4000  # should be less than 4096 for OpenAI
         text_chunks = split_text(text, max_chars, self.config.language)
 
-        async with aiofiles.open(output_file, "wb") as outfile:
+        journal = self.journal(os.path.dirname(output_file))
+        async with OrderedAudioWriter(output_file, len(text_chunks), self.scheduler.budget, journal,
+                                      text_chunks) as writer:
             tasks = []
             for i, chunk in enumerate(text_chunks, 1):
-                tasks.append(self.process_chunk(chunk, i, len(text_chunks), audio_tags))
-
-            audio_segments = await asyncio.gather(*tasks)
+                tasks.append(self.scheduler.synthesize(
+                    output_file, chunk, writer.segment(i - 1), self.process_chunk, chunk, i, len(text_chunks), audio_tags))
 
-            for segment in audio_segments:
-                await outfile.write(segment)
+            await self.scheduler.gather(tasks)
 
         set_audio_tags(output_file, audio_tags)
 
-    async def process_chunk(self, chunk: str, i: int, total_chunks: int, audio_tags: AudioTags) -> bytes:
+    async def synthesize_segment(self, sink, text, audio_tags: AudioTags):
+        # 串流的片段總數事先不知道
+        await self.process_chunk(sink, text, sink.index + 1, "?", audio_tags)
+
+    async def process_chunk(self, sink, chunk: str, i: int, total_chunks, audio_tags: AudioTags):
         logger.info(
             f"Processing chapter-{audio_tags.idx} <{audio_tags.title}>, chunk {i} of {total_chunks}"
         )
-        response = await self.async_client.audio.speech.create(
+        # 邊收邊寫，不在記憶體中保留整段音頻
+        async with self.async_client.audio.speech.with_streaming_response.create(
             model=self.config.model_name,
             voice=self.config.voice_name,
             input=chunk,
             response_format=self.config.output_format,
-        )
-        return response.content
+        ) as response:
+            async for data in response.iter_bytes(STREAM_CHUNK_SIZE):
+                await sink.write(data)
 
 
     def get_break_string(self):
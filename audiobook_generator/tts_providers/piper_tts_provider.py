@@ -1,23 +1,31 @@
-import tempfile
-from subprocess import run
-from pathlib import Path
+import os
 import logging
 import asyncio
-
-
-from pydub import AudioSegment
+from collections import deque
+from contextlib import aclosing
 
 from audiobook_generator.config.general_config import GeneralConfig
+from audiobook_generator.core.audio_encoder import finalize_wav, make_encoder
 from audiobook_generator.core.audio_tags import AudioTags
-from audiobook_generator.core.utils import set_audio_tags
+from audiobook_generator.core.audio_writer import OrderedAudioWriter
+from audiobook_generator.core.utils import set_audio_tags, split_sentences
 from audiobook_generator.tts_providers.base_tts_provider import BaseTTSProvider
+from audiobook_generator.tts_providers.piper_worker_pool import PiperWorkerPool
 
 logger = logging.getLogger(__name__)
 
 __all__ = ["PiperTTSProvider"]
 
+PART_CHARS = 600  # 每次交給一個 worker 的文字長度
+
 
 class PiperTTSProvider(BaseTTSProvider):
+    # 本地合成，延遲取決於章節長度而不是服務負載
+    adaptive_concurrency = False
+    # 編碼前的 PCM 處理階段，按順序套用；每個為 stage(chunks) -> chunks，chunks 是 (PcmFormat, pcm) 的異步迭代器。
+    # 改變音頻的階段需要同時加入 cache_identity，否則會用到舊的快取
+    pcm_stages = ()
+
     def __init__(self, config: GeneralConfig):
         logger.setLevel(config.log)
 
@@ -38,6 +46,7 @@ class PiperTTSProvider(BaseTTSProvider):
         # 0.000$ per 1 million characters
         # or 0.000$ per 1000 characters
         self.price = 0.000
+        self.worker_pool = None
         super().__init__(config)
 
     def __str__(self) -> str:
@@ -46,42 +55,96 @@ class PiperTTSProvider(BaseTTSProvider):
     def validate_config(self):
         pass
 
+    def get_worker_pool(self) -> PiperWorkerPool:
+        if self.worker_pool is None:
+            command = [
+                "piper-tts",
+                "--model",
+                self.config.model_name,
+                "--speaker",
+                self.config.voice_name,
+                "--sentence_silence",
+                str(self.config.break_duration),
+                "--length_scale",
+                str(1.0 / self.config.voice_rate),
+                "--json-input",
+                "--output_file",
+                "-",
+            ]
+            self.worker_pool = PiperWorkerPool(command, self.config.piper_workers or os.cpu_count() or 1)
+        return self.worker_pool
+
+    async def close(self):
+        if self.worker_pool is not None:
+            await self.worker_pool.close()
+            self.worker_pool = None
+
+    async def iter_pcm(self, parts):
+        """
+        按順序產出各段的 (PcmFormat, pcm)，當前段邊合成邊產出。
+        同一章最多 worker 數量的段同時在合成，後面的段暫存到輪到為止，記憶體用量與章節長度無關。
+        """
+        pool = self.get_worker_pool()
+        pending = deque()
+        next_part = 0
+        try:
+            while pending or next_part < len(parts):
+                while next_part < len(parts) and len(pending) < len(pool.workers):
+                    queue = asyncio.Queue()
+
+                    async def on_pcm(fmt, pcm, queue=queue):
+                        queue.put_nowait((fmt, pcm))
+
+                    task = asyncio.ensure_future(pool.synthesize(parts[next_part], on_pcm))
+                    task.add_done_callback(lambda _, queue=queue: queue.put_nowait(None))
+                    pending.append((task, queue))
+                    next_part += 1
+
+                task, queue = pending[0]
+                while (item := await queue.get()) is not None:
+                    yield item
+                pending.popleft()
+                # 合成失敗時拋出錯誤
+                await task
+        finally:
+            for task, _ in pending:
+                task.cancel()
+
     async def async_text_to_speech(
         self,
         text: str,
         output_file: str,
         audio_tags: AudioTags,
     ):
-        def blocking_io():
-            with tempfile.TemporaryDirectory() as tmpdirname:
-                logger.debug("created temporary directory %r", tmpdirname)
-                tmpfilename = Path(tmpdirname) / "piper.wav"
-
-                run(
-                    [
-                        "piper-tts",
-                        "--model",
-                        self.config.model_name,
-                        "--speaker",
-                        self.config.voice_name,
-                        "--sentence_silence",
-                        str(self.config.break_duration),
-                        "--length_scale",
-                        str(1.0 / self.config.voice_rate),
-                        "-f",
-                        tmpfilename,
-                    ],
-                    input=text.encode("utf-8"),
-                )
-
-                AudioSegment.from_wav(tmpfilename).export(
-                    output_file, format=self.config.output_format
-                )
-
-        await asyncio.to_thread(blocking_io)
+        # 長章節分成多段交給不同的 worker，所有核心同時工作；每段是獨立的語句，只在句末切分，避免句中停頓
+        parts = split_sentences(text, PART_CHARS, self.config.language) or [text]
+
+        async def synthesize(sink):
+            encoder = None
+            chunks = self.iter_pcm(parts)
+            for stage in self.pcm_stages:
+                chunks = stage(chunks)
+            try:
+                async with aclosing(chunks):
+                    async for fmt, pcm in chunks:
+                        if encoder is None:
+                            encoder = make_encoder(self.config.output_format, fmt, sink.write)
+                        await encoder.write(pcm)
+                if encoder is not None:
+                    await encoder.close()
+            except BaseException:
+                if encoder is not None:
+                    encoder.abort()
+                raise
+
+        # 整章作為排程器的一個工作，結果可以從快取取得；各段由 worker pool 排隊，不再佔用排程器的名額
+        journal = self.journal(os.path.dirname(output_file))
+        async with OrderedAudioWriter(output_file, 1, self.scheduler.budget, journal, [text]) as writer:
+            await self.scheduler.synthesize(output_file, text, writer.segment(0), synthesize)
+        if self.config.output_format == "wav":
+            await asyncio.to_thread(finalize_wav, output_file)
         set_audio_tags(output_file, audio_tags)
 
-
     def estimate_cost(self, total_chars):
         return 0
 
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import logging
+import struct
+
+from audiobook_generator.core.audio_encoder import PcmFormat
+
+logger = logging.getLogger(__name__)
+
+CLOSE_TIMEOUT = 5  # 關閉 stdin 後等待進程退出的秒數
+PCM_READ_SIZE = 64 * 1024
+
+
+async def read_wav_header(stream: asyncio.StreamReader):
+    """ 讀取 WAV 頭部，返回格式和 data 塊的長度；長度寫在頭部，所以連續的多個 WAV 可以逐個分開 """
+    riff, _, wave = struct.unpack("<4sI4s", await stream.readexactly(12))
+    if riff != b"RIFF" or wave != b"WAVE":
+        raise RuntimeError(f"Unexpected piper-tts output: {riff!r}")
+    fmt = None
+    while True:
+        chunk_id, size = struct.unpack("<4sI", await stream.readexactly(8))
+        if chunk_id == b"data":
+            if fmt is None:
+                raise RuntimeError("piper-tts output has no fmt chunk")
+            return fmt, size
+        # 塊的長度是奇數時後面有一個填充字節
+        data = await stream.readexactly(size + size % 2)
+        if chunk_id == b"fmt ":
+            _, channels, sample_rate, _, _, bits = struct.unpack("<HHIIHH", data[:16])
+            fmt = PcmFormat(sample_rate, channels, bits // 8)
+
+
+class PiperWorker:
+    """ 一個常駐的 piper-tts 進程：模型只載入一次，每行 JSON 輸入合成一段文字，音頻以 WAV 寫到 stdout，不經暫存文件 """
+
+    def __init__(self, command):
+        self.command = command
+        self.process = None
+        self.launches = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def synthesize(self, text, on_pcm):
+        """ 合成 text，邊收到 PCM 邊調用 on_pcm(fmt, pcm) """
+        if not self.alive:
+            self.launches += 1
+            self.process = await asyncio.create_subprocess_exec(
+                *self.command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE)
+        try:
+            self.process.stdin.write(json.dumps({"text": text}, ensure_ascii=False).encode("utf-8") + b"\n")
+            await self.process.stdin.drain()
+            fmt, remaining = await read_wav_header(self.process.stdout)
+            while remaining:
+                pcm = await self.process.stdout.readexactly(min(remaining, PCM_READ_SIZE))
+                remaining -= len(pcm)
+                await on_pcm(fmt, pcm)
+        except asyncio.IncompleteReadError:
+            process, self.process = self.process, None
+            raise RuntimeError(f"piper-tts exited with code {await process.wait()}")
+        except BaseException:
+            # 讀到一半的輸出無法和下一個請求對齊，結束進程，下次使用時重新啟動
+            self.kill()
+            raise
+
+    def kill(self):
+        if self.alive:
+            self.process.kill()
+        # 退出狀態要等事件循環處理後才更新，直接丟棄，下次使用時重新啟動
+        self.process = None
+
+    async def close(self):
+        if not self.alive:
+            return
+        self.process.stdin.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+
+
+class PiperWorkerPool:
+    """
+    固定數量的 piper-tts 進程，請求交給空閒的 worker，沒有空閒時按先後排隊。
+
+    worker 在第一次使用時才啟動，進程意外退出時下次使用自動重啟。
+    """
+
+    def __init__(self, command, size):
+        self.workers = [PiperWorker(command) for _ in range(max(1, size))]
+        self.idle = None
+
+    @property
+    def launches(self) -> int:
+        return sum(worker.launches for worker in self.workers)
+
+    async def synthesize(self, text, on_pcm):
+        if self.idle is None:
+            self.idle = asyncio.Queue()
+            for worker in self.workers:
+                self.idle.put_nowait(worker)
+        worker = await self.idle.get()
+        try:
+            await worker.synthesize(text, on_pcm)
+        finally:
+            self.idle.put_nowait(worker)
+
+    async def close(self):
+        await asyncio.gather(*[worker.close() for worker in self.workers])
@@ -0,0 +1,50 @@
+import asyncio
+import hashlib
+import json
+
+from audiobook_generator.core.disk_cache import DiskCache
+from audiobook_generator.core.metrics import CACHE_LOOKUPS
+
+
+class SynthesisCache(DiskCache):
+    """
+    合成結果的磁碟快取，鍵為 provider、聲音參數和片段文字的雜湊，值為編碼後的音頻。
+
+    存取和淘汰見 DiskCache；按鍵的前兩位分目錄，一本書可以有上萬個片段。
+    """
+    NAME = "Synthesis cache"
+    # 合成或拼接邏輯有改動而令音頻不同時，提升版本號使舊快取失效
+    VERSION = 2
+    SUFFIX = ".audio"
+
+    def __init__(self, cache_dir, max_size_mb, identity: dict):
+        super().__init__(cache_dir, max_size_mb)
+        self.identity = json.dumps({"version": self.VERSION, **identity}, sort_keys=True)
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+
+    def make_key(self, text) -> str:
+        digest = hashlib.sha256(self.identity.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+
+    async def get(self, key):
+        """ 返回音頻，沒有快取時返回 None """
+        audio = await asyncio.to_thread(self._read_file, key)
+        if audio is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.hit_bytes += len(audio)
+        CACHE_LOOKUPS.inc(cache="tts", result="miss" if audio is None else "hit")
+        return audio
+
+    async def put(self, key, audio: bytes):
+        await asyncio.to_thread(self._write_file, key, audio)
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0.0
+        return f"hits {self.hits}, misses {self.misses} ({ratio:.0%} hit), {self.hit_bytes / 1024 / 1024:.1f} MB reused"
@@ -5,8 +5,14 @@ import platform
 from pathlib import Path
 import logging
 import sys
-import re
 import time
+import json
+import argparse
+import asyncio
+import contextvars
+
+from audiobook_generator.core.library_catalog import LibraryCatalog
+from audiobook_generator.core.resume_journal import ResumeJournal
 
 # --- 配置 ---
 class Config:
@@ -22,6 +28,18 @@ class Config:
         self.base_url = "api.openai.com"
         self.llm_model = "gemini-2.5-pro"
 
+        # 解析結果快取（以 . 開頭的文件夾不會被當成書籍掃描）
+        self.parse_cache_dir = self.base_path / '.cache' / 'parsed'
+        # 摘要快取：同樣的章節（重複上傳、新版中沒有改動的章節）不再請求 LLM
+        self.summary_cache_dir = self.base_path / '.cache' / 'summaries'
+        # 每次轉換的指標 JSON 摘要；設定 METRICS_TEXTFILE（node_exporter textfile collector 目錄下的 .prom 文件）時，
+        # 轉換期間同時定期寫出 Prometheus 指標
+        self.metrics_dir = self.base_path / '.cache' / 'metrics'
+        self.metrics_textfile = os.environ.get("METRICS_TEXTFILE")
+        # 書庫目錄：各書的章節字數、音頻和摘要狀態，掃描時查詢它而不是讀取每一章的文字
+        self.catalog_path = self.base_path / '.cache' / 'catalog.sqlite3'
+        self.catalog = None
+
         self.subprocess_log_file = self.base_path / 'output.log'
         self.script_log_file = script_dir / 'auto_ebook.log'
         self.log_size_limit = 100 * 1024 * 1024  # 100MB
@@ -36,11 +54,6 @@ class Config:
         else:
             raise NotImplementedError(f"不支持的操作系统: {self.platform}")
 
-def count_chinese_chars(text):
-    """Counts the number of Chinese characters in a string."""
-    # This regex matches CJK Unified Ideographs, covering both simplified and traditional.
-    return len(re.findall(r'[\u4e00-\u9fff]', text))
-
 # --- 日誌 ---
 def check_and_clear_log_file(log_file, size_limit):
     """檢查日誌文件大小，如果超過限制則清空"""
@@ -62,44 +75,89 @@ def setup_logging(log_file):
         ]
     )
 
+# 常駐模式中正在轉換的書名，寫入 output.log 的每一行
+current_book = contextvars.ContextVar("current_book", default="-")
+
+
+class BookLogFilter(logging.Filter):
+    """在日誌記錄中加上當前的書名"""
+    def filter(self, record):
+        record.book = current_book.get()
+        return True
+
+
+def setup_conversion_logging(log_file):
+    """常駐模式：轉換過程的日誌像子進程模式一樣寫入 output.log，不寫入腳本日誌"""
+    handler = logging.FileHandler(log_file, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] [%(book)s] %(message)s', '%Y-%m-%d %H:%M:%S'))
+    handler.addFilter(BookLogFilter())
+    conversion_logger = logging.getLogger('audiobook_generator')
+    conversion_logger.addHandler(handler)
+    conversion_logger.setLevel(logging.INFO)
+    conversion_logger.propagate = False
+
+
 # --- 核心功能 ---
-def run_conversion(config, epub_path, output_dir, **kwargs):
+def conversion_mode(kwargs):
+    return 'preview' if kwargs.get('preview') else 'summary' if kwargs.get('sum_only') else 'convert'
+
+
+def conversion_args(config, epub_path, output_dir, **kwargs):
     """
-    統一的轉換命令執行函數
+    返回傳給 main.py 的參數（子進程模式和常駐模式共用）
     :param config: Config 對象
     :param epub_path: EPUB 文件路徑
     :param output_dir: 輸出目錄
-    :param kwargs: 其他傳遞給 main.py 的參數
+    :param kwargs: preview / fnote_transplant / chapter_start / sum_only
     """
-    base_cmd = [
-        'python3', str(config.e2ab_script_path),
+    args = [
         '--tts', 'edge',
         '--voice_name', 'zh-CN-YunxiNeural',
         '--language', 'zh-TW',
         '--break_duration', '500',
         '--voice_volume', '100',
         '--output_text',
+        '--parse_cache_dir', str(config.parse_cache_dir),
+        '--catalog', str(config.catalog_path),
         str(epub_path),
         str(output_dir)
     ]
 
     # 根據 kwargs 動態添加參數
     if kwargs.get('preview'):
-        base_cmd.insert(6, '--preview')
+        args.append('--preview')
     if kwargs.get('fnote_transplant'):
-        base_cmd.insert(6, '--fnote_transplant')
+        args.append('--fnote_transplant')
     if chapter_start := kwargs.get('chapter_start'):
-        base_cmd.extend(['--chapter_start', str(chapter_start)])
+        args.extend(['--chapter_start', str(chapter_start)])
     if kwargs.get('sum_only'):
-        base_cmd.append('--sum_only')
+        args.append('--sum_only')
 
     # 如果 API 金鑰存在，並且不是預覽模式，則添加摘要相關參數
     if config.api_key and not kwargs.get('preview'):
-        base_cmd.extend([
+        args.extend([
             '--sum_model', config.llm_model,
             '--sum_api', config.api_key,
-            '--sum_url', config.base_url
+            '--sum_url', config.base_url,
+            '--sum_cache_dir', str(config.summary_cache_dir)
         ])
+    return args
+
+
+def run_conversion(config, epub_path, output_dir, **kwargs):
+    """
+    統一的轉換命令執行函數：以子進程運行 main.py
+    :param config: Config 對象
+    :param epub_path: EPUB 文件路徑
+    :param output_dir: 輸出目錄
+    :param kwargs: 其他傳遞給 main.py 的參數
+    """
+    base_cmd = ['python3', str(config.e2ab_script_path)] + conversion_args(config, epub_path, output_dir, **kwargs)
+
+    metrics_json = config.metrics_dir / f"{epub_path.stem}.{conversion_mode(kwargs)}.json"
+    base_cmd.extend(['--metrics_json', str(metrics_json)])
+    if config.metrics_textfile:
+        base_cmd.extend(['--metrics_textfile', config.metrics_textfile])
 
     logging.info(f"執行命令: {' '.join(base_cmd)}")
 
@@ -115,14 +173,43 @@ def run_conversion(config, epub_path, output_dir, **kwargs):
                 check=True  # 如果命令返回非零退出碼，則拋出異常
             )
         logging.info(f"成功處理: {epub_path.name}")
+        log_metrics_summary(metrics_json)
     except subprocess.CalledProcessError as e:
         logging.error(f"處理失敗: {epub_path.name}\n錯誤: {e}")
     except Exception as e:
         logging.error(f"發生未知錯誤: {epub_path.name}\n錯誤: {e}")
 
 
+def log_metrics_summary(metrics_json):
+    """從轉換輸出的指標摘要中記錄一行統計"""
+    try:
+        summary = json.loads(Path(metrics_json).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return
+
+    def total(name):
+        return sum(value.get('value', value.get('count', 0))
+                   for value in summary['metrics'].get(name, {}).get('values', []))
+
+    elapsed = summary['elapsed_seconds']
+    chars = total('audiobook_chapter_chars_total')
+    logging.info(
+        f"耗時 {elapsed:.1f}s，{total('audiobook_chapters_total')} 章 {chars} 字"
+        f"（{chars / elapsed if elapsed else 0:.0f} 字/秒），{total('audiobook_tts_segments_total')} 個片段，"
+        f"重試 {total('audiobook_retries_total')} 次，寫入 {total('audiobook_audio_bytes_written_total') / 1024 / 1024:.1f} MB")
+
+
 def check_incomplete_book(book_dir):
     """檢查書籍文件夾，確定是否需要從特定章節繼續"""
+    journal = ResumeJournal(book_dir)
+    if os.path.exists(journal.path):
+        # 以續傳日誌為準：未完成的章節會從第一個未寫入的片段繼續，不需要從前一章重新開始
+        pending = journal.pending_chapters(book_dir)
+        if pending is None:
+            return 1
+        return min(pending) if pending else None
+
+    # 沒有續傳日誌（舊版本轉換的書籍），按文件名判斷
     txt_files = list(book_dir.glob('*.txt'))
     mp3_files = list(book_dir.glob('*.mp3'))
 
@@ -160,68 +247,239 @@ def check_incomplete_book(book_dir):
     return max(1, start_chapter -1)
 
 
-def process_book_directory(book_dir, config):
-    """處理單個書籍文件夾（檢查完整性、摘要等）"""
+def plan_book_directory(book_dir, config):
+    """檢查單個書籍文件夾（完整性、摘要等），返回需要運行的轉換 (epub_path, kwargs)，不需要時返回 None"""
     logging.info(f"檢查文件夾: {book_dir.name}")
     epub_files = list(book_dir.glob('*.epub'))
     if not epub_files:
         logging.warning(f"文件夾 {book_dir.name} 中沒有找到 .epub 文件，跳過。")
-        return
+        return None
 
     epub_path = epub_files[0]
 
-    # 1. 檢查是否需要繼續轉換
-    start_from = check_incomplete_book(book_dir)
-    if start_from:
-        logging.info(f"檢測到《{epub_path.stem}》未完成，將從第 {start_from} 章開始。")
-        run_conversion(config, epub_path, book_dir, chapter_start=start_from, fnote_transplant=True)
-        return # 完成後退出，避免重複檢查摘要
-
-    # 2. 檢查並生成章節摘要及對應 MP3
-    if not start_from and config.api_key:
-        needs_sum_only_run = False
-        all_txt_files = sorted(book_dir.glob('*.txt'))
-        existing_mp3_stems = {f.stem for f in book_dir.glob('*.mp3')}
-
-        # 過濾出常規章節文件
-        chapter_files = [
-            f for f in all_txt_files
-            if '_' in f.stem and not f.stem.split('_', 1)[0].endswith('S')
-        ]
+    # 1. 書庫目錄還沒有這本書的完整記錄：以續傳日誌（或文件名）判斷是否需要繼續轉換，
+    #    已完成的書（本目錄出現之前轉換的）從文件夾導入一次，之後的掃描不再讀取章節文件
+    state = config.catalog.book_state(book_dir)
+    if state is None:
+        start_from = check_incomplete_book(book_dir)
+        if start_from:
+            logging.info(f"檢測到《{epub_path.stem}》未完成，將從第 {start_from} 章開始。")
+            return epub_path, {'chapter_start': start_from, 'fnote_transplant': True}
+        config.catalog.import_folder(book_dir)
+        state = config.catalog.book_state(book_dir)
+        if state is None:
+            return None
+
+    # 2. 文件夾中的 EPUB 換了新版：重新轉換全書，內容沒有改變的章節沿用上次的音頻，只合成有改變的章節
+    if config.catalog.epub_replaced(book_dir, epub_path):
+        logging.info(f"檢測到《{epub_path.stem}》的 EPUB 已更新，將重新轉換有改變的章節。")
+        return epub_path, {'fnote_transplant': True}
+
+    # 3. 檢查是否需要繼續轉換
+    if state.first_pending_audio:
+        logging.info(f"檢測到《{epub_path.stem}》未完成，將從第 {state.first_pending_audio} 章開始。")
+        return epub_path, {'chapter_start': state.first_pending_audio, 'fnote_transplant': True}
+
+    # 4. 檢查是否需要生成章節摘要或摘要的 MP3（中文字數超過 2000 的章節）
+    if config.api_key and state.needs_summary:
+        logging.info(f"檢測到《{epub_path.stem}》有 {len(state.summary_pending)} 章需要生成摘要，"
+                     f"{len(state.summary_audio_pending)} 個摘要缺少 MP3 文件。")
+        return epub_path, {'sum_only': True}
+    return None
 
-        for txt_file in chapter_files:
-            name_parts = txt_file.stem.split('_', 1)
-            if len(name_parts) < 2:
-                continue
 
-            summary_stem = f"{name_parts[0]}S_{name_parts[1]}"
-            summary_file = txt_file.with_name(f"{summary_stem}.txt")
+def process_book_directory(book_dir, config):
+    """處理單個書籍文件夾（檢查完整性、摘要等）"""
+    plan = plan_book_directory(book_dir, config)
+    if plan:
+        epub_path, kwargs = plan
+        run_conversion(config, epub_path, book_dir, **kwargs)
+
 
-            # 情況一：摘要 .txt 存在，但 .mp3 缺失
-            if summary_file.exists() and summary_stem not in existing_mp3_stems:
-                logging.info(f"檢測到摘要 '{summary_file.name}' 缺少對應的 MP3 文件。")
-                needs_sum_only_run = True
-                break
+def import_new_epubs(base_path):
+    """把根目錄下新的 EPUB 文件移動到各自的書籍文件夾，返回 [(epub_path, book_dir)]"""
+    imported = []
+    for item in base_path.glob('*.epub'):
+        logging.info(f"發現新的 EPUB 文件: {item.name}")
+        book_dir = base_path / item.stem
+        book_dir.mkdir(exist_ok=True)
+
+        destination = book_dir / item.name
+        shutil.move(str(item), str(destination))
+        logging.info(f"已將 {item.name} 移動到 {destination} 及生成所有章節文本")
+        imported.append((destination, book_dir))
+    return imported
+
+
+def book_directories(base_path):
+    return [item for item in base_path.iterdir() if item.is_dir() and not item.name.startswith(('.', '@'))]
+
+
+# 新書先預覽（生成所有章節文本）再完整轉換
+NEW_BOOK_CONVERSIONS = [{'preview': True, 'fnote_transplant': True}, {'fnote_transplant': True}]
+
+
+class ConversionDaemon:
+    """
+    常駐模式：在同一個進程和事件循環中直接調用 AudiobookGenerator / AudioSummaryGenerator，
+    不再為每本書啟動兩次 main.py（解釋器啟動、import、edge 聲音列表和 EPUB 解析都只在子進程中白做）。
 
-            # 情況二：摘要 .txt 不存在，且原文夠長，需要生成
-            if not summary_file.exists():
-                try:
-                    content = txt_file.read_text(encoding='utf-8')
-                    char_count = count_chinese_chars(content)
-                    if char_count > 2000:
-                        logging.info(f"檢測到章節 '{txt_file.name}' 需要生成摘要 (長度: {char_count} > 2000)。")
-                        needs_sum_only_run = True
-                        break
-                except Exception as e:
-                    logging.error(f"讀取文件 '{txt_file.name}' 失敗: {e}")
+    所有書共用一個 TTS provider（請求排程器、連線池、合成快取）、LLM 限流器和 HTTP 連線池；
+    最多 max_books 本書同時轉換，TTS 請求總數受共用排程器的上限限制，排程器在各書之間輪流分配空出的名額。
+    """
 
-        if needs_sum_only_run:
-            # logging.info(f"為《{epub_path.stem}》運行 --sum_only 模式來生成或補全摘要及音頻。")
-            run_conversion(config, epub_path, book_dir, sum_only=True)
+    def __init__(self, config, max_books=2):
+        self.config = config
+        self.book_slots = asyncio.Semaphore(max_books)
+        # 書籍文件夾 -> 正在處理（或排隊）的 task
+        self.books = {}
+        self.tts_provider = None
+        self.llm_limiter = None
+        self.session = None
+        self.shared_lock = asyncio.Lock()
+
+    async def close(self):
+        for task in list(self.books.values()):
+            task.cancel()
+        await asyncio.gather(*self.books.values(), return_exceptions=True)
+        if self.tts_provider:
+            await self.tts_provider.close()
+        if self.session:
+            await self.session.close()
+
+    async def _create_shared(self, book_config):
+        """第一本書開始轉換時，以它的設定建立共用的 provider 等（所有書的 TTS / LLM 設定相同）"""
+        async with self.shared_lock:
+            if self.tts_provider is not None:
+                return
+            import aiohttp
+            from audiobook_generator.core.adaptive_limiter import AdaptiveLimiter
+            from audiobook_generator.tts_providers.base_tts_provider import get_async_tts_provider
+
+            self.tts_provider = await get_async_tts_provider(book_config)
+            self.llm_limiter = AdaptiveLimiter(
+                "LLM", book_config.initial_inflight_requests, book_config.max_inflight_requests,
+                adaptive=not book_config.fixed_concurrency)
+            self.session = aiohttp.ClientSession()
+
+    async def convert(self, epub_path, output_dir, **kwargs):
+        """與 run_conversion 相同的轉換，在本進程中運行"""
+        from audiobook_generator.core.audiobook_generator import AudiobookGenerator
+        from audiobook_generator.core.summary_generator import AudioSummaryGenerator
+        from main import handle_args
+
+        args = conversion_args(self.config, epub_path, output_dir, **kwargs)
+        logging.info(f"開始處理（{conversion_mode(kwargs)}）: {' '.join(args)}")
+        started = time.monotonic()
+        try:
+            book_config = handle_args(args)
+            await self._create_shared(book_config)
+            if not book_config.sum_only:
+                await AudiobookGenerator(book_config, self.tts_provider, self.config.catalog).run()
+            if book_config.sum_api and not book_config.preview:
+                await AudioSummaryGenerator(book_config, self.tts_provider, self.llm_limiter, self.session,
+                                            self.config.catalog).run()
+            logging.info(f"成功處理: {epub_path.name}（{conversion_mode(kwargs)}，耗時 {time.monotonic() - started:.1f}s）")
+        except (Exception, SystemExit) as e:
+            # 包括 argparse 的 SystemExit，一本書失敗不影響其他書
+            logging.error(f"處理失敗: {epub_path.name}\n錯誤: {e!r}")
+
+    def submit(self, book_dir, conversions):
+        """排入一本書的轉換；這本書已在處理時忽略"""
+        if book_dir in self.books:
+            return
+        task = asyncio.create_task(self._run_book(book_dir, conversions))
+        self.books[book_dir] = task
+        task.add_done_callback(lambda _: self.books.pop(book_dir, None))
+
+    async def _run_book(self, book_dir, conversions):
+        async with self.book_slots:
+            # task 有自己的 context，這本書的日誌（包括排程器代為發出的請求）都帶上書名
+            current_book.set(book_dir.name)
+            for epub_path, kwargs in conversions:
+                await self.convert(epub_path, book_dir, **kwargs)
+
+    async def scan(self):
+        """掃描一次工作目錄，把需要處理的書排入隊列"""
+        await self._import_new_books()
+        await self._check_books(await asyncio.to_thread(book_directories, self.config.base_path))
+
+    async def _import_new_books(self):
+        for epub_path, book_dir in await asyncio.to_thread(import_new_epubs, self.config.base_path):
+            self.submit(book_dir, [(epub_path, kwargs) for kwargs in NEW_BOOK_CONVERSIONS])
+
+    async def _check_books(self, book_dirs):
+        for book_dir in book_dirs:
+            # 正在轉換的書，文件夾的變化是轉換本身造成的
+            if book_dir in self.books:
+                continue
+            plan = await asyncio.to_thread(plan_book_directory, book_dir, self.config)
+            if plan:
+                self.submit(book_dir, [plan])
+
+    async def run(self, interval):
+        while True:
+            await self.scan()
+            await asyncio.sleep(interval)
+
+    async def watch(self, watcher):
+        """監視模式：啟動時完整掃描一次，之後只檢查有變化的 EPUB 和書籍文件夾"""
+        base_path = self.config.base_path
+        await self.scan()
+        while True:
+            changes = await watcher.changes()
+            if base_path in changes:
+                await self.scan()
+                continue
+            if any(path.parent == base_path and path.suffix.lower() == '.epub' for path in changes):
+                await self._import_new_books()
+            await self._check_books(sorted(path for path in changes if path.parent == base_path and path.is_dir()))
+
+
+async def run_daemon(config, args):
+    # main.py 在 import 時設定 root logger，要在 setup_logging 之後才 import
+    from audiobook_generator.core.library_watcher import open_library_watcher
+    from audiobook_generator.core.metrics import MetricsExporter
+
+    setup_conversion_logging(config.subprocess_log_file)
+    if args.watch:
+        logging.info(f"--- 常駐模式：監視 {config.base_path} 的變化，最多同時轉換 {args.max_books} 本書 ---")
+    else:
+        logging.info(f"--- 常駐模式：每 {args.interval:g} 秒掃描 {config.base_path}，最多同時轉換 {args.max_books} 本書 ---")
+    daemon = ConversionDaemon(config, args.max_books)
+    watcher = None
+    try:
+        # 所有書共用進程內的指標，只寫 Prometheus textfile（每本書的 JSON 摘要在子進程模式才有）
+        async with MetricsExporter(config.metrics_textfile, book=str(config.base_path), tts='edge'):
+            if args.watch:
+                watcher = open_library_watcher(config.base_path, args.poll_interval)
+                logging.info(f"--- 監視模式：{type(watcher).__name__} ---")
+                await daemon.watch(watcher)
+            else:
+                await daemon.run(args.interval)
+    finally:
+        if watcher:
+            watcher.close()
+        await daemon.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="自動轉換工作目錄中的 EPUB 電子書")
+    parser.add_argument("--daemon", action="store_true",
+                        help="常駐模式：在本進程中轉換，所有書共用 TTS 連線和請求上限，定期重新掃描工作目錄")
+    parser.add_argument("--max_books", type=int, default=2, help="常駐模式中同時轉換的書籍數（預設: 2）")
+    parser.add_argument("--interval", type=float, default=300, help="常駐模式中重新掃描的間隔秒數（預設: 300）")
+    parser.add_argument("--watch", action="store_true",
+                        help="監視模式（隱含 --daemon）：啟動時掃描一次，之後以 inotify 監視新的 EPUB 和書籍文件夾的變化，"
+                             "只檢查有變化的書，不再定期重新掃描；沒有 inotify 時改為輪詢")
+    parser.add_argument("--poll_interval", type=float, default=1.0,
+                        help="監視模式沒有 inotify 時，輪詢目錄列表的間隔秒數（預設: 1）")
+    return parser.parse_args(argv)
 
 
 def main():
     """主執行函數"""
+    args = parse_args()
     start_time = time.time()
     config = Config()
 
@@ -236,27 +494,28 @@ def main():
         logging.error(f"核心腳本 'main.py' 未在預期路徑找到: {config.e2ab_script_path}")
         return
 
-    base_path = config.base_path
-    logging.info(f"--- 開始掃描工作目錄: {base_path} ---")
-
-    # 處理根目錄下的新 EPUB 文件
-    for item in base_path.glob('*.epub'):
-        logging.info(f"發現新的 EPUB 文件: {item.name}")
-        book_dir = base_path / item.stem
-        book_dir.mkdir(exist_ok=True)
-
-        destination = book_dir / item.name
-        shutil.move(str(item), str(destination))
-        logging.info(f"已將 {item.name} 移動到 {destination} 及生成所有章節文本")
-
-        # 預覽和完整轉換
-        run_conversion(config, destination, book_dir, preview=True, fnote_transplant=True)
-        run_conversion(config, destination, book_dir, fnote_transplant=True)
-
-    # 檢查並處理所有子文件夾
-    for item in base_path.iterdir():
-        if item.is_dir() and not item.name.startswith(('.', '@')):
+    config.catalog = LibraryCatalog(config.catalog_path)
+    try:
+        if args.daemon or args.watch:
+            try:
+                asyncio.run(run_daemon(config, args))
+            except KeyboardInterrupt:
+                logging.info("--- 常駐模式已停止 ---")
+            return
+
+        base_path = config.base_path
+        logging.info(f"--- 開始掃描工作目錄: {base_path} ---")
+
+        # 處理根目錄下的新 EPUB 文件：預覽和完整轉換
+        for destination, book_dir in import_new_epubs(base_path):
+            for kwargs in NEW_BOOK_CONVERSIONS:
+                run_conversion(config, destination, book_dir, **kwargs)
+
+        # 檢查並處理所有子文件夾
+        for item in book_directories(base_path):
             process_book_directory(item, config)
+    finally:
+        config.catalog.close()
 
     end_time = time.time()
     elapsed_time = end_time - start_time
@@ -0,0 +1,96 @@
+"""
+自適應並發基準測試：本地服務的容量分階段變化（超出容量的握手返回 429），
+比較固定並發與 AdaptiveLimiter 在每個階段的上限、吞吐量和被限流次數，並檢查上限是否收斂到服務容量附近；
+沒有收斂或有片段失敗時以非零狀態退出，可作為 AIMD 的回歸檢查。
+
+    python -m benchmarks.bench_adaptive_limit
+"""
+import asyncio
+import statistics
+import time
+
+from audiobook_generator.core.adaptive_limiter import AdaptiveLimiter
+from audiobook_generator.core.segment_scheduler import SegmentScheduler
+from benchmarks.bench_scheduler import make_book, make_comm, output_path
+from benchmarks.fake_edge_server import FakeEdgeServer
+
+# (服務容量, 秒數)：平時、夜間空閒、開始限流
+PHASES = [(12, 20), (32, 20), (6, 20)]
+MAX_INFLIGHT = 48
+
+
+async def sample(server, scheduler, samples):
+    start = time.perf_counter()
+    while True:
+        samples.append((time.perf_counter() - start, server.capacity, scheduler.limiter.limit,
+                        server.connections, server.throttled))
+        await asyncio.sleep(0.25)
+
+
+async def run_phases(server, adaptive):
+    server.reset()
+    limiter = AdaptiveLimiter("TTS", 4, MAX_INFLIGHT, adaptive=adaptive)
+    scheduler = SegmentScheduler(MAX_INFLIGHT, limiter)
+    samples = []
+    server.capacity = PHASES[0][0]
+    sampler = asyncio.create_task(sample(server, scheduler, samples))
+    # 書本要比所有階段長，階段結束後取消
+    chapters = [asyncio.create_task(make_comm(text, scheduler, idx).run_tts(output_path(idx)))
+                for idx, text in enumerate(make_book(chapters=60, seed=1))]
+    book = asyncio.gather(*chapters)
+    failed = None
+    try:
+        for capacity, seconds in PHASES:
+            server.capacity = capacity
+            done, _ = await asyncio.wait([book], timeout=seconds)
+            if done:
+                book.result()
+                break
+    except Exception as e:
+        failed = f"{type(e).__name__}: {e}"
+    finally:
+        for task in chapters + [sampler]:
+            task.cancel()
+        await asyncio.gather(*chapters, sampler, return_exceptions=True)
+    return samples, limiter, failed
+
+
+def report(name, samples, limiter, failed):
+    print(f"{name}: {limiter.snapshot()}" + (f", FAILED ({failed})" if failed else ""))
+    converged = True
+    elapsed = 0
+    for capacity, seconds in PHASES:
+        phase = [s for s in samples if elapsed <= s[0] < elapsed + seconds]
+        elapsed += seconds
+        if len(phase) < 2:
+            # 沒有足夠的採樣，無法確認收斂
+            converged = False
+            break
+        # 後半段的平均上限，AIMD 應在容量的一半到容量之間擺動
+        settled = phase[len(phase) // 2:]
+        mean_limit = statistics.mean(s[2] for s in settled)
+        requests = phase[-1][3] - phase[0][3]
+        throttled = phase[-1][4] - phase[0][4]
+        print(f"  capacity={capacity:>2}: mean limit {mean_limit:5.1f}, "
+              f"{requests / seconds:5.1f} req/s, throttled {throttled}")
+        converged &= 0.4 * capacity <= mean_limit <= 1.25 * capacity
+    return converged
+
+
+async def main():
+    server = FakeEdgeServer(handshake_latency=0.3, realtime_factor=50)
+    await server.start()
+    try:
+        samples, limiter, failed = await run_phases(server, adaptive=False)
+        report(f"fixed {MAX_INFLIGHT}", samples, limiter, failed)
+        samples, limiter, failed = await run_phases(server, adaptive=True)
+        converged = report("adaptive", samples, limiter, failed)
+        print(f"adaptive limit converged to capacity: {converged and not failed}")
+    finally:
+        await server.stop()
+    if not converged or failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+"""
+Azure 連線池基準測試：比較舊的「每章一個 ClientSession、token 過期時每個請求各自去取」與整個 provider 共用連線池、
+單飛（single-flight）提前刷新 token 的握手次數、token 請求數和每個 chunk 的 p50 延遲。
+
+    python -m benchmarks.bench_azure_pool
+"""
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import aiohttp
+
+import audiobook_generator.tts_providers.azure_tts_provider as azure_tts_provider
+from audiobook_generator.core.audio_tags import AudioTags
+from audiobook_generator.core.audio_writer import OrderedAudioWriter
+from audiobook_generator.core.utils import set_audio_tags, split_text
+from audiobook_generator.tts_providers.azure_tts_provider import AzureTTSProvider
+from benchmarks.bench_scheduler import make_book
+from benchmarks.fake_azure_server import FakeAzureServer
+from main import handle_args
+
+OUTPUT_DIR = tempfile.mkdtemp(prefix="bench_azure_pool_")
+# 縮短 token 有效期，讓一次測試內發生多次刷新
+TOKEN_LIFETIME = timedelta(seconds=4)
+TOKEN_REFRESH_MARGIN = timedelta(seconds=1)
+
+
+class TimedAzureTTSProvider(AzureTTSProvider):
+    """ 記錄每個 chunk 從發出到收完音頻的時間 """
+
+    def __init__(self, config, base_url):
+        super().__init__(config)
+        self.TOKEN_URL = f"{base_url}/sts/v1.0/issuetoken"
+        self.TTS_URL = f"{base_url}/cognitiveservices/v1"
+        self.chunk_latencies = []
+
+    async def process_chunk(self, sink, *args):
+        started = time.perf_counter()
+        await super().process_chunk(sink, *args)
+        self.chunk_latencies.append(time.perf_counter() - started)
+
+
+class LegacyAzureTTSProvider(TimedAzureTTSProvider):
+    """ 舊做法：每章新建 ClientSession，token 過期後並發的請求各自取 token """
+
+    async def async_auto_renew_access_token(self, session) -> str:
+        if self.access_token is None or self.is_access_token_expired():
+            self.access_token = await self.async_get_access_token(session)
+            self.token_expiry_time = datetime.utcnow() + TOKEN_LIFETIME
+        return self.access_token
+
+    async def async_text_to_speech(self, text, output_file, audio_tags):
+        text_chunks = split_text(text, 1800, self.config.language)
+        async with aiohttp.ClientSession() as session:
+            async with OrderedAudioWriter(output_file, len(text_chunks), self.scheduler.budget) as writer:
+                await self.process_chunks(session, text_chunks, audio_tags, output_file, writer)
+        set_audio_tags(output_file, audio_tags)
+
+
+def make_config():
+    return handle_args([
+        "book.epub", OUTPUT_DIR, "--tts", "azure", "--language", "zh-CN", "--voice_name", "zh-CN-YunxiNeural",
+        "--log", "WARNING", "--max_inflight_requests", "16", "--fixed_concurrency",
+    ])
+
+
+async def run(server, name, provider_class, book):
+    server.reset()
+    provider = provider_class(make_config(), server.base_url)
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*[
+            provider.async_text_to_speech(text, os.path.join(OUTPUT_DIR, f"{idx:04d}.mp3"),
+                                          AudioTags(f"chapter {idx}", "author", "book", idx))
+            for idx, text in enumerate(book)
+        ])
+    finally:
+        await provider.close()
+    elapsed = time.perf_counter() - start
+    print(f"{name}: {elapsed:.2f}s, chunks={len(provider.chunk_latencies)}, handshakes={server.handshakes}, "
+          f"token_requests={server.token_requests}, "
+          f"p50 per chunk={statistics.median(provider.chunk_latencies) * 1000:.0f}ms")
+
+
+async def main():
+    logging.disable(logging.WARNING)
+    os.environ.setdefault("MS_TTS_KEY", "fake")
+    os.environ.setdefault("MS_TTS_REGION", "fake")
+    azure_tts_provider.TOKEN_LIFETIME = TOKEN_LIFETIME
+    azure_tts_provider.TOKEN_REFRESH_MARGIN = TOKEN_REFRESH_MARGIN
+
+    server = FakeAzureServer(handshake_latency=0.15, token_latency=0.1, realtime_factor=400)
+    await server.start()
+    try:
+        book = make_book(chapters=48)
+        print(f"book: {len(book)} chapters, {sum(map(len, book))} chars")
+        await run(server, "per-chapter session", LegacyAzureTTSProvider, book)
+        await run(server, "pooled session", TimedAzureTTSProvider, book)
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
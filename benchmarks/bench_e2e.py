@@ -0,0 +1,255 @@
+"""
+端到端吞吐量基準測試：以生成的 EPUB 完整運行 AudiobookGenerator（和 AudioSummaryGenerator），
+TTS 和 LLM 都連接到本地模擬服務，結果以 JSON 輸出，方便在不同提交之間比較。
+
+情景：
+  edge      edge-tts WebSocket
+  azure     Azure REST + token
+  openai    OpenAI /v1/audio/speech
+  summary   edge 合成全書後，以 OpenAI 兼容的 chat/completions 生成摘要並合成摘要音頻
+
+模擬服務在本進程運行，生成器在子進程運行，峰值 RSS 只計生成器本身。
+片段延遲為服務端從收到請求到發完音頻的時間，請求數包括被注入錯誤的請求（即客戶端的總嘗試次數）。
+
+    python -m benchmarks.bench_e2e --output e2e.json
+    python -m benchmarks.bench_e2e --scenarios edge,summary --error-rate 0.02 --throttle-rate 0.05
+    python -m benchmarks.bench_e2e --output new.json --baseline old.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import resource
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_azure_server import FakeAzureServer
+from benchmarks.fake_edge_server import FakeEdgeServer, use_fake_edge
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from benchmarks.fake_service import FaultInjector, LatencyDistribution
+from benchmarks.make_epub import make_epub
+
+SCENARIOS = ["edge", "azure", "openai", "summary"]
+CHAPTER_TEXT = re.compile(r"^\d{4}_.*\.txt$")
+CHAPTER_AUDIO = re.compile(r"^\d{4}_.*\.mp3$")
+SUMMARY_AUDIO = re.compile(r"^\d{4}S_.*\.mp3$")
+# 比較時列出的指標，越小越好的為 False
+COMPARED = {
+    "elapsed_seconds": False,
+    "chars_per_second": True,
+    "peak_rss_mb": False,
+    "tts.requests_per_chapter": False,
+    "tts.p50_seconds": False,
+    "tts.p95_seconds": False,
+    "llm.p50_seconds": False,
+    "llm.p95_seconds": False,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end throughput benchmark against local fake services.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"Comma separated scenarios (default: {','.join(SCENARIOS)})")
+    parser.add_argument("--chapters", type=int, default=12, help="Chapters in the generated EPUB (default: 12)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the book, latencies and faults (default: 0)")
+    parser.add_argument("--latency", default="lognormal:0.1:0.5",
+                        help="TTS latency before the first audio: fixed:S, uniform:A:B or lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--llm-latency", default="uniform:0.5:2", help="LLM response latency (default: uniform:0.5:2)")
+    parser.add_argument("--handshake-latency", type=float, default=0.1,
+                        help="Extra latency of each new edge/azure connection in seconds (default: 0.1)")
+    parser.add_argument("--realtime-factor", type=float, default=100.0,
+                        help="How many times faster than real time the fake TTS streams audio (default: 100)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests failing with 429")
+    parser.add_argument("--generator-args", default="",
+                        help="Extra arguments passed to main.py, e.g. \"--max_inflight_requests 8\"")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with the results JSON of an earlier run")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True, check=True).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_generator(spec):
+    """ 子進程：按 spec 設定環境後運行 main.async_main，返回客戶端一側的結果 """
+    from audiobook_generator.tts_providers.azure_tts_provider import AzureTTSProvider
+    from main import async_main, handle_args
+
+    workdir = spec["workdir"]
+    scenario = spec["scenario"]
+    argv = [os.path.join(workdir, "book.epub"), workdir, "--language", "zh-CN", "--no_prompt", "--output_text",
+            "--log", "WARNING"]
+    if scenario in ("edge", "summary"):
+        use_fake_edge(spec["edge_port"])
+        argv += ["--tts", "edge", "--voice_name", "zh-CN-YunxiNeural"]
+    elif scenario == "azure":
+        os.environ["MS_TTS_KEY"] = "fake"
+        os.environ["MS_TTS_REGION"] = "fake"
+        azure_url = spec["azure_url"]
+        azure_init = AzureTTSProvider.__init__
+
+        def init(self, config):
+            azure_init(self, config)
+            self.TOKEN_URL = f"{azure_url}/sts/v1.0/issuetoken"
+            self.TTS_URL = f"{azure_url}/cognitiveservices/v1"
+
+        AzureTTSProvider.__init__ = init
+        argv += ["--tts", "azure", "--voice_name", "zh-CN-YunxiNeural"]
+    elif scenario == "openai":
+        argv += ["--tts", "openai"]
+    if scenario in ("openai", "summary"):
+        os.environ["OPENAI_BASE_URL"] = spec["openai_url"]
+        os.environ["OPENAI_API_KEY"] = "fake"
+    if scenario == "summary":
+        argv += ["--sum_url", spec["openai_url"], "--sum_api", "fake", "--sum_model", "fake"]
+    argv += shlex.split(spec["generator_args"])
+
+    config = handle_args(argv)
+    start = time.perf_counter()
+    await async_main(config)
+    elapsed = time.perf_counter() - start
+
+    files = sorted(os.listdir(workdir))
+    chars = 0
+    chapters = 0
+    for name in files:
+        if CHAPTER_TEXT.match(name):
+            chapters += 1
+            with open(os.path.join(workdir, name), encoding="utf-8") as f:
+                chars += len(f.read())
+    return {
+        "elapsed_seconds": round(elapsed, 3),
+        "chapters": chapters,
+        "chars": chars,
+        "chars_per_second": round(chars / elapsed, 1) if elapsed else None,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "chapter_audio_files": sum(1 for name in files if CHAPTER_AUDIO.match(name)),
+        "summary_audio_files": sum(1 for name in files if SUMMARY_AUDIO.match(name)),
+    }
+
+
+async def run_scenario(scenario, args):
+    """ 啟動需要的模擬服務，在子進程運行生成器，合併兩邊的統計 """
+    workdir = tempfile.mkdtemp(prefix=f"bench_e2e_{scenario}_")
+    make_epub(os.path.join(workdir, "book.epub"), args.chapters, args.seed)
+    faults = FaultInjector(args.error_rate, args.throttle_rate, args.seed)
+    latency = LatencyDistribution(args.latency, args.seed)
+    spec = {"scenario": scenario, "workdir": workdir, "generator_args": args.generator_args}
+
+    tts_server = None
+    llm_server = None
+    if scenario in ("edge", "summary"):
+        tts_server = FakeEdgeServer(handshake_latency=args.handshake_latency, realtime_factor=args.realtime_factor,
+                                    latency=latency, faults=faults)
+        await tts_server.start()
+        spec["edge_port"] = tts_server.port
+    elif scenario == "azure":
+        tts_server = FakeAzureServer(handshake_latency=args.handshake_latency, realtime_factor=args.realtime_factor,
+                                     latency=latency, faults=faults)
+        spec["azure_url"] = await tts_server.start()
+    if scenario in ("openai", "summary"):
+        # summary 情景只用它的 chat/completions，注入的錯誤只作用在 TTS 服務上
+        llm_server = FakeOpenAIServer(realtime_factor=args.realtime_factor, speech_latency=latency,
+                                      chat_latency=LatencyDistribution(args.llm_latency, args.seed),
+                                      faults=faults if scenario == "openai" else None)
+        spec["openai_url"] = await llm_server.start()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "benchmarks.bench_e2e", "--child", json.dumps(spec),
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        stdout, stderr = await process.communicate()
+    finally:
+        for server in (tts_server, llm_server):
+            if server:
+                await server.stop()
+    if process.returncode != 0:
+        raise RuntimeError(f"{scenario} failed:\n{stderr.decode(errors='replace')[-4000:]}")
+
+    result = json.loads(stdout.decode().strip().splitlines()[-1])
+    result["warnings"] = stderr.decode(errors="replace").count("WARNING")
+    tts_stats = llm_server.speech_stats if scenario == "openai" else tts_server.stats
+    result["tts"] = tts_stats.snapshot()
+    attempts = tts_stats.requests + tts_stats.throttled + tts_stats.errors
+    result["tts"]["requests_per_chapter"] = round(attempts / result["chapters"], 2) if result["chapters"] else None
+    if scenario == "summary":
+        result["llm"] = llm_server.chat_stats.snapshot()
+    return result
+
+
+def flatten(result, prefix=""):
+    values = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{key}."))
+        else:
+            values[f"{prefix}{key}"] = value
+    return values
+
+
+def compare(results, baseline):
+    print(f"\nbaseline {baseline.get('commit')} -> {results.get('commit')}")
+    old_settings = baseline.get("settings", {})
+    for key, value in results["settings"].items():
+        if old_settings.get(key, value) != value:
+            print(f"  note: {key} differs ({old_settings[key]} -> {value}), results are not directly comparable")
+    for scenario, result in results["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(scenario)
+        if not old:
+            continue
+        new_values, old_values = flatten(result), flatten(old)
+        print(f"{scenario}:")
+        for key, higher_is_better in COMPARED.items():
+            before, after = old_values.get(key), new_values.get(key)
+            if not isinstance(before, (int, float)) or not isinstance(after, (int, float)):
+                continue
+            change = (after - before) / before if before else 0.0
+            better = change > 0 if higher_is_better else change < 0
+            mark = "" if abs(change) < 0.02 else (" better" if better else " worse")
+            print(f"  {key}: {before} -> {after} ({change:+.1%}){mark}")
+
+
+async def main(args):
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    results = {
+        "commit": git_commit(),
+        "settings": {key: value for key, value in vars(args).items()
+                     if key not in ("output", "baseline", "child")},
+        "scenarios": {},
+    }
+    for scenario in scenarios:
+        result = await run_scenario(scenario, args)
+        results["scenarios"][scenario] = result
+        print(f"{scenario}: {json.dumps(result, ensure_ascii=False)}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.child:
+        print(json.dumps(asyncio.run(run_generator(json.loads(args.child)))))
+    else:
+        asyncio.run(main(args))
@@ -0,0 +1,67 @@
+"""
+EdgeTTS 段落合併基準測試：比較每段一個請求與不同 --edge_pack_chars 的請求數和章節耗時。
+
+    python -m benchmarks.bench_edge_packing
+"""
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from audiobook_generator.core.utils import iter_mp3_frames
+from audiobook_generator.tts_providers.edge_tts_provider import CommWithPauses
+from benchmarks.bench_split_text import make_text
+from benchmarks.fake_edge_server import FakeEdgeServer
+
+BREAK_STRING = "@BRK#"
+
+
+def make_chapter(chars=8000, seed=0):
+    rng = random.Random(seed)
+    text = make_text(chars, seed)
+    paragraphs = []
+    pos = 0
+    while pos < len(text):
+        size = rng.randint(30, 120)
+        paragraphs.append(text[pos:pos + size])
+        pos += size
+    return f" {BREAK_STRING}".join(paragraphs), len(paragraphs)
+
+
+async def run_once(server, text, pack_chars):
+    server.reset()
+    communicate = CommWithPauses(text=text, voice_name="zh-CN-YunxiNeural", break_string=BREAK_STRING,
+                                 break_duration=500, pack_chars=pack_chars)
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_file = os.path.join(tmpdir, "chapter.mp3")
+        await communicate.run_tts(output_file)
+        elapsed = time.perf_counter() - start
+        with open(output_file, "rb") as f:
+            audio = f.read()
+    duration = sum(frame[2] for frame in iter_mp3_frames(audio))
+    return {
+        "requests": communicate.request_count,
+        "connections": server.connections,
+        "peak_concurrent": server.peak_active,
+        "seconds": round(elapsed, 2),
+        "audio_seconds": round(duration, 1),
+    }
+
+
+async def main():
+    server = FakeEdgeServer(handshake_latency=0.3, realtime_factor=50, max_concurrent_handshakes=8)
+    await server.start()
+    try:
+        text, paragraphs = make_chapter()
+        print(f"chapter: {len(text)} chars, {paragraphs} paragraphs")
+        for pack_chars in (0, 500, 1500, 4000, 100_000):
+            result = await run_once(server, text, pack_chars)
+            print(f"pack_chars={pack_chars}: {result}")
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
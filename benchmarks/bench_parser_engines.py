@@ -0,0 +1,202 @@
+"""
+解析引擎基準測試：生成包含各種標記的 EPUB（標題、只有 <p> 的標題、<pre>、script/style/template、註釋、實體、URL、註腳、
+沒有內容的文件），對每個 newline_mode / test_mode / 註腳選項的組合，確認 soup 和 lxml 引擎提取的 (標題, 文字)
+和清理後的章節完全相同，再比較兩個引擎提取全書的時間。有任何不同時以非零狀態退出。
+
+    python -m benchmarks.bench_parser_engines
+    python -m benchmarks.bench_parser_engines --chapters 400 --repeat 5
+"""
+import argparse
+import html
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+
+from ebooklib import epub
+
+from benchmarks.bench_split_text import make_text
+from benchmarks.make_epub import make_chapter_html
+
+BREAK_STRING = " @BRK#"
+NEWLINE_MODES = ["single", "double", "none"]
+FNOTE_OPTIONS = {
+    "none": [],
+    "remove_endnotes": ["--remove_endnotes"],
+    "fnote_transplant": ["--fnote_transplant"],
+    "both": ["--remove_endnotes", "--fnote_transplant"],
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Parity and timing of the soup and lxml parser engines.")
+    parser.add_argument("--chapters", type=int, default=120, help="Files in the generated EPUB (default: 120)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="Timing runs per engine, the best is reported (default: 3)")
+    return parser.parse_args(argv)
+
+
+def paragraphs(text, rng):
+    parts = []
+    pos = 0
+    while pos < len(text):
+        size = rng.randint(30, 120)
+        parts.append(f"<p>{html.escape(text[pos:pos + size])}</p>")
+        pos += size
+    return "".join(parts)
+
+
+def make_chapter(i, rng, seed):
+    """ 第 i 個文件的 HTML，按 i 輪流使用不同的標記；返回 (HTML, 註腳 id 或 None) """
+    text = make_text(rng.choice([300, 800, 1500]), seed + i).replace(BREAK_STRING, "")
+    kind = i % 8
+    if kind == 0:
+        return make_chapter_html(f"第{i + 1}章", text, rng), None
+    if kind == 1:
+        # 沒有 h 標籤，用前兩段有文字的 <p> 作為標題；第一段只有空白
+        return f"<p> </p><p><b>序言</b>之{i + 1}</p><p>引子</p>{paragraphs(text, rng)}", None
+    if kind == 2:
+        return (f"<h2 id='h{i}'>第<span>{i + 1}</span>章&nbsp;&amp;「引號」&lt;題&gt;</h2>"
+                f"<p>實體：&#x4E2D;&#25991; &hellip; &mdash; &copy; A&amp;B</p>{paragraphs(text, rng)}"), None
+    if kind == 3:
+        return (f"<h3>程式 {i + 1}</h3><pre>  第一行\n\n    第二行  \n\t縮排</pre>"
+                f"<script>var x = '不要讀出';</script><style>p {{ color: red; }}</style>"
+                f"<!-- 註釋不讀出 --><template><p>模板不讀出</p></template>{paragraphs(text, rng)}"), None
+    if kind == 4:
+        return (f"<h1>連結 {i + 1}</h1><p>見 https://example.com/a?b=1&amp;c=2 和 mailto:someone@example.com，"
+                f"以及 <a href='http://example.org/x'>http://example.org/x</a> 的說明。</p>{paragraphs(text, rng)}"), None
+    if kind == 5:
+        note = f"n{i}"
+        return (f"<h1>註腳 {i + 1}</h1><p>正文<a id='r{i}' href='notes.xhtml#{note}'>[{i}]</a>之後"
+                f"<a href='notes.xhtml#{note}'>註釋說明</a>的文字。</p>{paragraphs(text, rng)}"), note
+    if kind == 6:
+        # 沒有標題也沒有內容，不算作章節
+        return "<div>  \n </div>", None
+    return (f"<h1>空白 {i + 1}</h1>\n\n<p>一</p>\n   \n<p>二</p>\t<div> <span> </span> </div>\n"
+            f"<div><p>巢狀<em>強調</em><strong>加粗</strong></p></div>{paragraphs(text, rng)}"), None
+
+
+def make_corpus(path, chapters, seed):
+    rng = random.Random(seed)
+    book = epub.EpubBook()
+    book.set_identifier(f"bench-parser-{seed}-{chapters}")
+    book.set_title("解析引擎基準測試")
+    book.set_language("zh")
+    book.add_author("bench")
+
+    items = []
+    notes = []
+    for i in range(chapters):
+        content, note = make_chapter(i, rng, seed)
+        file_name = f"chapter_{i + 1:03d}.xhtml"
+        item = epub.EpubHtml(title=f"第{i + 1}章", file_name=file_name, lang="zh")
+        item.content = content
+        book.add_item(item)
+        items.append(item)
+        if note:
+            notes.append(f"<p id='{note}'><a href='{file_name}#r{i}'>[{i}]</a> 這是第{i}個註腳的內容⤴</p>")
+
+    item = epub.EpubHtml(title="註釋", file_name="notes.xhtml", lang="zh")
+    item.content = "<h1>註釋</h1>" + "".join(notes)
+    book.add_item(item)
+    items.append(item)
+
+    book.toc = items
+    book.spine = items
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    epub.write_epub(path, book)
+
+
+def make_parser(path, engine, newline_mode="double", test_mode=False, fnote="none"):
+    from audiobook_generator.book_parsers.epub_book_parser import EpubBookParser
+    from main import handle_args
+
+    argv = [path, os.path.dirname(path), "--language", "zh-CN", "--voice_name", "zh-CN-YunxiNeural",
+            "--newline_mode", newline_mode, "--parser_engine", engine, "--log", "WARNING",
+            *FNOTE_OPTIONS[fnote], *(["--test_mode"] if test_mode else [])]
+    return EpubBookParser(handle_args(argv))
+
+
+def extract_all(parser):
+    """ 每個文件提取的 (文件名, 標題, 原始文字) """
+    parser.break_string = BREAK_STRING
+    parser._prepare_files()
+    return [(file_name, *parser._extract_content(file_name, item.get_body_content()))
+            for file_name, item in parser.files.items()]
+
+
+def first_difference(soup_results, lxml_results):
+    """ 第一個不同的項目，只顯示第一個不同字符前後的內容 """
+    for soup_item, lxml_item in zip(soup_results, lxml_results):
+        if soup_item != lxml_item:
+            soup_repr, lxml_repr = repr(soup_item), repr(lxml_item)
+            pos = next((i for i, (a, b) in enumerate(zip(soup_repr, lxml_repr)) if a != b),
+                       min(len(soup_repr), len(lxml_repr)))
+            start = max(0, pos - 40)
+            return (f"{soup_item[0]}: soup ...{soup_repr[start:pos + 60]}... "
+                    f"!= lxml ...{lxml_repr[start:pos + 60]}...")
+    return f"soup has {len(soup_results)} items, lxml has {len(lxml_results)}"
+
+
+def check_parity(path):
+    """ 返回不同的組合數 """
+    mismatches = 0
+    for newline_mode, test_mode, fnote in itertools.product(NEWLINE_MODES, [False, True], FNOTE_OPTIONS):
+        results = {}
+        for engine in ("soup", "lxml"):
+            extracted = extract_all(make_parser(path, engine, newline_mode, test_mode, fnote))
+            chapters = make_parser(path, engine, newline_mode, test_mode, fnote).get_chapters(BREAK_STRING)
+            results[engine] = (extracted, chapters)
+
+        name = f"newline_mode={newline_mode} test_mode={test_mode} fnote={fnote}"
+        (soup_extracted, soup_chapters), (lxml_extracted, lxml_chapters) = results["soup"], results["lxml"]
+        if soup_extracted != lxml_extracted:
+            mismatches += 1
+            print(f"{name}: extraction differs: {first_difference(soup_extracted, lxml_extracted)}")
+        elif soup_chapters != lxml_chapters:
+            mismatches += 1
+            print(f"{name}: chapters differ: {first_difference(soup_chapters, lxml_chapters)}")
+        else:
+            print(f"{name}: {len(soup_extracted)} files, {len(soup_chapters)} chapters, same")
+    return mismatches
+
+
+def time_engine(path, engine, repeat):
+    """ 最快一次提取全書所有文件的秒數（不計讀取 EPUB） """
+    best = None
+    for _ in range(repeat):
+        parser = make_parser(path, engine)
+        parser.break_string = BREAK_STRING
+        parser._prepare_files()
+        contents = [(file_name, item.get_body_content()) for file_name, item in parser.files.items()]
+        started = time.perf_counter()
+        for file_name, content in contents:
+            parser._extract_content(file_name, content)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(args):
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_parser_"), "book.epub")
+    make_corpus(path, args.chapters, args.seed)
+    mismatches = check_parity(path)
+    soup_seconds = time_engine(path, "soup", args.repeat)
+    lxml_seconds = time_engine(path, "lxml", args.repeat)
+    print(json.dumps({
+        "files": args.chapters + 1,
+        "combinations": len(NEWLINE_MODES) * 2 * len(FNOTE_OPTIONS),
+        "mismatches": mismatches,
+        "soup_extract_seconds": round(soup_seconds, 3),
+        "lxml_extract_seconds": round(lxml_seconds, 3),
+        "speedup": round(soup_seconds / lxml_seconds, 2) if lxml_seconds else None,
+    }))
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main(parse_args())
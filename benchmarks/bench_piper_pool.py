@@ -0,0 +1,113 @@
+"""
+Piper worker pool 基準測試：比較舊的「每章啟動一個 piper-tts 進程」與常駐的 worker pool 的總耗時和模型載入次數。
+
+使用 benchmarks/stub_piper_tts.py 模擬 piper-tts（載入模型和合成都佔用 CPU），不需要安裝 piper。
+
+    python -m benchmarks.bench_piper_pool
+"""
+import asyncio
+import io
+import logging
+import os
+import stat
+import sys
+import tempfile
+import time
+from pathlib import Path
+from subprocess import run
+
+from pydub import AudioSegment
+
+from audiobook_generator.core.audio_tags import AudioTags
+from audiobook_generator.core.audio_writer import OrderedAudioWriter
+from audiobook_generator.core.utils import set_audio_tags
+from audiobook_generator.tts_providers.piper_tts_provider import PiperTTSProvider
+from benchmarks.bench_edge_packing import make_chapter
+from main import handle_args
+
+OUTPUT_DIR = tempfile.mkdtemp(prefix="bench_piper_pool_")
+BIN_DIR = tempfile.mkdtemp(prefix="bench_piper_bin_")
+LAUNCH_LOG = os.path.join(OUTPUT_DIR, "launches.log")
+
+
+def install_stub():
+    """ 在 PATH 最前面放一個名為 piper-tts 的腳本，轉到替身程序 """
+    stub = Path(__file__).with_name("stub_piper_tts.py")
+    script = Path(BIN_DIR) / "piper-tts"
+    script.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{stub}" "$@"\n')
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    os.environ["PATH"] = f"{BIN_DIR}{os.pathsep}{os.environ['PATH']}"
+    os.environ["STUB_PIPER_LAUNCH_LOG"] = LAUNCH_LOG
+
+
+class LegacyPiperTTSProvider(PiperTTSProvider):
+    """ 舊做法：每章啟動一個 piper-tts，寫暫存 WAV 再用 pydub 轉碼 """
+
+    async def async_text_to_speech(self, text, output_file, audio_tags):
+        def blocking_io():
+            with tempfile.TemporaryDirectory() as tmpdirname:
+                tmpfilename = Path(tmpdirname) / "piper.wav"
+                run(["piper-tts", "--model", self.config.model_name, "--speaker", self.config.voice_name,
+                     "--sentence_silence", str(self.config.break_duration),
+                     "--length_scale", str(1.0 / self.config.voice_rate), "-f", tmpfilename],
+                    input=text.encode("utf-8"))
+                buffer = io.BytesIO()
+                AudioSegment.from_wav(tmpfilename).export(buffer, format=self.config.output_format)
+                return buffer.getvalue()
+
+        async def synthesize(sink):
+            await sink.write(await asyncio.to_thread(blocking_io))
+
+        async with OrderedAudioWriter(output_file, 1, self.scheduler.budget) as writer:
+            await self.scheduler.synthesize(output_file, text, writer.segment(0), synthesize)
+        set_audio_tags(output_file, audio_tags)
+
+
+def make_book():
+    """ 大部分是短章（模型載入佔主要時間），加兩條長章 """
+    sizes = [600, 900, 1200, 1500] * 6 + [8000, 12000]
+    return [make_chapter(chars, seed)[0] for seed, chars in enumerate(sizes)]
+
+
+def make_config(*extra):
+    return handle_args([
+        "book.epub", OUTPUT_DIR, "--tts", "piper", "--language", "zh-CN", "--model_name", "stub.onnx",
+        "--output_format", "wav", "--break_duration", "0.2", "--log", "WARNING", *extra,
+    ])
+
+
+def count_launches():
+    if not os.path.exists(LAUNCH_LOG):
+        return 0
+    with open(LAUNCH_LOG) as f:
+        return len(f.readlines())
+
+
+async def timed(name, provider, book):
+    if os.path.exists(LAUNCH_LOG):
+        os.remove(LAUNCH_LOG)
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*[
+            provider.async_text_to_speech(text, os.path.join(OUTPUT_DIR, f"{idx:04d}.wav"),
+                                          AudioTags(f"chapter {idx}", "author", "book", idx))
+            for idx, text in enumerate(book)
+        ])
+    finally:
+        await provider.close()
+    elapsed = time.perf_counter() - start
+    print(f"{name}: {elapsed:.2f}s, model loads={count_launches()}")
+
+
+async def main():
+    logging.disable(logging.WARNING)
+    install_stub()
+    book = make_book()
+    print(f"book: {len(book)} chapters, {sum(map(len, book))} chars, {os.cpu_count()} CPU cores")
+    await timed("process per chapter", LegacyPiperTTSProvider(make_config()), book)
+    await timed("worker pool (one per core)", PiperTTSProvider(make_config()), book)
+    await timed("worker pool (2 workers)", PiperTTSProvider(make_config("--piper_workers", "2")), book)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
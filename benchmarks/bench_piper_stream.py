@@ -0,0 +1,104 @@
+"""
+Piper 流式編碼基準測試：比較「收齊整章 PCM 再用 pydub 轉碼」與 PCM 邊到邊編碼的峰值記憶體，並確認兩者輸出的音頻相同。
+
+使用 benchmarks/stub_piper_tts.py 模擬 piper-tts；wav 和 mp3 不需要 ffmpeg。
+
+    python -m benchmarks.bench_piper_stream
+"""
+import asyncio
+import io
+import logging
+import os
+import time
+import tracemalloc
+
+from pydub import AudioSegment
+
+from audiobook_generator.core.audio_tags import AudioTags
+from audiobook_generator.core.audio_writer import OrderedAudioWriter
+from audiobook_generator.core.utils import set_audio_tags, split_sentences
+from audiobook_generator.tts_providers.piper_tts_provider import PART_CHARS, PiperTTSProvider
+from benchmarks.bench_edge_packing import make_chapter
+from benchmarks.bench_piper_pool import OUTPUT_DIR, install_stub, make_config
+
+
+class BufferedPiperTTSProvider(PiperTTSProvider):
+    """ 舊做法：收齊各段的 PCM，拼成整章後一次轉碼 """
+
+    async def async_text_to_speech(self, text, output_file, audio_tags):
+        parts = split_sentences(text, PART_CHARS, self.config.language) or [text]
+        pool = self.get_worker_pool()
+
+        async def collect(part):
+            pcm = bytearray()
+            fmt = None
+
+            async def on_pcm(chunk_fmt, chunk):
+                nonlocal fmt
+                fmt = chunk_fmt
+                pcm.extend(chunk)
+
+            await pool.synthesize(part, on_pcm)
+            return fmt, bytes(pcm)
+
+        def encode(results):
+            fmt = results[0][0]
+            audio = AudioSegment(data=b"".join(pcm for _, pcm in results), sample_width=fmt.sample_width,
+                                 frame_rate=fmt.sample_rate, channels=fmt.channels)
+            buffer = io.BytesIO()
+            audio.export(buffer, format=self.config.output_format)
+            return buffer.getvalue()
+
+        async def synthesize(sink):
+            results = await self.scheduler.gather([collect(part) for part in parts])
+            await sink.write(await asyncio.to_thread(encode, results))
+
+        async with OrderedAudioWriter(output_file, 1, self.scheduler.budget) as writer:
+            await self.scheduler.synthesize(output_file, text, writer.segment(0), synthesize)
+        set_audio_tags(output_file, audio_tags)
+
+
+def pcm_of(path):
+    """ 標籤寫在文件開頭，data 塊之後就是 PCM """
+    with open(path, "rb") as f:
+        data = f.read()
+    return data[data.index(b"data") + 8:]
+
+
+async def measure(name, provider, text, output_format):
+    output_file = os.path.join(OUTPUT_DIR, f"{name}.{output_format}")
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        await provider.async_text_to_speech(text, output_file, AudioTags("chapter", "author", "book", 1))
+    finally:
+        await provider.close()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name} ({output_format}): {elapsed:.2f}s, peak memory {peak / 1024 / 1024:.1f} MB, "
+          f"output {os.path.getsize(output_file) / 1024 / 1024:.1f} MB")
+    return output_file
+
+
+async def main():
+    logging.disable(logging.WARNING)
+    install_stub()
+    os.environ["STUB_PIPER_LOAD_SECONDS"] = "0.2"
+    os.environ["STUB_PIPER_SECONDS_PER_CHAR"] = "0.0001"
+    # 每個字 0.2 秒音頻，接近真實語速
+    os.environ["STUB_PIPER_AUDIO_SECONDS_PER_CHAR"] = "0.2"
+    for chars in (5000, 20000):
+        text = make_chapter(chars, chars)[0]
+        print(f"chapter: {chars} chars")
+        buffered = await measure(f"buffered_{chars}", BufferedPiperTTSProvider(make_config("--piper_workers", "2")),
+                                 text, "wav")
+        streamed = await measure(f"streamed_{chars}", PiperTTSProvider(make_config("--piper_workers", "2")),
+                                 text, "wav")
+        print(f"  same PCM: {pcm_of(buffered) == pcm_of(streamed)}")
+        await measure(f"streamed_{chars}",
+                      PiperTTSProvider(make_config("--piper_workers", "2", "--output_format", "mp3")), text, "mp3")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""
+全書排程基準測試：比較舊的「每次 5 章、章內片段全部同時發出」與全書共用 SegmentScheduler 的總耗時和最高連線數。
+
+    python -m benchmarks.bench_scheduler
+"""
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from audiobook_generator.core.segment_scheduler import SegmentScheduler
+from audiobook_generator.tts_providers.edge_tts_provider import CommWithPauses
+from benchmarks.bench_edge_packing import BREAK_STRING, make_chapter
+from benchmarks.fake_edge_server import FakeEdgeServer
+
+
+def make_book(chapters=24, seed=0):
+    """ 長短不一的章節：大部分是短章，少數長章 """
+    rng = random.Random(seed)
+    book = []
+    for i in range(chapters):
+        chars = rng.choice([800, 1500, 3000]) if i % 6 else rng.choice([12000, 20000])
+        book.append(make_chapter(chars, seed + i)[0])
+    return book
+
+
+OUTPUT_DIR = tempfile.mkdtemp(prefix="bench_scheduler_")
+
+
+def make_comm(text, scheduler, chapter):
+    return CommWithPauses(text=text, voice_name="zh-CN-YunxiNeural", break_string=BREAK_STRING,
+                          break_duration=500, scheduler=scheduler, chapter=chapter)
+
+
+def output_path(chapter):
+    return os.path.join(OUTPUT_DIR, f"{chapter:04d}.mp3")
+
+
+async def legacy_run(book):
+    """ 舊做法：Semaphore(5) 限制章節數，章內不限制並發 """
+    semaphore = asyncio.Semaphore(5)
+
+    async def chapter(idx, text):
+        async with semaphore:
+            await make_comm(text, SegmentScheduler(10 ** 6), idx).run_tts(output_path(idx))
+
+    await asyncio.gather(*[chapter(idx, text) for idx, text in enumerate(book)])
+
+
+async def scheduled_run(book, max_inflight):
+    scheduler = SegmentScheduler(max_inflight)
+    await asyncio.gather(*[make_comm(text, scheduler, idx).run_tts(output_path(idx)) for idx, text in enumerate(book)])
+
+
+async def timed(server, name, coro):
+    server.reset()
+    start = time.perf_counter()
+    await coro
+    elapsed = time.perf_counter() - start
+    print(f"{name}: {elapsed:.2f}s, connections={server.connections}, peak_concurrent={server.peak_active}")
+
+
+async def main():
+    server = FakeEdgeServer(handshake_latency=0.3, realtime_factor=50, max_concurrent_handshakes=8)
+    await server.start()
+    try:
+        book = make_book()
+        print(f"book: {len(book)} chapters, {sum(map(len, book))} chars")
+        await timed(server, "legacy (5 chapters, unbounded segments)", legacy_run(book))
+        for max_inflight in (8, 16, 32):
+            await timed(server, f"scheduler max_inflight={max_inflight}", scheduled_run(book, max_inflight))
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+"""
+停頓靜音基準測試：比較每個停頓重新用 lameenc 編碼 128kbps 靜音與快取的同格式靜音幀，
+包括生成的耗時，以及整章 MP3 的時長估算（播放器按首幀的比特率估算）與實際時長的差距。
+
+    python -m benchmarks.bench_silence
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+import lameenc
+from mutagen.mp3 import MP3
+
+from audiobook_generator.core.audio_assets import silence
+from audiobook_generator.core.segment_scheduler import SegmentScheduler
+from audiobook_generator.core.utils import iter_mp3_frames
+from audiobook_generator.tts_providers.edge_tts_provider import EDGE_AUDIO_FORMAT, CommWithPauses
+from benchmarks.bench_edge_packing import BREAK_STRING, make_chapter
+from benchmarks.fake_edge_server import FakeEdgeServer
+
+OUTPUT_DIR = tempfile.mkdtemp(prefix="bench_silence_")
+BREAK_DURATION = 500
+
+
+def legacy_silence(break_duration, sample_rate=24000, bit_depth=16):
+    """ 舊做法：每次新建編碼器，以 128kbps 編碼零值 PCM """
+    num_frames = int(sample_rate * break_duration / 1000)
+    encoder = lameenc.Encoder()
+    encoder.set_channels(1)
+    encoder.set_in_sample_rate(sample_rate)
+    encoder.set_bit_rate(128)
+    encoder.set_out_sample_rate(sample_rate)
+    encoder.set_quality(2)
+    return encoder.encode(b'\x00' * (bit_depth // 8) * num_frames) + encoder.flush()
+
+
+class LegacyCommWithPauses(CommWithPauses):
+    async def write_silence(self, sink, duration_ms):
+        await sink.write(await asyncio.to_thread(legacy_silence, self.break_duration))
+        await sink.finish()
+
+
+def frames_duration(data):
+    return sum(duration for _, _, duration, _ in iter_mp3_frames(data))
+
+
+def actual_duration(path):
+    with open(path, "rb") as f:
+        return frames_duration(f.read())
+
+
+async def chapter_run(server, comm_class, text, name):
+    server.reset()
+    output_file = os.path.join(OUTPUT_DIR, f"{name}.mp3")
+    comm = comm_class(text=text, voice_name="zh-CN-YunxiNeural", break_string=BREAK_STRING,
+                      break_duration=BREAK_DURATION, scheduler=SegmentScheduler(16), chapter=name)
+    start = time.perf_counter()
+    await comm.run_tts(output_file)
+    elapsed = time.perf_counter() - start
+    actual = actual_duration(output_file)
+    estimated = MP3(output_file).info.length
+    print(f"{name}: {elapsed:.2f}s, actual {actual:.1f}s, player estimate {estimated:.1f}s "
+          f"({(estimated - actual) / actual:+.1%})")
+
+
+async def main():
+    pauses = 2000
+    start = time.perf_counter()
+    for _ in range(pauses):
+        legacy_silence(BREAK_DURATION)
+    legacy = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(pauses):
+        silence(BREAK_DURATION, EDGE_AUDIO_FORMAT)
+    cached = time.perf_counter() - start
+    print(f"{pauses} pauses: lameenc per pause {legacy * 1000:.0f}ms, cached frames {cached * 1000:.1f}ms")
+    print(f"one pause: lameenc {len(legacy_silence(BREAK_DURATION))} bytes, "
+          f"cached {len(silence(BREAK_DURATION, EDGE_AUDIO_FORMAT))} bytes "
+          f"({BREAK_DURATION}ms requested, {frames_duration(silence(BREAK_DURATION, EDGE_AUDIO_FORMAT)):.3f}s)")
+
+    server = FakeEdgeServer(handshake_latency=0.05, realtime_factor=200)
+    await server.start()
+    try:
+        text, paragraphs = make_chapter(8000, 3)
+        print(f"chapter: {len(text)} chars, {paragraphs} paragraphs")
+        await chapter_run(server, LegacyCommWithPauses, text, "lameenc_silence")
+        await chapter_run(server, CommWithPauses, text, "cached_silence")
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
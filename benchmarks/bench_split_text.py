@@ -0,0 +1,89 @@
+"""
+split_text 基準測試：比較舊的逐字累加實現與現在的單次掃描實現（1 MB 中文文本）。
+
+    python -m benchmarks.bench_split_text
+"""
+import logging
+import random
+import time
+
+from audiobook_generator.core.utils import split_text
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def legacy_split_text(text, max_chars):
+    """ 舊版 split_text 中文分支（逐字累加，每字調用 is_special_char 並建立 debug 字串） """
+    legacy_logger = logging.getLogger("legacy")
+
+    def is_special_char(char):
+        ord_char = ord(char)
+        result = (
+            (ord_char >= 33 and ord_char <= 126)
+            or (char in "。，、？！：；“”‘’（）《》【】…—～·「」『』〈〉〖〗〔〕")
+            or (char in "∶")
+        )
+        legacy_logger.debug(f"is_special_char> char={char}, ord={ord_char}, result={result}")
+        return result
+
+    chunks = []
+    current_chunk = ""
+    for char in text:
+        if len(current_chunk) + 1 <= max_chars or is_special_char(char):
+            current_chunk += char
+        else:
+            chunks.append(current_chunk)
+            current_chunk = char
+    if current_chunk:
+        chunks.append(current_chunk)
+    for i, chunk in enumerate(chunks, 1):
+        legacy_logger.info(f"Chunk {i}: Length={len(chunk)}, Start={chunk[:100]}..., End={chunk[-100:]}")
+    return chunks
+
+
+def make_text(size, seed=0):
+    rng = random.Random(seed)
+    hanzi = [chr(c) for c in range(0x4e00, 0x4e00 + 3000)]
+    marks = "。。！？，，，；"
+    parts = []
+    length = 0
+    while length < size:
+        sentence = "".join(rng.choices(hanzi, k=rng.randint(8, 40)))
+        if rng.random() < 0.1:
+            sentence += f"{rng.randint(1, 9999)}.{rng.randint(0, 9)}公里"
+        sentence += rng.choice(marks)
+        if rng.random() < 0.05:
+            sentence += " @BRK#"
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts)[:size]
+
+
+def timed(func, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    # 1 MB UTF-8 中文約 35 萬字
+    text = make_text(350_000)
+    for max_chars in (1800, 4000):
+        legacy_time, legacy_chunks = timed(legacy_split_text, text, max_chars)
+        new_time, new_chunks = timed(split_text, text, max_chars, "zh-CN")
+        assert "".join(new_chunks) == text
+        sentence_ends = sum(chunk[-1] in "。！？，；" for chunk in new_chunks[:-1])
+        print(
+            f"max_chars={max_chars} size={len(text.encode('utf-8')) / 1e6:.2f}MB "
+            f"legacy={legacy_time * 1000:.1f}ms ({len(legacy_chunks)} chunks) "
+            f"new={new_time * 1000:.1f}ms ({len(new_chunks)} chunks, {sentence_ends} end on punctuation) "
+            f"speedup={legacy_time / new_time:.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+摘要流水線基準測試：以本地模擬的 LLM（chat/completions）和 edge-tts 運行 AudioSummaryGenerator（--sum_only），
+記錄兩段服務各自的忙碌時間，比較總耗時與「LLM 時間 + TTS 時間」及「兩者中較長的一段」。
+兩段串行時總耗時接近兩者之和，流水線時接近較長的一段。
+另外記錄每章摘要從 LLM 請求開始到寫出第一段音頻的時間（--generator-args=--sum_stream 時按句串流合成）。
+
+    python -m benchmarks.bench_summary_pipeline
+    python -m benchmarks.bench_summary_pipeline --chapters 24 --llm-latency uniform:5:15 --generator-args "--sum_tts_workers 8"
+    python -m benchmarks.bench_summary_pipeline --generator-args=--sum_stream
+    python -m benchmarks.bench_summary_pipeline --generator-args="--sum_cache_dir /tmp/summary_cache"   # 第二次運行全部命中
+"""
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import statistics
+import tempfile
+import time
+
+from benchmarks.bench_split_text import make_text
+from benchmarks.fake_edge_server import FakeEdgeServer
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from benchmarks.fake_service import LatencyDistribution
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Summary LLM/TTS pipeline benchmark against local fake services.")
+    parser.add_argument("--chapters", type=int, default=16, help="Chapters that need a summary (default: 16)")
+    parser.add_argument("--llm-latency", default="uniform:3:8", help="LLM response latency (default: uniform:3:8)")
+    parser.add_argument("--realtime-factor", type=float, default=10.0,
+                        help="How many times faster than real time the fake edge-tts streams audio (default: 10)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--generator-args", default="", help="Extra arguments passed to main.py")
+    return parser.parse_args(argv)
+
+
+class Intervals:
+    """ 服務端每個請求的開始和結束時間 """
+
+    def __init__(self):
+        self.spans = []
+
+    def wrap(self, handler):
+        async def timed(request):
+            started = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                self.spans.append((started, time.perf_counter()))
+        return timed
+
+    def busy(self) -> float:
+        """ 至少有一個請求在處理的總時間 """
+        total = 0.0
+        end = None
+        for start, stop in sorted(self.spans):
+            if end is None or start > end:
+                total += stop - start
+                end = stop
+            elif stop > end:
+                total += stop - end
+                end = stop
+        return total
+
+
+def make_book_folder(chapters, seed):
+    """ 每章都超過 2000 字（都需要摘要）的章節文字文件；返回文件夾和 {章節文字: 摘要 MP3 路徑} """
+    folder = tempfile.mkdtemp(prefix="bench_summary_")
+    summaries = {}
+    for i in range(1, chapters + 1):
+        text = make_text(3000, seed + i).replace(" @BRK#", "")
+        with open(os.path.join(folder, f"{i:04d}_第{i}章.txt"), "w", encoding="utf-8") as f:
+            f.write(text)
+        summaries[text] = os.path.join(folder, f"{i:04d}S_第{i}章.mp3")
+    return folder, summaries
+
+
+def record_first_audio(first_audio):
+    """ 記錄每個輸出文件收到第一段音頻的時間 """
+    from audiobook_generator.core.audio_writer import SegmentSink
+    write = SegmentSink.write
+
+    async def timed_write(self, data):
+        if data:
+            first_audio.setdefault(self.writer.output_file, time.perf_counter())
+        await write(self, data)
+
+    SegmentSink.write = timed_write
+
+
+def record_llm_start(handler, summaries, llm_started):
+    """ 記錄每章摘要的 LLM 請求開始的時間（重試時取第一次） """
+    async def timed(request):
+        body = await request.json()
+        path = summaries.get(body["messages"][-1]["content"])
+        if path:
+            llm_started.setdefault(path, time.perf_counter())
+        return await handler(request)
+    return timed
+
+
+async def main(args):
+    from audiobook_generator.core.summary_generator import AudioSummaryGenerator
+    from main import handle_args
+
+    llm = FakeOpenAIServer(chat_latency=LatencyDistribution(args.llm_latency, args.seed))
+    tts = FakeEdgeServer(realtime_factor=args.realtime_factor, latency=LatencyDistribution("fixed:0.1", args.seed))
+    llm_spans, tts_spans = Intervals(), Intervals()
+    folder, summaries = make_book_folder(args.chapters, args.seed)
+    llm_started, first_audio = {}, {}
+    record_first_audio(first_audio)
+    llm.chat = record_llm_start(llm_spans.wrap(llm.chat), summaries, llm_started)
+    tts.handle = tts_spans.wrap(tts.handle)
+    llm_url = await llm.start()
+    await tts.start()
+    argv = [os.path.join(folder, "book.epub"), folder, "--tts", "edge", "--voice_name", "zh-CN-YunxiNeural",
+            "--language", "zh-CN", "--sum_only", "--sum_url", llm_url, "--sum_api", "fake", "--sum_model", "fake",
+            "--log", "WARNING"] + shlex.split(args.generator_args)
+    try:
+        started = time.perf_counter()
+        await AudioSummaryGenerator(handle_args(argv)).run()
+        elapsed = time.perf_counter() - started
+    finally:
+        await tts.stop()
+        await llm.stop()
+
+    llm_busy, tts_busy = llm_spans.busy(), tts_spans.busy()
+    summaries = sum(1 for name in os.listdir(folder) if name.endswith(".mp3"))
+    # 每章摘要從 LLM 請求開始到第一段音頻寫出的時間
+    waits = sorted(first_audio[path] - llm_started[path] for path in llm_started if path in first_audio)
+    print(json.dumps({
+        "summaries": summaries,
+        "elapsed_seconds": round(elapsed, 2),
+        "llm_requests": len(llm_spans.spans),
+        "llm_busy_seconds": round(llm_busy, 2),
+        "tts_busy_seconds": round(tts_busy, 2),
+        "sum_seconds": round(llm_busy + tts_busy, 2),
+        "max_seconds": round(max(llm_busy, tts_busy), 2),
+        "first_audio_seconds": round(min(first_audio.values()) - started, 2) if first_audio else None,
+        "summary_first_audio_p50_seconds": round(statistics.median(waits), 2) if waits else None,
+        "summary_first_audio_max_seconds": round(waits[-1], 2) if waits else None,
+    }))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
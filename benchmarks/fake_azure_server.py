@@ -0,0 +1,102 @@
+"""
+本地模擬的 Azure TTS REST 服務，用於基準測試（不需要 Azure 帳號）。
+
+/sts/v1.0/issuetoken 發出 token，/cognitiveservices/v1 以固定速度串流 MP3 音頻。
+新連線的第一個請求額外等待 handshake_latency，模擬 TLS 握手的成本。
+可選的 latency（首段音頻前的等待）和 faults（合成請求以 429 / 500 失敗）見 benchmarks/fake_service.py。
+"""
+import asyncio
+import uuid
+
+import regex as re
+from aiohttp import web
+
+from benchmarks.fake_edge_server import make_tone_frames
+from benchmarks.fake_service import FaultInjector, LatencyDistribution, RequestStats, stream_frames, timed_request
+
+FRAME_BYTES = 144  # 24kHz 48kbps 單聲道的一幀
+
+
+class FakeAzureServer:
+    def __init__(self, handshake_latency=0.15, token_latency=0.1, first_audio_latency=0.05,
+                 seconds_per_char=0.2, realtime_factor=50.0,
+                 latency: LatencyDistribution = None, faults: FaultInjector = None):
+        self.handshake_latency = handshake_latency
+        self.token_latency = token_latency
+        self.first_audio_latency = first_audio_latency
+        self.latency = latency
+        self.faults = faults
+        self.stats = RequestStats()
+        self.seconds_per_char = seconds_per_char
+        self.realtime_factor = realtime_factor
+        self.audio = make_tone_frames()
+        self.tokens = set()
+        self.seen_transports = set()
+        self.handshakes = 0
+        self.token_requests = 0
+        self.tts_requests = 0
+        self.unauthorized = 0
+        self.runner = None
+        self.base_url = None
+
+    async def start(self, port=0):
+        app = web.Application()
+        app.router.add_post("/sts/v1.0/issuetoken", self.issue_token)
+        app.router.add_post("/cognitiveservices/v1", self.synthesize)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    def reset(self):
+        self.seen_transports.clear()
+        self.handshakes = 0
+        self.token_requests = 0
+        self.tts_requests = 0
+        self.unauthorized = 0
+        self.stats.reset()
+
+    async def _accept(self, request):
+        transport = id(request.transport)
+        if transport not in self.seen_transports:
+            self.seen_transports.add(transport)
+            self.handshakes += 1
+            await asyncio.sleep(self.handshake_latency)
+
+    async def issue_token(self, request):
+        await self._accept(request)
+        self.token_requests += 1
+        await asyncio.sleep(self.token_latency)
+        token = uuid.uuid4().hex
+        self.tokens.add(token)
+        return web.Response(text=token)
+
+    async def synthesize(self, request):
+        await self._accept(request)
+        self.tts_requests += 1
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if token not in self.tokens:
+            self.unauthorized += 1
+            return web.Response(status=401, text="Unauthorized")
+        status = self.faults.pick() if self.faults else None
+        if status:
+            self.stats.count_fault(status)
+            return self.faults.response(status)
+        async with timed_request(self.stats):
+            text = re.sub(r"<[^>]+>", "", await request.text())
+            response = web.StreamResponse(headers={"Content-Type": "audio/mpeg"})
+            await response.prepare(request)
+            await asyncio.sleep(self.latency.sample() if self.latency else self.first_audio_latency)
+            # 每個字 seconds_per_char 秒的音頻，以 realtime_factor 倍速發送
+            frames = max(1, round(len(text) * self.seconds_per_char / (FRAME_BYTES * 8 / 48000)))
+            await stream_frames(response, self.audio, FRAME_BYTES, frames * FRAME_BYTES, 48000 / 8,
+                                self.realtime_factor)
+            await response.write_eof()
+        return response
@@ -0,0 +1,189 @@
+"""
+本地模擬的 edge-tts WebSocket 服務，用於基準測試（不需要連線到 Microsoft）。
+
+每個字返回固定長度的確定性 MP3 音頻，並附帶 WordBoundary 資料。
+可選的 latency（首段音頻前的等待）和 faults（握手時以 429 / 500 拒絕）見 benchmarks/fake_service.py。
+"""
+import asyncio
+import json
+import math
+import time
+import uuid
+
+import edge_tts.communicate
+import edge_tts.voices
+import lameenc
+import regex as re
+from aiohttp import web
+
+from benchmarks.fake_service import FaultInjector, LatencyDistribution, RequestStats, timed_request
+
+SAMPLE_RATE = 24000
+FRAME_SECONDS = 576 / SAMPLE_RATE  # MPEG-2 Layer III
+TICKS_PER_SECOND = 10_000_000
+WORD_PATTERN = re.compile(r"\p{Han}|[\p{L}\p{N}]+")
+VOICES = [("zh-CN-YunxiNeural", "zh-CN"), ("zh-CN-XiaoxiaoNeural", "zh-CN"), ("en-US-GuyNeural", "en-US")]
+
+
+def make_tone_frames(seconds=30):
+    """ 24kHz 48kbps 單聲道，與 edge-tts 的輸出格式相同 """
+    encoder = lameenc.Encoder()
+    encoder.set_channels(1)
+    encoder.set_in_sample_rate(SAMPLE_RATE)
+    encoder.set_out_sample_rate(SAMPLE_RATE)
+    encoder.set_bit_rate(48)
+    encoder.set_quality(7)
+    samples = bytearray()
+    for i in range(int(SAMPLE_RATE * seconds)):
+        value = int(3000 * math.sin(2 * math.pi * 440 * i / SAMPLE_RATE))
+        samples += value.to_bytes(2, "little", signed=True)
+    return encoder.encode(bytes(samples)) + encoder.flush()
+
+
+def use_fake_edge(port):
+    """ 令 edge_tts 連接到本地服務（服務在另一個進程時也可以單獨調用） """
+    url = f"ws://127.0.0.1:{port}/edge/v1?TrustedClientToken=fake"
+    edge_tts.communicate.WSS_URL = url
+    edge_tts.voices.VOICE_LIST = f"http://127.0.0.1:{port}/edge/voices/list?trustedclienttoken=fake"
+    return url
+
+
+class FakeEdgeServer:
+    def __init__(self, handshake_latency=0.15, first_audio_latency=0.05, seconds_per_word=0.25,
+                 realtime_factor=20.0, max_concurrent_handshakes=None, capacity=None,
+                 latency: LatencyDistribution = None, faults: FaultInjector = None):
+        self.handshake_latency = handshake_latency
+        # 模擬限流：同時連線數超過 capacity 時以 429 拒絕握手（可在運行中修改）
+        self.capacity = capacity
+        # 模擬服務端同時處理握手的上限（突發大量連線時握手會排隊）
+        self.handshake_slots = asyncio.Semaphore(max_concurrent_handshakes) if max_concurrent_handshakes else None
+        self.first_audio_latency = first_audio_latency
+        self.latency = latency
+        self.faults = faults
+        self.stats = RequestStats()
+        self.seconds_per_word = seconds_per_word
+        self.realtime_factor = realtime_factor
+        self.audio = make_tone_frames()
+        self.frames_per_word = max(1, round(seconds_per_word / FRAME_SECONDS))
+        self.frame_bytes = 144  # 72 * 48000 / 24000
+        self.connections = 0
+        self.throttled = 0
+        self.handshaking = 0
+        self.active = 0
+        self.peak_active = 0
+        self.runner = None
+        self.port = None
+        self.url = None
+
+    async def start(self, port=0):
+        app = web.Application()
+        app.router.add_get("/edge/v1", self.handle)
+        app.router.add_get("/edge/voices/list", self.list_voices)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.port = port
+        self.url = use_fake_edge(port)
+        return self.url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    def reset(self):
+        self.connections = 0
+        self.throttled = 0
+        self.peak_active = 0
+        self.stats.reset()
+
+    async def list_voices(self, request):
+        return web.json_response([
+            {"Name": name, "ShortName": name, "Locale": locale, "Gender": "Male",
+             "VoiceTag": {"ContentCategories": [], "VoicePersonalities": []}}
+            for name, locale in VOICES
+        ])
+
+    async def handle(self, request):
+        if self.capacity is not None and self.active + self.handshaking >= self.capacity:
+            self.throttled += 1
+            await asyncio.sleep(self.handshake_latency / 2)
+            return web.Response(status=429, text="Too Many Requests")
+        status = self.faults.pick() if self.faults else None
+        if status:
+            self.stats.count_fault(status)
+            await asyncio.sleep(self.handshake_latency / 2)
+            return self.faults.response(status)
+        async with timed_request(self.stats):
+            return await self._handle(request)
+
+    async def _handle(self, request):
+        # 模擬 TLS + WebSocket 握手延遲
+        self.handshaking += 1
+        try:
+            if self.handshake_slots:
+                async with self.handshake_slots:
+                    await asyncio.sleep(self.handshake_latency)
+            else:
+                await asyncio.sleep(self.handshake_latency)
+            ws = web.WebSocketResponse()
+            await ws.prepare(request)
+        finally:
+            self.handshaking -= 1
+        self.connections += 1
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+        try:
+            async for message in ws:
+                if "Path:ssml" in message.data:
+                    await self.synthesize(ws, message.data)
+                    break
+        finally:
+            self.active -= 1
+        await ws.close()
+        return ws
+
+    async def synthesize(self, ws, data):
+        request_id = uuid.uuid4().hex
+        ssml = data.split("\r\n\r\n", 1)[1]
+        text = re.sub(r"<[^>]+>", "", ssml)
+        words = WORD_PATTERN.findall(edge_tts.communicate.unescape(text))
+
+        await ws.send_str(self._text_message(request_id, "turn.start", "{}"))
+        await asyncio.sleep(self.latency.sample() if self.latency else self.first_audio_latency)
+
+        started = time.perf_counter()
+        offset = 0
+        word_ticks = self.frames_per_word * FRAME_SECONDS * TICKS_PER_SECOND
+        for i, word in enumerate(words):
+            metadata = {"Metadata": [{"Type": "WordBoundary", "Data": {
+                "Offset": int(offset), "Duration": int(word_ticks * 0.8), "text": {"Text": word}}}]}
+            await ws.send_str(self._text_message(request_id, "audio.metadata", json.dumps(metadata)))
+            start = (i * self.frames_per_word * self.frame_bytes) % (len(self.audio) - self.frames_per_word * self.frame_bytes)
+            start -= start % self.frame_bytes
+            chunk = self.audio[start:start + self.frames_per_word * self.frame_bytes]
+            await ws.send_bytes(self._audio_message(request_id, chunk))
+            offset += word_ticks
+            # 以 realtime_factor 倍速「合成」
+            target = (i + 1) * self.seconds_per_word / self.realtime_factor
+            delay = target - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        await ws.send_bytes(self._audio_message(request_id, b"", content_type=None))
+        await ws.send_str(self._text_message(request_id, "turn.end", "{}"))
+
+    @staticmethod
+    def _text_message(request_id, path, body):
+        return (f"X-RequestId:{request_id}\r\nContent-Type:application/json; charset=utf-8\r\n"
+                f"Path:{path}\r\n\r\n{body}")
+
+    @staticmethod
+    def _audio_message(request_id, data, content_type="audio/mpeg"):
+        headers = f"X-RequestId:{request_id}\r\n"
+        if content_type:
+            headers += f"Content-Type:{content_type}\r\n"
+        headers += "Path:audio\r\n"
+        headers = headers.encode("utf-8")
+        return len(headers).to_bytes(2, "big") + headers + data
@@ -0,0 +1,122 @@
+"""
+本地模擬的 OpenAI 兼容服務，用於基準測試（不需要 API key）。
+
+/v1/audio/speech 按輸入長度以固定速度串流確定性的 MP3 音頻；
+/v1/chat/completions 返回由輸入內容決定的中文摘要（同樣的輸入總是得到同樣的摘要）；"stream": true 時以 SSE 逐段返回，
+各段平均分佈在同一個延遲內（最後一段到達的時間與非串流的回應相同）。
+兩者都可設定延遲分佈和 429 / 500 注入，見 benchmarks/fake_service.py。
+"""
+import asyncio
+import hashlib
+import json
+import random
+
+from aiohttp import web
+
+from benchmarks.fake_edge_server import make_tone_frames
+from benchmarks.fake_service import FaultInjector, LatencyDistribution, RequestStats, stream_frames, timed_request
+
+FRAME_BYTES = 144  # 24kHz 48kbps 單聲道的一幀
+STREAM_DELTA_CHARS = 8  # 串流回應每段的字數
+HANZI = [chr(c) for c in range(0x4e00, 0x4e00 + 3000)]
+
+
+def make_summary(text, chars=600):
+    """ 以輸入的雜湊為種子生成約 chars 字的摘要 """
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    sentences = []
+    length = 0
+    while length < chars:
+        sentence = "".join(rng.choices(HANZI, k=rng.randint(10, 30))) + rng.choice("。，；")
+        sentences.append(sentence)
+        length += len(sentence)
+    return "".join(sentences)
+
+
+class FakeOpenAIServer:
+    def __init__(self, seconds_per_char=0.2, realtime_factor=50.0, summary_chars=600,
+                 speech_latency: LatencyDistribution = None, chat_latency: LatencyDistribution = None,
+                 faults: FaultInjector = None):
+        self.seconds_per_char = seconds_per_char
+        self.realtime_factor = realtime_factor
+        self.summary_chars = summary_chars
+        self.speech_latency = speech_latency or LatencyDistribution("fixed:0.05")
+        self.chat_latency = chat_latency or LatencyDistribution("fixed:0.5")
+        self.faults = faults
+        self.speech_stats = RequestStats()
+        self.chat_stats = RequestStats()
+        self.audio = make_tone_frames()
+        self.runner = None
+        self.base_url = None
+
+    async def start(self, port=0):
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post("/v1/audio/speech", self.speech)
+        app.router.add_post("/v1/chat/completions", self.chat)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.base_url = f"http://127.0.0.1:{port}/v1"
+        return self.base_url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    def reset(self):
+        self.speech_stats.reset()
+        self.chat_stats.reset()
+
+    def _fault(self, stats):
+        status = self.faults.pick() if self.faults else None
+        if status:
+            stats.count_fault(status)
+            return self.faults.response(status)
+        return None
+
+    async def speech(self, request):
+        if fault := self._fault(self.speech_stats):
+            return fault
+        async with timed_request(self.speech_stats):
+            body = await request.json()
+            response = web.StreamResponse(headers={"Content-Type": "audio/mpeg"})
+            await response.prepare(request)
+            await asyncio.sleep(self.speech_latency.sample())
+            frames = max(1, round(len(body["input"]) * self.seconds_per_char / (FRAME_BYTES * 8 / 48000)))
+            await stream_frames(response, self.audio, FRAME_BYTES, frames * FRAME_BYTES, 48000 / 8,
+                                self.realtime_factor)
+            await response.write_eof()
+        return response
+
+    async def chat(self, request):
+        if fault := self._fault(self.chat_stats):
+            return fault
+        async with timed_request(self.chat_stats):
+            body = await request.json()
+            content = make_summary(body["messages"][-1]["content"], self.summary_chars)
+            if body.get("stream"):
+                return await self._stream_chat(request, body, content)
+            await asyncio.sleep(self.chat_latency.sample())
+            return web.json_response({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+            })
+
+    async def _stream_chat(self, request, body, content):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        deltas = [content[i:i + STREAM_DELTA_CHARS] for i in range(0, len(content), STREAM_DELTA_CHARS)]
+        interval = self.chat_latency.sample() / len(deltas)
+        for delta in deltas:
+            await asyncio.sleep(interval)
+            chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "model": body.get("model", "fake"),
+                     "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
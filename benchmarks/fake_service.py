@@ -0,0 +1,126 @@
+"""
+本地模擬服務的共用部分：可設定的延遲分佈、錯誤 / 429 注入和請求統計。
+
+隨機數都有固定種子，同樣的設定在不同提交之間得到同樣的延遲和錯誤序列，結果可以直接比較。
+"""
+import asyncio
+import math
+import random
+import time
+from contextlib import asynccontextmanager
+
+from aiohttp import web
+
+
+class LatencyDistribution:
+    """
+    延遲分佈（秒），以字串描述：
+      fixed:0.05              固定值
+      uniform:0.02:0.2        均勻分佈
+      lognormal:0.1:0.5       對數常態分佈，參數為中位數和 sigma（長尾）
+    """
+
+    def __init__(self, spec="fixed:0", seed=0):
+        self.spec = spec
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(param) for param in params]
+        expected = {"fixed": 1, "uniform": 2, "lognormal": 2}
+        if kind not in expected or len(self.params) != expected[kind]:
+            raise ValueError(f"Invalid latency distribution: {spec}")
+        self.rng = random.Random(seed)
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return self.rng.uniform(*self.params)
+        median, sigma = self.params
+        return self.rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+    def __str__(self):
+        return self.spec
+
+
+class FaultInjector:
+    """ 按比例令請求以 429 或 500 失敗 """
+
+    def __init__(self, error_rate=0.0, throttle_rate=0.0, seed=0):
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rng = random.Random(seed)
+
+    def pick(self):
+        """ 返回要回應的錯誤狀態碼，不注入錯誤時返回 None """
+        roll = self.rng.random()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return 500
+        return None
+
+    @staticmethod
+    def response(status):
+        text = "Too Many Requests" if status == 429 else "Internal Server Error"
+        return web.Response(status=status, text=text, headers={"Retry-After": "1"} if status == 429 else None)
+
+
+class RequestStats:
+    """ 服務端看到的請求數、注入的錯誤數和成功請求從收到到完成的時間 """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.latencies = []
+
+    def count_fault(self, status):
+        if status == 429:
+            self.throttled += 1
+        else:
+            self.errors += 1
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def snapshot(self) -> dict:
+        p50 = self.percentile(0.5)
+        p95 = self.percentile(0.95)
+        return {
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "errors": self.errors,
+            "p50_seconds": round(p50, 4) if p50 is not None else None,
+            "p95_seconds": round(p95, 4) if p95 is not None else None,
+        }
+
+
+@asynccontextmanager
+async def timed_request(stats: RequestStats):
+    """ 計一個請求，正常完成時記錄耗時 """
+    stats.requests += 1
+    started = time.perf_counter()
+    yield
+    stats.latencies.append(time.perf_counter() - started)
+
+
+async def stream_frames(response, audio, frame_bytes, total_bytes, byte_rate, realtime_factor, chunk_seconds=0.5):
+    """ 以 realtime_factor 倍速把 total_bytes 的確定性音頻（從 audio 循環取整幀）寫到 StreamResponse """
+    step = max(frame_bytes, int(byte_rate * chunk_seconds) // frame_bytes * frame_bytes)
+    started = time.perf_counter()
+    sent = 0
+    while sent < total_bytes:
+        size = min(step, total_bytes - sent)
+        start = sent % (len(audio) - size)
+        start -= start % frame_bytes
+        await response.write(audio[start:start + size])
+        sent += size
+        delay = sent / byte_rate / realtime_factor - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -0,0 +1,60 @@
+"""
+生成用於端到端基準測試的 EPUB：章節長短不一，內容由種子決定。
+
+    python -m benchmarks.make_epub book.epub --chapters 12
+"""
+import argparse
+import html
+import random
+
+from ebooklib import epub
+
+from benchmarks.bench_split_text import make_text
+
+
+def make_chapter_html(title, text, rng):
+    paragraphs = []
+    pos = 0
+    while pos < len(text):
+        size = rng.randint(30, 120)
+        paragraphs.append(f"<p>{html.escape(text[pos:pos + size])}</p>")
+        pos += size
+    return f"<h1>{html.escape(title)}</h1>" + "".join(paragraphs)
+
+
+def make_epub(path, chapters=12, seed=0):
+    """ 大部分是短章，每 4 章有一個超過 2000 字的長章（會生成摘要）；返回各章字數 """
+    rng = random.Random(seed)
+    book = epub.EpubBook()
+    book.set_identifier(f"bench-{seed}-{chapters}")
+    book.set_title("基準測試")
+    book.set_language("zh")
+    book.add_author("bench")
+
+    items = []
+    sizes = []
+    for i in range(chapters):
+        chars = rng.choice([2500, 4000]) if i % 4 == 0 else rng.choice([600, 1200, 1800])
+        text = make_text(chars, seed + i).replace(" @BRK#", "")
+        item = epub.EpubHtml(title=f"第{i + 1}章", file_name=f"chapter_{i + 1:03d}.xhtml", lang="zh")
+        item.content = make_chapter_html(f"第{i + 1}章", text, rng)
+        book.add_item(item)
+        items.append(item)
+        sizes.append(len(text))
+
+    book.toc = items
+    book.spine = items
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    epub.write_epub(path, book)
+    return sizes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("--chapters", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    sizes = make_epub(args.path, args.chapters, args.seed)
+    print(f"{args.path}: {len(sizes)} chapters, {sum(sizes)} chars")
@@ -0,0 +1,83 @@
+"""
+模擬 piper-tts 命令行的替身，用於基準測試（不需要安裝 piper 和下載聲音模型）。
+
+啟動時以佔用 CPU 的方式模擬載入 ONNX 模型，合成時每個字同樣佔用固定的 CPU 時間，輸出 22050Hz 16-bit 單聲道 WAV。
+支持兩種模式：
+  - 整段 stdin 文字合成到 --output_file 指定的文件（舊的每章一個進程）
+  - --json-input：每行一個 {"text": ...}，--output_file - 時每行的 WAV 依次寫到 stdout
+
+環境變量 STUB_PIPER_LOAD_SECONDS、STUB_PIPER_SECONDS_PER_CHAR 調整成本，STUB_PIPER_AUDIO_SECONDS_PER_CHAR 調整音頻長度；STUB_PIPER_LAUNCH_LOG 指定的文件每次啟動追加一行。
+"""
+import argparse
+import io
+import json
+import math
+import os
+import sys
+import time
+import wave
+
+SAMPLE_RATE = 22050
+# 每個字的音頻長度，預設比真實語速短，避免測試產生過大的文件
+AUDIO_SECONDS_PER_CHAR = float(os.environ.get("STUB_PIPER_AUDIO_SECONDS_PER_CHAR", "0.02"))
+# 一秒的 220Hz 正弦波，按需要重複
+TONE = b"".join(int(2000 * math.sin(2 * math.pi * 220 * i / SAMPLE_RATE)).to_bytes(2, "little", signed=True)
+                for i in range(SAMPLE_RATE))
+
+
+def burn(seconds):
+    """ 佔用 CPU 而不是 sleep，多個進程搶同一個核心時和真實的 piper 一樣會互相拖慢 """
+    deadline = time.process_time() + seconds
+    while time.process_time() < deadline:
+        pass
+
+
+def make_wav(text, seconds_per_char, sentence_silence):
+    burn(len(text) * seconds_per_char)
+    samples = int(SAMPLE_RATE * (len(text) * AUDIO_SECONDS_PER_CHAR + sentence_silence))
+    pcm = (TONE * (samples // SAMPLE_RATE + 1))[:samples * 2]
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--speaker")
+    parser.add_argument("--sentence_silence", type=float, default=0.2)
+    parser.add_argument("--length_scale", type=float, default=1.0)
+    parser.add_argument("--json-input", action="store_true")
+    parser.add_argument("-f", "--output_file", required=True)
+    args = parser.parse_args()
+
+    seconds_per_char = float(os.environ.get("STUB_PIPER_SECONDS_PER_CHAR", "0.0005"))
+    launch_log = os.environ.get("STUB_PIPER_LAUNCH_LOG")
+    if launch_log:
+        with open(launch_log, "a") as f:
+            f.write(f"{os.getpid()}\n")
+    burn(float(os.environ.get("STUB_PIPER_LOAD_SECONDS", "1.0")))
+
+    if not args.json_input:
+        with open(args.output_file, "wb") as f:
+            f.write(make_wav(sys.stdin.read(), seconds_per_char, args.sentence_silence))
+        return
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        wav = make_wav(json.loads(line)["text"], seconds_per_char, args.sentence_silence)
+        if args.output_file == "-":
+            sys.stdout.buffer.write(wav)
+            sys.stdout.buffer.flush()
+        else:
+            with open(args.output_file, "wb") as f:
+                f.write(wav)
+
+
+if __name__ == "__main__":
+    main()
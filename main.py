@@ -1,8 +1,12 @@
 import argparse
+import asyncio
 import logging
+import os
 
 from audiobook_generator.config.general_config import GeneralConfig
 from audiobook_generator.core.audiobook_generator import AudiobookGenerator
+from audiobook_generator.core.metrics import MetricsExporter
+from audiobook_generator.core.summary_generator import AudioSummaryGenerator
 from audiobook_generator.tts_providers.base_tts_provider import (
     get_supported_tts_providers,
 )
@@ -15,7 +19,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def handle_args():
+def handle_args(argv=None):
     parser = argparse.ArgumentParser(
         description="Convert text book to audiobook")
     parser.add_argument("input_file", help="Path to the EPUB file")
@@ -88,6 +92,32 @@ def handle_args():
         help="用註腳內容取代註腳標誌（Only for Chinese book），不可與--remove_endnotes共用。",
     )
 
+    parser.add_argument(
+        "--parse_workers",
+        default=0,
+        type=int,
+        help="Number of worker processes for parsing chapters (HTML to text, cleanup, t2s). Parsed chapters are fed to TTS as they finish, so parsing overlaps with synthesis. (default: 0, parse in the main process)",
+    )
+
+    parser.add_argument(
+        "--parser_engine",
+        choices=["soup", "lxml"],
+        default="soup",
+        help="Engine for extracting chapter titles and text. 'lxml' is a faster path built directly on lxml that gives the same output; chapters that need footnote rewriting always use 'soup'. (default: soup)",
+    )
+
+    parser.add_argument(
+        "--parse_cache_dir",
+        help="Folder for caching parsed chapters. The cache key combines the EPUB content hash with every option that affects the text, so later runs on the same book (e.g. after --preview) skip parsing. (default: no cache)",
+    )
+
+    parser.add_argument(
+        "--parse_cache_size",
+        default=512,
+        type=float,
+        help="Size limit of the parsed chapter cache in MB, least recently used books are evicted first (default: 512)",
+    )
+
     parser.add_argument(
         "--voice_name",
         help="Various TTS providers has different voice names, look up for your provider settings.",
@@ -103,6 +133,72 @@ def handle_args():
         help="Various TTS providers has different neural model names",
     )
 
+    parser.add_argument(
+        "--max_inflight_requests",
+        default=16,
+        type=int,
+        help="Maximum number of TTS requests in flight for the whole book. Segments of all chapters share this budget and chapters with the most remaining text are served first. (default: 16)",
+    )
+
+    parser.add_argument(
+        "--initial_inflight_requests",
+        default=4,
+        type=int,
+        help="Starting concurrency of the adaptive limiter. It grows by one per round of healthy requests up to --max_inflight_requests and halves on 429s, timeouts or connection failures. (default: 4)",
+    )
+
+    parser.add_argument(
+        "--fixed_concurrency",
+        action="store_true",
+        help="Always use --max_inflight_requests instead of adapting concurrency to latency and errors.",
+    )
+
+    parser.add_argument(
+        "--max_buffered_audio_mb",
+        default=64,
+        type=float,
+        help="Memory cap for synthesized audio waiting for earlier segments before it can be appended to the chapter file. When full, only segments that can be written straight to disk are sent to the TTS service. (default: 64)",
+    )
+
+    parser.add_argument(
+        "--tts_cache_dir",
+        help="Folder for caching synthesized audio segments. The key hashes the provider, voice settings, output format and segment text, so re-runs of a mostly unchanged book only synthesize the changed segments. Several runs can share the folder. (default: no cache)",
+    )
+
+    parser.add_argument(
+        "--tts_cache_size",
+        default=2048,
+        type=float,
+        help="Size limit of the synthesis cache in MB, least recently used segments are evicted first (default: 2048)",
+    )
+
+    parser.add_argument(
+        "--no_resume",
+        action="store_true",
+        help="Ignore the resume journal in the output folder and synthesize every chapter from the start. By default, chapters finished by an earlier run are skipped and an interrupted chapter continues from its first unwritten segment, as long as its text and voice settings are unchanged.",
+    )
+    parser.add_argument(
+        "--catalog",
+        help="Path of a SQLite library catalog. When set, the EPUB hash and each chapter's title, character counts, text hash, audio and summary status are recorded at parse time, and summary generation queries it instead of reading every chapter file. auto_ebook.py keeps one for the whole library. (default: none)",
+    )
+
+    parser.add_argument(
+        "--metrics_textfile",
+        help="Write pipeline metrics (parse time, segments, request latency histograms, retries, bytes written, cache hits, queue depth) in the Prometheus text format to this file, for node_exporter's textfile collector. Rewritten atomically every --metrics_interval seconds and at the end of the run. (default: off)",
+    )
+
+    parser.add_argument(
+        "--metrics_json",
+        help="Write a JSON summary of the same metrics for this book to this file when the run ends. (default: off)",
+    )
+
+    parser.add_argument(
+        "--metrics_interval",
+        default=15,
+        type=float,
+        help="Seconds between rewrites of --metrics_textfile (default: 15)",
+    )
+
     parser.add_argument(
         "--test_mode",
         action="store_true",
@@ -139,6 +235,85 @@ def handle_args():
         help="Proxy server for the TTS provider. Format: http://[username:password@]proxy.server:port",
     )
 
+    edge_tts_group.add_argument(
+        "--edge_pack_chars",
+        default=0,
+        type=int,
+        help="Merge consecutive paragraphs into requests of up to this many characters (capped at the service limit of one request) instead of one request per paragraph. Paragraph pauses are spliced back in at the word boundaries reported by the service. (default: 0, one request per paragraph)",
+    )
+
+    openai_tts_group = parser.add_argument_group(title="openai specific")
+    openai_tts_group.add_argument(
+        "--ttsfm",
+        action="store_true",
+        help="Use a ttsfm (OpenAI compatible) endpoint for OpenAI TTS.",
+    )
+
+    openai_tts_group.add_argument(
+        "--instructions",
+        help="Voice instructions for OpenAI TTS models that support them.",
+    )
+
+    piper_tts_group = parser.add_argument_group(title="piper specific")
+    piper_tts_group.add_argument(
+        "--piper_workers",
+        type=int,
+        help="Number of long-lived piper-tts processes that keep the voice model loaded. Chapters are split into parts that are spread over the workers. (default: number of CPU cores)",
+    )
+
+    summary_group = parser.add_argument_group(title="summary specific")
+    summary_group.add_argument(
+        "--sum_url",
+        help="Base URL of the OpenAI compatible chat/completions API used for chapter summaries.",
+    )
+
+    summary_group.add_argument(
+        "--sum_api",
+        help="API key for the summary LLM. Chapter summaries are generated only when this is set.",
+    )
+
+    summary_group.add_argument(
+        "--sum_model",
+        help="Model name for the summary LLM.",
+    )
+
+    summary_group.add_argument(
+        "--sum_only",
+        action="store_true",
+        help="Only generate chapter summaries (and their audio) from existing chapter text files.",
+    )
+
+    summary_group.add_argument(
+        "--sum_tts_workers",
+        type=int,
+        default=4,
+        help="Number of summaries synthesized at the same time. Each summary is sent to TTS as soon as its LLM response arrives instead of after all summaries are generated; at most twice this many finished summaries wait for a worker. (default: 4)",
+    )
+
+    summary_group.add_argument(
+        "--sum_cache_dir",
+        help="Folder for caching chapter summaries. The key hashes the summary prompt, model, temperature and chapter text, so a chapter that was already summarized (in another folder, an earlier edition or a duplicate upload) does not call the LLM again. Several runs can share the folder. (default: no cache)",
+    )
+
+    summary_group.add_argument(
+        "--sum_cache_size",
+        default=64,
+        type=float,
+        help="Size limit of the summary cache in MB, least recently used summaries are evicted first (default: 64)",
+    )
+
+    summary_group.add_argument(
+        "--sum_cache_max_age",
+        type=float,
+        help="Days after which a cached summary is generated again, e.g. to pick up model updates. (default: no age limit)",
+    )
+
+    summary_group.add_argument(
+        "--sum_stream",
+        action="store_true",
+        help="Stream the LLM response (SSE) and start synthesizing each summary sentence by sentence while the model is still generating; the summary audio is assembled in order and the .txt is written when the response is complete. Piper collects the whole summary first.",
+    )
+
     azure_edge_tts_group = parser.add_argument_group(
         title="azure/edge specific")
     azure_edge_tts_group.add_argument(
@@ -147,14 +322,24 @@ def handle_args():
         help="Break duration in milliseconds for the different paragraphs or sections (default: 1250, means 1.25 s). Valid values range from 0 to 5000 milliseconds for Azure TTS.",
     )
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     return GeneralConfig(args)
 
 
+async def async_main(config):
+    async with MetricsExporter(config.metrics_textfile, config.metrics_json, config.metrics_interval,
+                               book=os.path.basename(config.input_file), tts=config.tts):
+        if not config.sum_only:
+            await AudiobookGenerator(config).run()
+
+        if config.sum_api and not config.preview:
+            await AudioSummaryGenerator(config).run()
+
+
 def main():
     config = handle_args()
     logger.setLevel(config.log)
-    AudiobookGenerator(config).run()
+    asyncio.run(async_main(config))
 
 
 if __name__ == "__main__":